@@ -10,6 +10,9 @@ from aiogram.types import BotCommand
 from utils.logger import logger
 
 from core.scheduler import start_scheduler
+from core.http_client import close_http_client
+from core.report_service import shutdown_report_service
+from utils.delivery import start_delivery, stop_delivery
 
 async def set_commands(bot: Bot):
     commands = [
@@ -40,6 +43,9 @@ async def main():
     # Регистрируем все хендлеры
     register_all_handlers(dp)
 
+    # Очередь исходящих уведомлений (воркеры отправки в Telegram)
+    start_delivery(bot)
+
     # Запускаем планировщик
     start_scheduler(bot)
 
@@ -47,7 +53,15 @@ async def main():
     await set_commands(bot)
 
     # Запускаем поллинг (опрос)
-    await dp.start_polling(bot)
+    try:
+        await dp.start_polling(bot)
+    finally:
+        # Дожидаемся отправки уже поставленных в очередь сообщений
+        await stop_delivery()
+        # Закрываем общие пулы соединений к WB
+        await close_http_client()
+        # Останавливаем процессы-сборщики отчётов
+        shutdown_report_service()
 
     # Запускаем лонг поллинг
     logger.info("Какое-то информационное сообщение")
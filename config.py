@@ -11,6 +11,79 @@ DB_USER = os.getenv("DB_USER", "postgres")
 DB_PASSWORD = os.getenv("DB_PASSWORD", "admin")
 DB_NAME = os.getenv("DB_NAME", "WB_Wizard_db")
 
+# Пул HTTP-соединений к API Wildberries (core/http_client.py)
+WB_HTTP_POOL_LIMIT = int(os.getenv("WB_HTTP_POOL_LIMIT", "100"))         # всего соединений на хост-пул
+WB_HTTP_LIMIT_PER_HOST = int(os.getenv("WB_HTTP_LIMIT_PER_HOST", "30"))  # одновременных соединений к хосту
+WB_HTTP_DNS_TTL = int(os.getenv("WB_HTTP_DNS_TTL", "300"))               # кэш DNS, сек
+WB_HTTP_KEEPALIVE = float(os.getenv("WB_HTTP_KEEPALIVE", "30"))          # keep-alive простаивающих соединений, сек
+WB_HTTP_TIMEOUT = float(os.getenv("WB_HTTP_TIMEOUT", "60"))              # общий таймаут запроса по умолчанию, сек
+
+# Параллельный опрос токенов в цикле проверки (core/token_executor.py)
+TOKEN_CONCURRENCY = int(os.getenv("TOKEN_CONCURRENCY", "10"))   # сколько токенов опрашиваем одновременно
+TOKEN_TIMEOUT = float(os.getenv("TOKEN_TIMEOUT", "90"))          # лимит на обработку одного токена, сек
+
+# Пул соединений с PostgreSQL (db/database.py)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "20"))        # постоянных соединений (не меньше TOKEN_CONCURRENCY)
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))  # сверх пула в пиках (обработчики, шедулер)
+DB_POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", "30"))  # сколько ждать свободного соединения, сек
+
+# Очередь исходящих сообщений в Telegram (utils/delivery.py)
+DELIVERY_WORKERS = int(os.getenv("DELIVERY_WORKERS", "8"))                  # воркеров отправки
+DELIVERY_GLOBAL_RATE = float(os.getenv("DELIVERY_GLOBAL_RATE", "25"))       # сообщений в секунду на бота (лимит TG ~30)
+DELIVERY_CHAT_INTERVAL = float(os.getenv("DELIVERY_CHAT_INTERVAL", "1.0"))  # пауза между сообщениями в один чат, сек
+DELIVERY_MAX_ATTEMPTS = int(os.getenv("DELIVERY_MAX_ATTEMPTS", "5"))        # попыток на сообщение
+
+# Кэш карточек card.wb.ru для уведомлений (core/card_cache.py)
+CARD_CACHE_TTL = int(os.getenv("CARD_CACHE_TTL", "1800"))              # через сколько секунд карточка считается устаревшей
+CARD_CACHE_BATCH = int(os.getenv("CARD_CACHE_BATCH", "100"))           # nm_id в одном запросе nm=a;b;c
+CARD_CACHE_MAX_SIZE = int(os.getenv("CARD_CACHE_MAX_SIZE", "50000"))   # максимум карточек в памяти
+CARD_CACHE_REFRESH_MIN = int(os.getenv("CARD_CACHE_REFRESH_MIN", "10"))  # период фонового обновления, мин
+
+# Поиск позиций товаров в выдаче search.wb.ru (core/search_pages.py)
+SEARCH_PROBE_WINDOW = int(os.getenv("SEARCH_PROBE_WINDOW", "3"))   # страниц в одном окне адаптивного поиска
+
+# Общий регулятор запросов к search.wb.ru (core/search_governor.py)
+SEARCH_RATE = float(os.getenv("SEARCH_RATE", "10"))                    # стартовый темп, запросов/сек на процесс
+SEARCH_RATE_MIN = float(os.getenv("SEARCH_RATE_MIN", "1"))             # ниже не опускаемся после 429
+SEARCH_RATE_MAX = float(os.getenv("SEARCH_RATE_MAX", "30"))            # выше не разгоняемся
+SEARCH_RATE_STEP = float(os.getenv("SEARCH_RATE_STEP", "0.5"))         # прирост темпа за секунду без 429
+SEARCH_RATE_DECREASE = float(os.getenv("SEARCH_RATE_DECREASE", "0.5")) # множитель темпа при 429
+SEARCH_BACKOFF_BASE = float(os.getenv("SEARCH_BACKOFF_BASE", "5"))     # первая пауза после 429, сек (дальше ×2)
+SEARCH_BACKOFF_MAX = float(os.getenv("SEARCH_BACKOFF_MAX", "300"))     # максимальная пауза, сек
+SEARCH_MAX_INFLIGHT = int(os.getenv("SEARCH_MAX_INFLIGHT", "20"))      # запросов в полёте одновременно
+SEARCH_MAX_ATTEMPTS = int(os.getenv("SEARCH_MAX_ATTEMPTS", "5"))       # попыток на страницу при 429
+
+# Возобновляемые обходы выдачи (core/crawl_state.py)
+CRAWL_RUN_MAX_AGE_HOURS = float(os.getenv("CRAWL_RUN_MAX_AGE_HOURS", "24"))  # незавершённый обход старше — не продолжаем, начинаем заново
+
+# Загрузка картинок товаров (core/image_pipeline.py)
+IMAGE_FETCH_CONCURRENCY = int(os.getenv("IMAGE_FETCH_CONCURRENCY", "10"))    # одновременных скачиваний
+IMAGE_FETCH_TIMEOUT = float(os.getenv("IMAGE_FETCH_TIMEOUT", "10"))          # таймаут скачивания одной картинки, сек
+IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", "4"))                         # потоков для декодирования/ресайза
+IMAGE_WRITE_BATCH = int(os.getenv("IMAGE_WRITE_BATCH", "50"))                # картинок в одной записи в БД
+PRODUCT_ONBOARD_CONCURRENCY = int(os.getenv("PRODUCT_ONBOARD_CONCURRENCY", "8"))  # новых товаров, разбираемых параллельно
+
+# Поиск хоста CDN с картинками товара (core/basket_hosts.py)
+BASKET_PROBE_TIMEOUT = float(os.getenv("BASKET_PROBE_TIMEOUT", "3"))   # таймаут одного HEAD, сек
+BASKET_MAX_HOST = int(os.getenv("BASKET_MAX_HOST", "40"))             # перебираем basket-01 ... basket-NN
+BASKET_CDN_HOSTS = int(os.getenv("BASKET_CDN_HOSTS", "18"))           # и nsk-basket-cdn-01 ... -NN
+
+# Сборка Excel-отчётов в отдельных процессах (core/report_service.py)
+REPORT_WORKERS = int(os.getenv("REPORT_WORKERS", "2"))                    # процессов-сборщиков
+REPORT_TIMEOUT = float(os.getenv("REPORT_TIMEOUT", "600"))                # лимит времени на один отчёт, сек
+REPORT_MAX_MEMORY_MB = int(os.getenv("REPORT_MAX_MEMORY_MB", "2048"))     # лимит памяти процесса-сборщика, МБ (0 — без лимита)
+REPORT_MAX_TASKS_PER_CHILD = int(os.getenv("REPORT_MAX_TASKS_PER_CHILD", "20"))  # после скольких отчётов процесс перезапускается
+
+# Кэш готовых отчётов на диске (core/report_cache.py)
+REPORT_CACHE_DIR = os.getenv("REPORT_CACHE_DIR", "report_cache")              # каталог с готовыми файлами
+REPORT_CACHE_MAX_MB = int(os.getenv("REPORT_CACHE_MAX_MB", "500"))            # предел размера кэша, МБ (вытесняем давно не читанные)
+REPORT_CACHE_TTL = int(os.getenv("REPORT_CACHE_TTL", "1800"))                 # файл старше — собираем заново, сек
+
+# Ежедневные отчёты (utils/notifications.py, core/scheduler.py)
+DAILY_REPORT_PREBUILD_HOUR = int(os.getenv("DAILY_REPORT_PREBUILD_HOUR", "8"))      # во сколько собираем заранее (до рассылки в 9:00);
+DAILY_REPORT_PREBUILD_MINUTE = int(os.getenv("DAILY_REPORT_PREBUILD_MINUTE", "0"))  # это же время — конец периода отчёта
+DAILY_REPORT_CACHE_TTL = int(os.getenv("DAILY_REPORT_CACHE_TTL", "10800"))          # сколько собранный заранее отчёт ждёт рассылки, сек
+
 YANDEX_MERCHANT_ID = os.getenv("YANDEX_MERCHANT_ID")
 YANDEX_SECRET_KEY = os.getenv("YANDEX_SECRET_KEY")
 ...
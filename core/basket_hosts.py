@@ -0,0 +1,169 @@
+# core/basket_hosts.py
+import asyncio
+import bisect
+
+import aiohttp
+from sqlalchemy.dialects.postgresql import insert
+
+from config import BASKET_PROBE_TIMEOUT, BASKET_MAX_HOST, BASKET_CDN_HOSTS
+from core.http_client import get_http_client
+from db.database import SessionLocal
+from db.models import BasketHost
+from utils.logger import logger
+
+
+def _fallback_host(vol: int) -> str:
+    """Стартовая догадка по диапазонам vol (актуальны на май-2025), пока карта пустая."""
+    if   vol <=  143: n = 1
+    elif vol <=  287: n = 2
+    elif vol <=  431: n = 3
+    elif vol <=  719: n = 4
+    elif vol <= 1007: n = 5
+    elif vol <= 1061: n = 6
+    elif vol <= 1115: n = 7
+    elif vol <= 1169: n = 8
+    elif vol <= 1313: n = 9
+    elif vol <= 1601: n = 10
+    elif vol <= 1655: n = 11
+    elif vol <= 1919: n = 12
+    elif vol <= 2045: n = 13
+    elif vol <= 2189: n = 14
+    elif vol <= 2405: n = 15
+    elif vol <= 2621: n = 16
+    elif vol <= 2837: n = 17
+    elif vol == 4118: n = 23
+    else:             n = 18
+    return f"basket-{n:02}.wbbasket.ru"
+
+
+def candidate_hosts() -> list[str]:
+    """Все хосты, среди которых ищем картинку, если догадка не подошла."""
+    return (
+        [f"basket-{n:02}.wbbasket.ru" for n in range(1, BASKET_MAX_HOST + 1)]
+        + [f"nsk-basket-cdn-{n:02}.geobasket.ru" for n in range(1, BASKET_CDN_HOSTS + 1)]
+    )
+
+
+def image_url(host: str, nm_id: int, size: str = "big", n: int = 1) -> str:
+    vol = nm_id // 100_000
+    part = nm_id // 1_000
+    return f"https://{host}/vol{vol}/part{part}/{nm_id}/images/{size}/{n}.webp"
+
+
+async def image_exists(url: str) -> bool:
+    """HEAD через общий пул соединений; любые сетевые ошибки — «нет»."""
+    try:
+        timeout = aiohttp.ClientTimeout(total=BASKET_PROBE_TIMEOUT)
+        async with get_http_client().head(url, timeout=timeout) as resp:
+            return resp.status == 200
+    except (aiohttp.ClientError, asyncio.TimeoutError):
+        return False
+
+
+class BasketHostMap:
+    """
+    Карта vol -> хост CDN, сохраняемая в таблице basket_hosts.
+
+    Для vol без записи берём хост ближайшего известного vol снизу
+    (корзины WB раздаются диапазонами vol), а если карта пуста —
+    стартовую догадку _fallback_host(). Промах — параллельный HEAD по всем
+    хостам, первый ответ 200 побеждает и записывается в карту.
+    """
+
+    def __init__(self):
+        self._hosts: dict[int, str] = {}
+        self._vols: list[int] = []   # отсортированные ключи _hosts
+        self._loaded = False
+
+    def _load(self) -> None:
+        if self._loaded:
+            return
+        session = SessionLocal()
+        try:
+            self._hosts = dict(session.query(BasketHost.vol, BasketHost.host).all())
+        finally:
+            session.close()
+        self._vols = sorted(self._hosts)
+        self._loaded = True
+        logger.info(f"[basket] загружено {len(self._hosts)} записей vol -> хост")
+
+    def guess(self, vol: int) -> str:
+        self._load()
+        host = self._hosts.get(vol)
+        if host:
+            return host
+        i = bisect.bisect_right(self._vols, vol)
+        if i:
+            return self._hosts[self._vols[i - 1]]
+        return _fallback_host(vol)
+
+    def remember(self, vol: int, host: str) -> None:
+        """Запоминает хост для vol (в памяти и в БД), если он новый или поменялся."""
+        if self._hosts.get(vol) == host:
+            return
+        if vol not in self._hosts:
+            bisect.insort(self._vols, vol)
+        self._hosts[vol] = host
+
+        session = SessionLocal()
+        try:
+            stmt = insert(BasketHost.__table__).values(vol=vol, host=host)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=["vol"],
+                set_={"host": stmt.excluded.host, "updated_at": stmt.excluded.updated_at},
+            )
+            session.execute(stmt)
+            session.commit()
+        except Exception as e:
+            session.rollback()
+            logger.warning(f"[basket] не удалось сохранить vol={vol} -> {host}: {e}")
+        finally:
+            session.close()
+
+    async def _probe(self, nm_id: int, hosts: list[str], size: str, n: int) -> str | None:
+        """Параллельный HEAD по hosts; возвращает первый хост с ответом 200, остальные отменяем."""
+        tasks = {
+            asyncio.create_task(image_exists(image_url(host, nm_id, size, n))): host
+            for host in hosts
+        }
+        try:
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.result():
+                        return tasks[task]
+            return None
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def resolve(self, nm_id: int, size: str = "big", n: int = 1) -> str | None:
+        """URL картинки товара или None, если её нет ни на одном хосте."""
+        vol = nm_id // 100_000
+        host = self.guess(vol)
+        if await image_exists(image_url(host, nm_id, size, n)):
+            self.remember(vol, host)
+            return image_url(host, nm_id, size, n)
+
+        found = await self._probe(nm_id, [h for h in candidate_hosts() if h != host], size, n)
+        if found is None:
+            logger.info(f"[basket] nm_id={nm_id}: картинка не найдена ни на одном хосте")
+            return None
+        logger.info(f"[basket] vol={vol}: {host} -> {found}")
+        self.remember(vol, found)
+        return image_url(found, nm_id, size, n)
+
+
+_map: BasketHostMap | None = None
+
+
+def get_basket_host_map() -> BasketHostMap:
+    global _map
+    if _map is None:
+        _map = BasketHostMap()
+    return _map
+
+
+async def resolve_image_url(nm_id: int, size: str = "big", n: int = 1) -> str | None:
+    return await get_basket_host_map().resolve(nm_id, size, n)
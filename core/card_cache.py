@@ -0,0 +1,136 @@
+# core/card_cache.py
+import asyncio
+import time
+
+from config import CARD_CACHE_TTL, CARD_CACHE_BATCH, CARD_CACHE_MAX_SIZE
+from core.wildberries_api import get_cards_batch
+from db.database import SessionLocal
+from db.models import Product
+from utils.logger import logger
+
+
+class CardCache:
+    """
+    TTL-кэш карточек card.wb.ru (promoTextCard, рейтинг, отзывы) по nm_id.
+
+    Чтение (get) никогда не ходит в сеть: отдаёт то, что есть (в том числе
+    устаревшее), а недостающие/устаревшие nm_id догружает в фоне пачками
+    по CARD_CACHE_BATCH штук (nm=a;b;c). Плюс периодический refresh_all()
+    из планировщика прогревает кэш для всех товаров из products.
+    """
+
+    def __init__(self, ttl: int = CARD_CACHE_TTL, batch: int = CARD_CACHE_BATCH, max_size: int = CARD_CACHE_MAX_SIZE):
+        self.ttl = ttl
+        self.batch = max(1, batch)
+        self.max_size = max_size
+        self._data: dict[int, tuple[dict, float]] = {}   # nm_id -> (карточка, когда загружена)
+        self._pending: set[int] = set()                   # ждут фоновой загрузки
+        self._task: asyncio.Task | None = None
+
+    def _is_fresh(self, nm_id: int, now: float) -> bool:
+        entry = self._data.get(nm_id)
+        return entry is not None and now - entry[1] < self.ttl
+
+    def get(self, nm_id: int) -> dict | None:
+        """
+        Карточка из кэша или None. Если её нет или она устарела —
+        ставим nm_id на фоновую загрузку, но сами не ждём.
+        """
+        entry = self._data.get(nm_id)
+        if entry is None or time.monotonic() - entry[1] >= self.ttl:
+            self.want([nm_id])
+        return entry[0] if entry else None
+
+    def want(self, nm_ids) -> None:
+        """Ставит недостающие/устаревшие nm_id на фоновую загрузку."""
+        now = time.monotonic()
+        missing = {nm_id for nm_id in nm_ids if nm_id and not self._is_fresh(nm_id, now)}
+        if not missing:
+            return
+        self._pending |= missing
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._drain_pending())
+
+    async def _drain_pending(self) -> None:
+        while self._pending:
+            nm_ids = list(self._pending)
+            self._pending.clear()
+            await self.refresh(nm_ids)
+            if not self._pending.isdisjoint(nm_ids):
+                # WB не ответил — не долбим его в цикле, повторим при следующем want()/refresh_all()
+                break
+
+    async def refresh(self, nm_ids) -> int:
+        """
+        Загружает карточки пачками nm=a;b;c. Возвращает, сколько карточек обновили.
+        Если запрос пачки не удался, старые записи не трогаем, а её nm_id
+        оставляем в очереди на повтор.
+        """
+        nm_ids = list(dict.fromkeys(nm_ids))
+        updated = 0
+        for i in range(0, len(nm_ids), self.batch):
+            chunk = nm_ids[i:i + self.batch]
+            cards = await get_cards_batch(chunk)
+            if cards is None:
+                self._pending.update(chunk)
+                continue
+            now = time.monotonic()
+            for nm_id in chunk:
+                # Товар, которого WB не вернул, тоже кэшируем (пустой карточкой),
+                # чтобы не запрашивать его на каждое уведомление
+                card = cards.get(nm_id, {"promo_text": "", "rating": None, "feedbacks": None})
+                self._data[nm_id] = (card, now)
+            updated += len(cards)
+        self._evict()
+        return updated
+
+    async def refresh_all(self) -> None:
+        """
+        Фоновое обновление: все товары из products плюс то, что уже лежит в кэше,
+        но только устаревшие записи.
+        """
+        session = SessionLocal()
+        try:
+            nm_ids = {nm_id for (nm_id,) in session.query(Product.nm_id).all()}
+        finally:
+            session.close()
+
+        nm_ids |= set(self._data.keys())
+        now = time.monotonic()
+        stale = [nm_id for nm_id in nm_ids if not self._is_fresh(nm_id, now)]
+        if not stale:
+            return
+        updated = await self.refresh(stale)
+        logger.info(f"[card_cache] обновлено карточек: {updated} из {len(stale)}")
+
+    def _evict(self) -> None:
+        """Если кэш разросся — выкидываем самые старые записи."""
+        overflow = len(self._data) - self.max_size
+        if overflow <= 0:
+            return
+        oldest = sorted(self._data.items(), key=lambda kv: kv[1][1])[:overflow]
+        for nm_id, _ in oldest:
+            self._data.pop(nm_id, None)
+
+
+_cache: CardCache | None = None
+
+
+def get_card_cache() -> CardCache:
+    global _cache
+    if _cache is None:
+        _cache = CardCache()
+    return _cache
+
+
+def get_cached_card(nm_id: int) -> dict:
+    """
+    Карточка для уведомления без ожидания сети: {"promo_text", "rating", "feedbacks"}.
+    Пока карточки нет в кэше — пустые значения.
+    """
+    return get_card_cache().get(nm_id) or {"promo_text": "", "rating": None, "feedbacks": None}
+
+
+async def refresh_card_cache() -> None:
+    """Задача для планировщика."""
+    await get_card_cache().refresh_all()
@@ -0,0 +1,99 @@
+# core/crawl_state.py
+import datetime
+
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+
+from config import CRAWL_RUN_MAX_AGE_HOURS
+from db.database import SessionLocal
+from db.models import CrawlRun, CrawlUnit
+from utils.logger import logger
+
+
+def unit_key(*parts) -> str:
+    """
+    Ключ единицы работы обхода, например unit_key(city_id, query_text) -> "3:кружка".
+    Двоеточие может встретиться только в последней части (тексте запроса),
+    поэтому ключ однозначен.
+    """
+    return ":".join(str(p) for p in parts)
+
+
+def start_or_resume_run(session: Session, kind: str, total_units: int | None = None,
+                        max_age_hours: float = CRAWL_RUN_MAX_AGE_HOURS) -> CrawlRun:
+    """
+    Незавершённый обход вида kind, если он есть и не слишком старый, иначе — новый.
+    Слишком старый незавершённый обход помечаем abandoned: его данные
+    уже неактуальны, продолжать его нет смысла.
+    """
+    now = datetime.datetime.utcnow()
+    run = (
+        session.query(CrawlRun)
+        .filter_by(kind=kind, status="running")
+        .order_by(CrawlRun.id.desc())
+        .first()
+    )
+
+    if run is not None and now - run.started_at > datetime.timedelta(hours=max_age_hours):
+        logger.info(f"[crawl] обход {kind} id={run.id} начат {run.started_at}, слишком старый — начинаем заново")
+        run.status = "abandoned"
+        run.finished_at = now
+        run = None
+
+    if run is None:
+        run = CrawlRun(kind=kind, status="running", total_units=total_units, done_units=0, started_at=now)
+        session.add(run)
+    else:
+        logger.info(f"[crawl] продолжаем обход {kind} id={run.id}: выполнено {run.done_units} из {run.total_units}")
+        if total_units is not None:
+            run.total_units = total_units
+
+    session.commit()
+    return run
+
+
+def has_unfinished_run(kind: str) -> bool:
+    """
+    Есть ли прерванный (running) обход вида kind — например, бот упал или
+    перезапустился посреди обхода. Шедулер по нему сразу продолжает обход,
+    не дожидаясь очередного планового запуска.
+    """
+    session = SessionLocal()
+    try:
+        return session.query(CrawlRun.id).filter_by(kind=kind, status="running").first() is not None
+    finally:
+        session.close()
+
+
+def completed_units(session: Session, run: CrawlRun) -> set[str]:
+    """Ключи уже выполненных единиц работы обхода."""
+    return {key for (key,) in session.query(CrawlUnit.unit_key).filter_by(run_id=run.id).all()}
+
+
+def mark_units_done(session: Session, run: CrawlRun, keys) -> None:
+    """
+    Отмечает единицы работы выполненными и двигает курсор прогресса.
+    Коммит делает вызывающий — вместе с результатами этих единиц,
+    чтобы отметка не появилась без данных (и наоборот).
+    """
+    keys = list(dict.fromkeys(keys))
+    if not keys:
+        return
+
+    now = datetime.datetime.utcnow()
+    stmt = (
+        insert(CrawlUnit.__table__)
+        .values([{"run_id": run.id, "unit_key": key, "completed_at": now} for key in keys])
+        .on_conflict_do_nothing(index_elements=["run_id", "unit_key"])
+        .returning(CrawlUnit.__table__.c.id)
+    )
+    inserted = len(session.execute(stmt).fetchall())
+    run.done_units = (run.done_units or 0) + inserted
+
+
+def finish_run(session: Session, run: CrawlRun) -> None:
+    """Обход завершён — следующий запуск начнёт новый."""
+    run.status = "finished"
+    run.finished_at = datetime.datetime.utcnow()
+    session.commit()
+    logger.info(f"[crawl] обход {run.kind} id={run.id} завершён: {run.done_units} единиц")
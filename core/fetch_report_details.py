@@ -1,73 +1,119 @@
 import datetime
+from sqlalchemy import func
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.orm import Session
 from db.database import SessionLocal
 from db.models import ReportDetails, Token
 from core.wildberries_api import fetch_full_report
+from core.token_executor import run_for_tokens
 from utils.token_utils import get_active_tokens
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Сколько строк отправляем одним INSERT (8 колонок × 5000 < лимита параметров PostgreSQL)
+INSERT_CHUNK = 5000
+
 async def save_report_details():
     """
     Сохраняет данные из API Wildberries в таблицу `report_details` для всех токенов.
+    Токены обрабатываются параллельно (см. core.token_executor).
+    Качаем только строки после последнего сохранённого rrd_id токена,
+    а вставка идёт через INSERT ... ON CONFLICT DO NOTHING, поэтому повторный
+    запуск не плодит дубликаты.
     """
-    session = SessionLocal()
-
-    try:
-        tokens_list = get_active_tokens(session)
-        if not tokens_list:
-            logger.info("[report_details] Активных токенов нет — выходим.")
-            return
-       
+    tokens_list = get_active_tokens()
+    if not tokens_list:
+        logger.info("[report_details] Активных токенов нет — выходим.")
+        return
 
-        # 2) Для каждого токена качаем отчёт за нужный период, сохраняем
-        period_days = 30
-        end_date = datetime.date.today()
-        start_date = end_date - datetime.timedelta(days=period_days)
-        date_from_str = start_date.isoformat()
-        date_to_str = end_date.isoformat()
+    # 2) Для каждого токена качаем отчёт за нужный период, сохраняем
+    period_days = 30
+    end_date = datetime.date.today()
+    start_date = end_date - datetime.timedelta(days=period_days)
+    date_from_str = start_date.isoformat()
+    date_to_str = end_date.isoformat()
 
-        total_inserted = 0
-        total_skipped = 0
+    results = await run_for_tokens(
+        tokens_list,
+        lambda token_obj: _save_token_report_details(token_obj, date_from_str, date_to_str),
+        label="report_details",
+    )
 
-        for token_obj in tokens_list:
-            user_token = token_obj.token_value
+    total_inserted = sum(inserted for inserted, _ in results)
+    total_skipped = sum(skipped for _, skipped in results)
 
-            # 3) Запрашиваем данные из API
-            report_data = await fetch_full_report(date_from_str, date_to_str, user_token)
-            if not report_data:
-                print(f"Нет данных для token_id={token_obj.id} ({user_token})")
-                continue
+    print(f"[ИТОГО] Добавлено {total_inserted} записей, пропущено {total_skipped}")
 
-            count_inserted_this_token = 0
-            count_skipped_this_token = 0
+def get_last_rrd_id(session: Session, token_id: int) -> int:
+    """
+    Максимальный сохранённый rrd_id токена (0 — если строк ещё нет).
+    """
+    last_rrd_id = (
+        session.query(func.max(ReportDetails.rrd_id))
+        .filter(ReportDetails.token_id == token_id)
+        .scalar()
+    )
+    return last_rrd_id or 0
 
-            for entry in report_data:
+def insert_report_rows(session: Session, token_id: int, report_data: list[dict]) -> int:
+    """
+    Пачками вставляет строки отчёта, пропуская уже сохранённые (token_id, rrd_id).
+    Возвращает количество реально добавленных строк. Коммит — на вызывающем.
+    """
+    rows = [
+        {
+            "token_id": token_id,
+            "rrd_id": entry["rrd_id"],
+            "create_dt": entry["create_dt"],
+            "nm_id": entry["nm_id"],
+            "office_name": entry["office_name"],
+            "order_dt": entry["order_dt"],
+            "commission_percent": entry["commission_percent"],
+            "report_type": entry["report_type"],
+        }
+        for entry in report_data
+        if entry.get("rrd_id")
+    ]
 
-                # Создаём объект ReportDetails, включая token_id
-                report_detail = ReportDetails(
-                    create_dt=entry["create_dt"],
-                    nm_id=entry["nm_id"],
-                    office_name=entry["office_name"],
-                    order_dt=entry["order_dt"],
-                    commission_percent=entry["commission_percent"],
-                    report_type=entry["report_type"]
-                )
-                session.add(report_detail)
-                count_inserted_this_token += 1
+    inserted = 0
+    for i in range(0, len(rows), INSERT_CHUNK):
+        stmt = (
+            insert(ReportDetails)
+            .values(rows[i:i + INSERT_CHUNK])
+            .on_conflict_do_nothing(constraint="uq_report_details_token_rrd")
+            .returning(ReportDetails.id)
+        )
+        inserted += len(session.execute(stmt).fetchall())
+    return inserted
 
-            session.commit()
+async def _save_token_report_details(token_obj: Token, date_from_str: str, date_to_str: str) -> tuple[int, int]:
+    """
+    Качает и сохраняет новые строки отчёта одного токена в собственной сессии.
+    Возвращает (добавлено, пропущено).
+    """
+    user_token = token_obj.token_value
 
-            total_inserted += count_inserted_this_token
-            total_skipped += count_skipped_this_token
+    session: Session = SessionLocal()
+    try:
+        last_rrd_id = get_last_rrd_id(session, token_obj.id)
+        # Не держим транзакцию открытой, пока ждём WB
+        session.rollback()
 
-            print(
-                f"Token {token_obj.id}: добавлено {count_inserted_this_token}, "
-                f"пропущено {count_skipped_this_token}"
-            )
+        # 3) Запрашиваем из API только строки после last_rrd_id
+        report_data = await fetch_full_report(date_from_str, date_to_str, user_token, rrdid=last_rrd_id)
+        if not report_data:
+            logger.debug(f"[report_details] token_id={token_obj.id}: новых строк нет (rrd_id > {last_rrd_id})")
+            return 0, 0
 
-        session.close()
-        print(f"[ИТОГО] Добавлено {total_inserted} записей, пропущено {total_skipped}")
+        count_inserted_this_token = insert_report_rows(session, token_obj.id, report_data)
+        count_skipped_this_token = len(report_data) - count_inserted_this_token
+        session.commit()
     finally:
-        session.close()
\ No newline at end of file
+        session.close()
+
+    print(
+        f"Token {token_obj.id}: добавлено {count_inserted_this_token}, "
+        f"пропущено {count_skipped_this_token}"
+    )
+    return count_inserted_this_token, count_skipped_this_token
@@ -5,6 +5,7 @@ from typing import List, Dict
 from db.database import SessionLocal
 from db.models import Order, Token, User
 from core.wildberries_api import get_orders  # или где у вас функция get_orders
+from db.bulk import bulk_upsert
 from sqlalchemy.orm import Session
 
 async def fill_orders(date_from_str: str, telegram_id: str):
@@ -28,9 +29,7 @@ async def fill_orders(date_from_str: str, telegram_id: str):
         session.close()
         return
 
-    count_new = 0
-    count_updated = 0
-
+    order_rows = []
     for data in orders_data:
         srid = data.get("srid")
         if not srid:
@@ -41,53 +40,59 @@ async def fill_orders(date_from_str: str, telegram_id: str):
         # Парсим "date"
         date_obj = parse_date_field(data.get("date"))
 
-        # Проверяем, есть ли уже запись
-        existing_order = session.query(Order).filter(Order.srid == srid).first()
-
-        if not existing_order:
-            # Новый заказ
-            new_order = Order(
-                token_id=token_obj.id,  # <-- ключевой момент: к какому токену принадлежит
-                srid=srid,
-                last_change_date=last_change_date_utc,
-                date=date_obj,
-                warehouse_name=data.get("warehouseName"),
-                region_name=data.get("regionName"),
-                subject=data.get("subject", ""),
-                supplier_article=data.get("supplierArticle", ""),
-                techSize=data.get("techSize"),
-                full_supplier_article = build_full_supplier_article(
-                    data.get("subject", ""), data.get("supplierArticle", "")
-                ),
-                nm_id=data.get("nmId"),
-                brand=data.get("brand"),
-                price_with_disc=data.get("priceWithDisc"),
-                total_price=data.get("totalPrice"),
-                spp=data.get("spp"),
-                is_cancel=data.get("isCancel", False)
-            )
-            session.add(new_order)
-            count_new += 1
-        else:
-            # Обновляем, если изменился lastChangeDate
-            if last_change_date_utc and last_change_date_utc > existing_order.last_change_date:
-                existing_order.last_change_date = last_change_date_utc
-                existing_order.is_cancel = data.get("isCancel", False)
-                count_updated += 1
-
-            # Если у нас нет supplier_article, но тут есть
-            if not existing_order.supplier_article:
-                existing_order.supplier_article = data.get("supplierArticle", "")
-                existing_order.full_supplier_article = build_full_supplier_article(
-                    existing_order.subject, existing_order.supplier_article
-                )
-                count_updated += 1
+        order_rows.append({
+            "token_id": token_obj.id,  # <-- ключевой момент: к какому токену принадлежит
+            "srid": srid,
+            "last_change_date": last_change_date_utc,
+            "date": date_obj,
+            "warehouse_name": data.get("warehouseName"),
+            "region_name": data.get("regionName"),
+            "subject": data.get("subject", ""),
+            "supplier_article": data.get("supplierArticle", ""),
+            "techSize": data.get("techSize"),
+            "full_supplier_article": build_full_supplier_article(
+                data.get("subject", ""), data.get("supplierArticle", "")
+            ),
+            "nm_id": data.get("nmId"),
+            "brand": data.get("brand"),
+            "price_with_disc": data.get("priceWithDisc"),
+            "total_price": data.get("totalPrice"),
+            "spp": data.get("spp"),
+            "is_cancel": data.get("isCancel", False),
+        })
+
+    # Существующие заказы подтягиваем пачками, пишем одним INSERT ... ON CONFLICT на пачку
+    result = bulk_upsert(session, Order, order_rows, ("srid",), _fill_order_changes)
+    count_new = len(result.inserted)
+    count_updated = len(result.updated)
 
     session.commit()
     session.close()
 
     print(f"Заполнено orders: новых={count_new}, обновлено={count_updated}")
 
+def _fill_order_changes(new: dict, old: dict) -> dict:
+    """
+    Какие поля существующего заказа обновить при первичном заполнении.
+    """
+    changes = {}
+
+    # Обновляем, если изменился lastChangeDate
+    if new["last_change_date"] and (
+        old["last_change_date"] is None or new["last_change_date"] > old["last_change_date"]
+    ):
+        changes["last_change_date"] = new["last_change_date"]
+        changes["is_cancel"] = new["is_cancel"]
+
+    # Если у нас нет supplier_article, но тут есть
+    if not old["supplier_article"] and new["supplier_article"]:
+        changes["supplier_article"] = new["supplier_article"]
+        changes["full_supplier_article"] = build_full_supplier_article(
+            old["subject"], new["supplier_article"]
+        )
+
+    return changes
+
 def parse_last_change_date(last_change_date_str: str):
     """
     Парсим строку вида '2024-11-01T10:11:07' в UTC-naive datetime.
@@ -0,0 +1,101 @@
+# core/http_client.py
+import asyncio
+from urllib.parse import urlsplit
+
+import aiohttp
+
+from config import (
+    WB_HTTP_POOL_LIMIT,
+    WB_HTTP_LIMIT_PER_HOST,
+    WB_HTTP_DNS_TTL,
+    WB_HTTP_KEEPALIVE,
+    WB_HTTP_TIMEOUT,
+)
+from utils.logger import logger
+
+
+class WBHttpClient:
+    """
+    Долгоживущий HTTP-клиент для запросов к Wildberries.
+
+    Для каждого хоста (statistics-api, supplies-api, card.wb.ru, ...) держим
+    свою aiohttp.ClientSession со своим пулом keep-alive соединений и
+    DNS-кэшем, чтобы не делать TCP+TLS рукопожатие на каждый вызов API.
+    Медленный хост при этом не забирает соединения у остальных.
+    """
+
+    def __init__(self,
+                 limit: int = WB_HTTP_POOL_LIMIT,
+                 limit_per_host: int = WB_HTTP_LIMIT_PER_HOST,
+                 dns_ttl: int = WB_HTTP_DNS_TTL,
+                 keepalive: float = WB_HTTP_KEEPALIVE,
+                 timeout: float = WB_HTTP_TIMEOUT):
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.dns_ttl = dns_ttl
+        self.keepalive = keepalive
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self._sessions: dict[str, aiohttp.ClientSession] = {}
+        self._closed = False
+
+    def session(self, url: str) -> aiohttp.ClientSession:
+        """
+        Возвращает сессию (пул соединений) для хоста из url.
+        Сессия создаётся лениво при первом обращении к хосту.
+        """
+        if self._closed:
+            raise RuntimeError("WBHttpClient уже закрыт")
+
+        host = urlsplit(url).netloc
+        sess = self._sessions.get(host)
+        if sess is None or sess.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.limit,
+                limit_per_host=self.limit_per_host,
+                ttl_dns_cache=self.dns_ttl,
+                keepalive_timeout=self.keepalive,
+            )
+            sess = aiohttp.ClientSession(connector=connector, timeout=self.timeout)
+            self._sessions[host] = sess
+            logger.debug(f"[http] новый пул соединений для {host}")
+        return sess
+
+    def get(self, url: str, **kwargs):
+        """Сокращение для self.session(url).get(url, ...)."""
+        return self.session(url).get(url, **kwargs)
+
+    def head(self, url: str, **kwargs):
+        """Сокращение для self.session(url).head(url, ...)."""
+        return self.session(url).head(url, **kwargs)
+
+    async def close(self) -> None:
+        """Закрывает все пулы соединений."""
+        self._closed = True
+        sessions = list(self._sessions.values())
+        self._sessions.clear()
+        for sess in sessions:
+            if not sess.closed:
+                await sess.close()
+        # aiohttp рекомендует дать SSL-транспортам время закрыться
+        await asyncio.sleep(0.25)
+
+
+_client: WBHttpClient | None = None
+
+
+def get_http_client() -> WBHttpClient:
+    """
+    Общий на весь процесс клиент. Создаётся при первом вызове,
+    закрывается из bot.py через close_http_client().
+    """
+    global _client
+    if _client is None or _client._closed:
+        _client = WBHttpClient()
+    return _client
+
+
+async def close_http_client() -> None:
+    global _client
+    if _client is not None:
+        await _client.close()
+        _client = None
@@ -0,0 +1,155 @@
+# core/image_pipeline.py
+import asyncio
+import io
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+
+import aiohttp
+import PIL.Image as PILImage
+from sqlalchemy import update, bindparam
+from sqlalchemy.orm import Session
+
+from config import (
+    IMAGE_FETCH_CONCURRENCY,
+    IMAGE_FETCH_TIMEOUT,
+    IMAGE_WORKERS,
+    IMAGE_WRITE_BATCH,
+)
+from core.http_client import get_http_client
+from core.media_store import put_blobs
+from core.thumbnails import render_thumbnails, upsert_thumbnails
+from db.database import SessionLocal
+from db.models import Product
+from utils.logger import logger
+
+# Размер картинки товара в media_blobs
+PRODUCT_IMAGE_SIZE = (200, 200)
+
+
+@dataclass
+class ProcessedImage:
+    nm_id: int
+    image: bytes                  # PNG 200x200 для media_blobs
+    thumbnails: dict[str, bytes]  # миниатюры для отчётов (core/thumbnails.py)
+
+
+_executor: ThreadPoolExecutor | None = None
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    """
+    Пул потоков для декодирования и ресайза. PIL отпускает GIL на тяжёлых
+    операциях, поэтому потоков достаточно, а цикл событий остаётся свободным.
+    """
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=IMAGE_WORKERS, thread_name_prefix="image")
+    return _executor
+
+
+def process_image(nm_id: int, source: bytes) -> ProcessedImage:
+    """Декодирует исходник и рисует все нужные варианты. Выполняется в пуле потоков."""
+    img = PILImage.open(io.BytesIO(source))
+    out = io.BytesIO()
+    img.resize(PRODUCT_IMAGE_SIZE, PILImage.Resampling.LANCZOS).save(out, format="PNG")
+    return ProcessedImage(
+        nm_id=nm_id,
+        image=out.getvalue(),
+        thumbnails=render_thumbnails(source),
+    )
+
+
+async def fetch_image(url: str) -> bytes | None:
+    """Скачивает картинку через общий пул соединений; None — если не получилось."""
+    timeout = aiohttp.ClientTimeout(total=IMAGE_FETCH_TIMEOUT)
+    async with get_http_client().get(url, timeout=timeout) as resp:
+        if resp.status != 200:
+            logger.warning(f"[images] {url}: HTTP {resp.status}")
+            return None
+        return await resp.read()
+
+
+async def load_images(urls: dict[int, str]) -> list[ProcessedImage]:
+    """
+    Скачивает и обрабатывает картинки {nm_id: url}: скачиваний одновременно
+    не больше IMAGE_FETCH_CONCURRENCY, декодирование и ресайз — в пуле потоков.
+    Картинки, которые не удалось скачать или прочитать, пропускаются.
+    """
+    sema = asyncio.Semaphore(IMAGE_FETCH_CONCURRENCY)
+    loop = asyncio.get_running_loop()
+
+    async def _one(nm_id: int, url: str) -> ProcessedImage | None:
+        try:
+            async with sema:
+                source = await fetch_image(url)
+            if not source:
+                return None
+            return await loop.run_in_executor(_get_executor(), process_image, nm_id, source)
+        except Exception as e:
+            logger.warning(f"[images] nm_id={nm_id}: ошибка при скачивании/обработке картинки: {e}")
+            return None
+
+    results = await asyncio.gather(*(_one(nm_id, url) for nm_id, url in urls.items()))
+    return [r for r in results if r is not None]
+
+
+def save_images(session: Session, images: list[ProcessedImage]) -> dict[int, str]:
+    """
+    Пишет картинки в media_blobs и миниатюры в product_thumbnails — по одному
+    INSERT на пачку. Возвращает {nm_id: image_hash}; ссылку в товаре
+    проставляет вызывающий, он же делает коммит.
+    """
+    if not images:
+        return {}
+    hashes = put_blobs(session, [img.image for img in images])
+    # source_hash миниатюр — хэш картинки товара (products.image_hash), как и при дорисовке
+    upsert_thumbnails(session, [(img.nm_id, h, img.thumbnails) for img, h in zip(images, hashes)])
+    return {img.nm_id: h for img, h in zip(images, hashes)}
+
+
+def link_product_images(session: Session, image_hashes: dict[int, str]) -> None:
+    """Проставляет products.image_hash по {nm_id: hash} одним UPDATE на пачку. Коммит — на вызывающем."""
+    if not image_hashes:
+        return
+    products = Product.__table__
+    stmt = (
+        update(products)
+        .where(products.c.nm_id == bindparam("b_nm_id"))
+        .values(image_hash=bindparam("b_hash"))
+    )
+    session.execute(stmt, [{"b_nm_id": nm_id, "b_hash": h} for nm_id, h in image_hashes.items()])
+
+
+async def fetch_and_store_images(urls: dict[int, str], batch_size: int = IMAGE_WRITE_BATCH) -> dict[int, str]:
+    """
+    Весь конвейер для уже существующих товаров: скачивание и обработка —
+    без открытой сессии, затем на каждую пачку из batch_size картинок короткая
+    транзакция (media_blobs, миниатюры, ссылка в products) с коммитом.
+    Ошибка в одной пачке не откатывает уже записанные.
+    Возвращает {nm_id: image_hash} для записанных картинок.
+    """
+    urls = {nm_id: url for nm_id, url in urls.items() if is_image_url(url)}
+    items = list(urls.items())
+    result = {}
+    for i in range(0, len(items), batch_size):
+        images = await load_images(dict(items[i:i + batch_size]))
+        if not images:
+            continue
+
+        session: Session = SessionLocal()
+        try:
+            image_hashes = save_images(session, images)
+            link_product_images(session, image_hashes)
+            session.commit()
+            result.update(image_hashes)
+        except Exception as e:
+            session.rollback()
+            logger.error(f"[images] не удалось сохранить пачку из {len(images)} картинок: {e}")
+        finally:
+            session.close()
+    return result
+
+
+def is_image_url(url: str | None) -> bool:
+    """parse_wildberries возвращает вместо URL текст «не найден», если картинки нет."""
+    return bool(url) and "не найден" not in url.lower()
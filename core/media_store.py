@@ -0,0 +1,50 @@
+# core/media_store.py
+import hashlib
+
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+
+from db.models import MediaBlob, Product
+
+
+def media_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def put_blob(session: Session, data: bytes) -> str | None:
+    """
+    Кладёт байты в media_blobs и возвращает их хэш (ключ для Product.image_hash).
+    Если такие байты уже есть — ничего не пишем, просто возвращаем хэш.
+    Коммит делает вызывающий.
+    """
+    if not data:
+        return None
+    return put_blobs(session, [data])[0]
+
+
+def put_blobs(session: Session, items) -> list[str]:
+    """Как put_blob, но для пачки картинок одним INSERT; хэши — в порядке items."""
+    items = list(items)
+    hashes = [media_hash(data) for data in items]
+    rows = {h: data for h, data in zip(hashes, items)}
+    if rows:
+        stmt = (
+            insert(MediaBlob.__table__)
+            .values([{"hash": h, "data": data, "size": len(data)} for h, data in rows.items()])
+            .on_conflict_do_nothing(index_elements=["hash"])
+        )
+        session.execute(stmt)
+    return hashes
+
+
+def get_product_images(session: Session, nm_ids) -> dict[int, bytes]:
+    """Картинки товаров (200x200) по списку nm_id одним запросом: {nm_id: bytes}."""
+    nm_ids = {nm_id for nm_id in nm_ids if nm_id}
+    if not nm_ids:
+        return {}
+    return dict(
+        session.query(Product.nm_id, MediaBlob.data)
+        .join(MediaBlob, MediaBlob.hash == Product.image_hash)
+        .filter(Product.nm_id.in_(nm_ids))
+        .all()
+    )
@@ -5,152 +5,187 @@ from db.models import Order, Product, Token
 from sqlalchemy.orm import Session
 from utils.logger import logger
 from utils.token_utils import get_active_tokens  # Импортируем функцию для получения активных токенов
-from core.products_service import upsert_product
+from core.products_service import upsert_products, get_products_map
+from core.token_executor import run_for_tokens
+from db.bulk import bulk_upsert
+from core.sync_cursors import get_date_from, advance_cursor, parse_wb_change_date
 
-# Можно где-то хранить в памяти или в отдельной таблице. Для примера -- глобально:
-LAST_CHECK_DATETIME = datetime.datetime.utcnow() - datetime.timedelta(minutes=30)
+# dateFrom берём из курсора токена (таблица sync_cursors), окно PERIOD_DAYS — только для первой загрузки
+CURSOR_ENDPOINT = "orders"
 PERIOD_DAYS = 7
 async def check_new_orders() -> list[dict]:
     """
     Опрос /orders, сохраняем новые/обновлённые заказы в БД.
     Возвращаем список тех заказов, которые либо новые, либо изменились.
+    Токены опрашиваются параллельно (см. core.token_executor),
+    у каждого токена свой курсор lastChangeDate (см. core.sync_cursors).
     """
 
     logger.info("Запуск проверки новых/обновлённых заказов...")
-    global LAST_CHECK_DATETIME
 
-    
-    session: Session = SessionLocal()
+    tokens_list = get_active_tokens()
 
-    tokens_list = get_active_tokens(session)
+    results = await run_for_tokens(tokens_list, _check_token_orders, label="orders")
 
+    # Склеиваем в порядке токенов
     all_new_orders_dicts = []
+    for orders_dicts in results:
+        all_new_orders_dicts.extend(orders_dicts)
 
-    date_from_str = (datetime.datetime.now() - datetime.timedelta(days=PERIOD_DAYS)).isoformat()
+    return all_new_orders_dicts
 
-    for token_obj in tokens_list:
-        token_value = token_obj.token_value
+async def _check_token_orders(token_obj: Token) -> list[dict]:
+    """
+    Обрабатывает заказы одного токена в собственной сессии.
+    Возвращает список словарей для уведомлений.
+    """
+    session: Session = SessionLocal()
+    try:
+        return await _process_token_orders(session, token_obj)
+    finally:
+        session.close()
 
-        logger.info(f"Обрабатываем токен id={token_obj.id}")
+async def _process_token_orders(session: Session, token_obj: Token) -> list[dict]:
+    token_value = token_obj.token_value
+    all_new_orders_dicts = []
 
-        # Делаем запрос
-        orders_data = await get_orders(date_from_str, token_value, flag=0)
-        if not orders_data:
+    # Забираем только то, что изменилось с прошлого опроса этого токена
+    date_from_str = get_date_from(session, token_obj.id, CURSOR_ENDPOINT, PERIOD_DAYS)
+    # Не держим транзакцию (и соединение из пула) открытой, пока ждём WB
+    session.rollback()
+    max_change_date = None
+
+    logger.info(f"Обрабатываем токен id={token_obj.id}")
+
+    # Делаем запрос
+    orders_data = await get_orders(date_from_str, token_value, flag=0)
+    if not orders_data:
+        return all_new_orders_dicts
+
+    logger.info(f"Token_id={token_obj.id}, получено {len(orders_data)} заказов.")
+    # Товары, которых ещё нет в products, — одним запросом на всю пачку
+    nm_ids = {data.get("nmId") for data in orders_data if data.get("nmId")}
+    known_nm_ids = {
+        nm_id for (nm_id,) in
+        session.query(Product.nm_id).filter(Product.nm_id.in_(nm_ids)).all()
+    } if nm_ids else set()
+    # upsert_products ниже ходит в сеть и открывает свои сессии — эту на время отпускаем
+    session.rollback()
+
+    order_rows = []
+    new_products = []  # товары, которых ещё нет в products
+    raw_by_srid = {}  # srid -> сырая строка WB (для priceWithDisc/spp в уведомлении)
+    for data in orders_data:
+        srid = data.get("srid")
+        last_change_date_str = data.get("lastChangeDate")
+        if not srid or not last_change_date_str:
             continue
-        
-        logger.info(f"Token_id={token_obj.id}, получено {len(orders_data)} заказов.")
-        new_or_updated_orders = []
-        max_change_date = LAST_CHECK_DATETIME
-
-        for data in orders_data:
-            srid = data.get("srid")
-            last_change_date_str = data.get("lastChangeDate")
-            if not srid or not last_change_date_str:
-                continue
-
-            try:
-                dt = datetime.datetime.fromisoformat(last_change_date_str)
-                dt_utc = dt.astimezone(datetime.timezone.utc)
-                last_change_date_obj = dt_utc.replace(tzinfo=None)
-            except ValueError:
-                last_change_date_obj = LAST_CHECK_DATETIME
-
-            existing_order = session.query(Order).filter_by(srid=srid, token_id=token_obj.id).first()
-
-            nm_id = data.get("nmId")
-            subject = data.get("subject", "")
-            supplier_art = data.get("supplierArticle", "")
-            tech_size = data.get("techSize", "")
-
-            product_in_db = session.query(Product).filter_by(nm_id=nm_id).first()
-
-            if product_in_db is None:
-                # upsert_product — асинхронная, поэтому обязательно await
-                await upsert_product(
-                    nm_id           = nm_id,
-                    subject_name    = subject,
-                    brand_name      = data.get("brand"),
-                    supplier_article= supplier_art,
-                    token_id        = token_obj.id,
-                    techSize        = tech_size
-                )
-
-            if not existing_order:
-                # Новый заказ
-                new_order = Order(
-                    token_id=token_obj.id,
-                    srid=srid,
-                    last_change_date=last_change_date_obj,
-                    date=(
-                        datetime.datetime.fromisoformat(data["date"].replace("Z", ""))
-                        if data.get("date") else None
-                    ),
-                    warehouse_name=data.get("warehouseName"),
-                    region_name=data.get("regionName"),
-                    subject=subject,
-                    supplier_article=supplier_art,
-                    full_supplier_article=f"{subject} '{supplier_art}'".strip(),
-                    nm_id=data.get("nmId"),
-                    brand=data.get("brand"),
-                    techSize=tech_size,
-                    price_with_disc=data.get("priceWithDisc"),
-                    total_price=data.get("totalPrice"),
-                    spp=data.get("spp"),
-                    is_cancel=data.get("isCancel", False)
-                )
-                session.add(new_order)
-                session.commit()
-                new_or_updated_orders.append(new_order)
-            else:
-                # Проверяем, не обновился ли
-                if last_change_date_obj > existing_order.last_change_date:
-                    existing_order.last_change_date = last_change_date_obj
-                    existing_order.is_cancel = data.get("isCancel", False)
-                    new_or_updated_orders.append(existing_order)
-
-                # Если supplier_article пустой, обновим
-                if not existing_order.supplier_article:
-                    existing_order.supplier_article = supplier_art
-                    existing_order.full_supplier_article = f"{existing_order.subject} '{supplier_art}'".strip()
-                    new_or_updated_orders.append(existing_order)
-
-                # Если techSize пустой, обновим
-                if not existing_order.techSize:
-                    existing_order.techSize = tech_size
-                    new_or_updated_orders.append(existing_order)
-
-
-            if last_change_date_obj > max_change_date:
-                max_change_date = last_change_date_obj
-
-        session.commit()
-
-        # Готовим список словарей
-        for o in new_or_updated_orders:
-            raw_data = next((x for x in orders_data if x.get("srid") == o.srid), {})
-            nm_id = o.nm_id
-            # Если нужно, подтягиваем Product
-            product = session.query(Product).filter_by(nm_id=nm_id).first()
-
-            all_new_orders_dicts.append({
-                "token_id": token_obj.id,
-                "srid": o.srid,
-                "last_change_date": (o.last_change_date.isoformat() if o.last_change_date else None),
-                "date": (o.date.isoformat() if o.date else None),
-                "itemName": o.subject,
-                "nm_id": o.nm_id,
-                "warehouseName": o.warehouse_name,
-                "regionName": o.region_name,
-                "price_with_disc": raw_data.get("priceWithDisc", 0.0),
-                "spp": raw_data.get("spp", 0.0),
-                "is_cancel": o.is_cancel,
-                "rating": product.rating if product else "N/A",
-                "reviews": product.reviews if product else "N/A",
-                "image_url": product.image_url if product else None
-            })
 
-        # Обновляем глобальный
-        LAST_CHECK_DATETIME = max_change_date
+        try:
+            dt = datetime.datetime.fromisoformat(last_change_date_str)
+            dt_utc = dt.astimezone(datetime.timezone.utc)
+            last_change_date_obj = dt_utc.replace(tzinfo=None)
+        except ValueError:
+            last_change_date_obj = datetime.datetime.utcnow()
+
+        nm_id = data.get("nmId")
+        subject = data.get("subject", "")
+        supplier_art = data.get("supplierArticle", "")
+        tech_size = data.get("techSize", "")
+
+        if nm_id and nm_id not in known_nm_ids:
+            # Новые товары заведём одной пачкой после цикла (upsert_products)
+            new_products.append({
+                "nm_id"           : nm_id,
+                "subject_name"    : subject,
+                "brand_name"      : data.get("brand"),
+                "supplier_article": supplier_art,
+                "token_id"        : token_obj.id,
+                "techSize"        : tech_size,
+            })
+            known_nm_ids.add(nm_id)
+
+        raw_by_srid[srid] = data
+        order_rows.append({
+            "token_id": token_obj.id,
+            "srid": srid,
+            "last_change_date": last_change_date_obj,
+            "date": (
+                datetime.datetime.fromisoformat(data["date"].replace("Z", ""))
+                if data.get("date") else None
+            ),
+            "warehouse_name": data.get("warehouseName"),
+            "region_name": data.get("regionName"),
+            "subject": subject,
+            "supplier_article": supplier_art,
+            "full_supplier_article": f"{subject} '{supplier_art}'".strip(),
+            "nm_id": nm_id,
+            "brand": data.get("brand"),
+            "techSize": tech_size,
+            "price_with_disc": data.get("priceWithDisc"),
+            "total_price": data.get("totalPrice"),
+            "spp": data.get("spp"),
+            "is_cancel": data.get("isCancel", False),
+        })
+
+        raw_change_date = parse_wb_change_date(last_change_date_str)
+        if raw_change_date and (max_change_date is None or raw_change_date > max_change_date):
+            max_change_date = raw_change_date
+
+    # Новые товары: карточки и картинки грузятся параллельно (core/image_pipeline.py)
+    if new_products:
+        await upsert_products(new_products)
+
+    # Новые и изменившиеся заказы — пачками, без запроса на каждую строку
+    new_or_updated_orders = bulk_upsert(session, Order, order_rows, ("srid",), order_changes).changed
+
+    # Курсор сдвигаем в той же транзакции, что и сами заказы
+    advance_cursor(session, token_obj.id, CURSOR_ENDPOINT, max_change_date)
+    session.commit()
+
+    # Готовим список словарей: сырые строки — из словаря, товары — одним запросом
+    products = get_products_map(session, (o["nm_id"] for o in new_or_updated_orders))
+    for o in new_or_updated_orders:
+        raw_data = raw_by_srid.get(o["srid"], {})
+        product = products.get(o["nm_id"])
+
+        all_new_orders_dicts.append({
+            "token_id": token_obj.id,
+            "srid": o["srid"],
+            "last_change_date": (o["last_change_date"].isoformat() if o["last_change_date"] else None),
+            "date": (o["date"].isoformat() if o["date"] else None),
+            "itemName": o["subject"],
+            "nm_id": o["nm_id"],
+            "warehouseName": o["warehouse_name"],
+            "regionName": o["region_name"],
+            "price_with_disc": raw_data.get("priceWithDisc", 0.0),
+            "spp": raw_data.get("spp", 0.0),
+            "is_cancel": o["is_cancel"],
+            "rating": product.rating if product else "N/A",
+            "reviews": product.reviews if product else "N/A",
+            "image_url": product.image_url if product else None
+        })
 
-    session.close()
     return all_new_orders_dicts
+
+def order_changes(new: dict, old: dict) -> dict:
+    """
+    Какие поля существующего заказа нужно обновить (для db.bulk.bulk_upsert).
+    """
+    changes = {}
+
+    # Проверяем, не обновился ли
+    if old["last_change_date"] is None or new["last_change_date"] > old["last_change_date"]:
+        changes["last_change_date"] = new["last_change_date"]
+        changes["is_cancel"] = new["is_cancel"]
+
+    # Если supplier_article пустой, обновим
+    if not old["supplier_article"] and new["supplier_article"]:
+        changes["supplier_article"] = new["supplier_article"]
+        changes["full_supplier_article"] = f"{old['subject']} '{new['supplier_article']}'".strip()
+
+    # Если techSize пустой, обновим
+    if not old["techSize"] and new["techSize"]:
+        changes["techSize"] = new["techSize"]
+
+    return changes
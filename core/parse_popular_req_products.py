@@ -1,16 +1,26 @@
 from db.database import SessionLocal
-from db.models import  Product,  DestCity, ProductSearchRequest, ProductPositions
+from db.models import  Product,  DestCity, ProductSearchRequest, ProductPositions, ProductPositionCurrent, ProductPositionDaily
+from db.bulk import bulk_upsert
+from db.copy_writer import CopyWriter
+from core.crawl_state import start_or_resume_run, completed_units, mark_units_done, finish_run, unit_key
+from core.search_pages import SearchPageCache, find_positions_in_search
 import datetime
-import aiohttp
 import asyncio
-import json
-import traceback
-# Параллельность
+# Сколько пар (запрос, город) обрабатываем одновременно.
+# Темп самих запросов к WB держит общий регулятор core/search_governor.py
 MAX_CONCURRENT = 20
 semaphore = asyncio.Semaphore(MAX_CONCURRENT)
 
 CHUNK_SIZE = 5000
 
+# Вид обхода в crawl_runs (core/crawl_state.py)
+CRAWL_KIND = "positions"
+
+# Колонки product_positions в порядке кортежей для CopyWriter
+POSITIONS_COPY_COLUMNS = (
+    "token_id", "nm_id", "city_id", "query_text", "request_count", "page", "position", "check_dt",
+)
+
 
 async def find_article_in_all_cities(nm_id: int, query_text: str, max_pages=50) -> dict:
     """
@@ -68,101 +78,17 @@ async def find_article_in_current_city(nm_id: int, query_text: str, city_rows: l
 
     return results_by_city
 
-async def find_article_in_search_async(nm_id: int, query_text: str, dest_value: int, max_pages=30) -> tuple:
+async def find_article_in_search_async(nm_id: int, query_text: str, dest_value: int, max_pages=30,
+                                       cache: SearchPageCache | None = None) -> tuple:
     """
     Асинхронная версия поиска товара nm_id по query_text + dest_value (город),
-    перебирая страницы 1..max_pages параллельно.
+    перебирая страницы 1..max_pages окнами и останавливаясь, как только нашли.
+    Страницы берутся через SearchPageCache (core/search_pages.py).
     
     Возвращает (page, position) если нашли, иначе (None, None).
     """
-    
-    
-    async def fetch_page(page_num: int) -> tuple:
-        """
-        Вспомогательная функция:
-        - Делает GET на конкретную страницу page_num
-        - Возвращает (page_num, position) или (None, None)
-        """
-        base_url = "https://search.wb.ru/exactmatch/ru/common/v9/search"
-        params = {
-            "ab_testid": "pers_norm_no_boost",
-            "appType": "1",
-            "curr": "rub",
-            "dest": str(dest_value),
-            "hide_dtype": "10",
-            "lang": "ru",
-            "page": str(page_num),
-            "query": query_text,
-            "resultset": "catalog",
-            "sort": "popular",
-            "spp": "30",
-            "suppressSpellcheck": "false"
-        }
-
-        max_retries = 3
-        attempt = 0
-
-        # Лог перед запросом
-        while attempt < max_retries:
-            attempt += 1
-            
-            async with aiohttp.ClientSession() as session:
-                try:
-                    resp = await session.get(base_url, params=params, timeout=30)
-                    if resp.status == 429:
-                        # Too many requests
-                        print(f"[WARN] nm_id={nm_id}, '{query_text}' page={page_num} => 429 Too Many Requests. "
-                            f"Попытка {attempt} из {max_retries}. Ждём 120 сек...")
-                        await asyncio.sleep(120)
-                        # повторяем в этом же цикле (не увеличиваем attempt)
-                        continue
-                    elif resp.status != 200:
-                        print(f"[WARN] nm_id={nm_id}, '{query_text}' page={page_num}, status={resp.status} => прерываем.")
-                        return (None, None)
-
-                    text_data = await resp.text()
-                    data = json.loads(text_data)
-                    products = data.get("data", {}).get("products", [])
-                    if not products:
-                        return (None, None)
-            
-                    for idx, product in enumerate(products, start=1):
-                        if product.get("id") == nm_id:
-                            # Нашли
-                            return (page_num, idx)
-
-                    return (None, None)
-
-                except Exception as e:
-                    print(f"[ERROR] nm_id={nm_id}, page={page_num}, искл. типа: {type(e).__name__}")
-                    print(f"Сообщение исключения: {str(e)}")
-                    traceback.print_exc()
-                    # При любой ошибке (TimeOut etc) тоже можно повторить
-                    # (например, treat like 429?), или просто вернуться None
-                    return (None, None)
-
-        # Если дошли сюда => 3 неудачные попытки (3 раза был 429)
-        print(f"[ERROR] nm_id={nm_id}, page={page_num} => не удалось получить результат (3x429?).")
-        return (None, None)
-
-    # Запускаем задачи параллельно
-    tasks = []
-    for p in range(1, max_pages + 1):
-        task = asyncio.create_task(fetch_page(p))
-        tasks.append(task)
-
-    # Ждём результаты
-    results = await asyncio.gather(*tasks)
-
-    # results => список [(page or None, pos or None), ...] 
-    # извлекаем минимальный page, если есть
-    found_pages = [(pg, ps) for (pg, ps) in results if pg is not None]
-    if found_pages:
-        # ищем с минимальным page
-        best = min(found_pages, key=lambda x: x[0])  # (page, pos)
-        return best
-    else:
-        return (None, None)
+    positions = await find_positions_in_search([nm_id], query_text, dest_value, max_pages, cache)
+    return positions.get(nm_id, (None, None))
 
 async def find_article_in_search_with_sema(nm_id: int, query_text: str, dest: int, max_pages=30):
     """
@@ -172,6 +98,56 @@ async def find_article_in_search_with_sema(nm_id: int, query_text: str, dest: in
     async with semaphore:
         return await find_article_in_search_async(nm_id, query_text, dest, max_pages)
 
+async def find_query_positions_with_sema(nm_ids, query_text: str, dest: int, cache: SearchPageCache,
+                                        max_pages=30, hints: dict | None = None) -> dict:
+    """
+    Позиции всех наших товаров по одному запросу в одном городе — одной выдачей.
+    hints — последние известные страницы товаров {nm_id: page}, с них начинаем поиск.
+    После подсчёта страницы запроса из кэша выбрасываем.
+    """
+    async with semaphore:
+        try:
+            return await find_positions_in_search(nm_ids, query_text, dest, max_pages, cache, hints=hints)
+        finally:
+            cache.discard(query_text, dest)
+
+def load_last_pages(session, city_id: int) -> dict[tuple, int]:
+    """
+    Последняя известная страница каждого товара по каждому запросу в городе:
+    {(nm_id, query_text): page}. Нужна, чтобы начинать поиск не с первой страницы.
+    Берётся из снимка product_positions_current, история не читается.
+    """
+    rows = (
+        session.query(ProductPositionCurrent.nm_id, ProductPositionCurrent.query_text, ProductPositionCurrent.page)
+        .filter(ProductPositionCurrent.city_id == city_id, ProductPositionCurrent.page.isnot(None))
+        .all()
+    )
+    return {(nm_id, query_text): page for nm_id, query_text, page in rows}
+
+def position_current_changes(new: dict, old: dict) -> dict:
+    """
+    Что обновить в снимке product_positions_current (для db.bulk.bulk_upsert):
+    всё, если проверка не старее той, что уже лежит в снимке.
+    """
+    if old["check_dt"] and new["check_dt"] < old["check_dt"]:
+        return {}
+    return {k: new[k] for k in ("request_count", "page", "position", "check_dt")}
+
+def position_daily_changes(new: dict, old: dict) -> dict:
+    """
+    Что обновить в дневной строке product_positions_daily (для db.bulk.bulk_upsert):
+    позицию — только если новая лучше (меньше страница/позиция), частотность — свежую.
+    """
+    changes = {}
+    if new["page"] is not None and (
+        old["page"] is None or (new["page"], new["position"]) < (old["page"], old["position"])
+    ):
+        changes["page"] = new["page"]
+        changes["position"] = new["position"]
+    if new["request_count"] != old["request_count"]:
+        changes["request_count"] = new["request_count"]
+    return changes
+
 def chunk_list(lst, size):
     """
     Генератор: разбивает lst на куски по size.
@@ -182,74 +158,126 @@ def chunk_list(lst, size):
 async def update_product_positions_chunked_async():
     """
     Асинхронная функция:
-      - Идёт по всем городам (DestCity).
-      - Для каждого товара (Product), смотрит запросы в product_search_requests.
-      - Чанками обрабатывает (nm_id, search_text) асинхронно,
-        вызывает find_article_in_search_async(...) => (page, pos).
-      - Записывает результат в product_positions.
+      - Собирает все пары (товар, запрос) из product_search_requests одним запросом
+        и группирует их по тексту запроса.
+      - Идёт по всем городам (DestCity); для каждого (запрос, город) выдача
+        скачивается один раз (SearchPageCache), а позиции ищутся сразу
+        для всех наших товаров с этим запросом — начиная с их последних
+        известных страниц, окнами, пока все не найдены.
+      - Записывает результат в product_positions и обновляет снимок
+        последних позиций product_positions_current и дневную сводку
+        product_positions_daily.
     """
 
     session = SessionLocal()
 
     # 1) Все города
     cities = session.query(DestCity).all()
-    # 2) Все товары
-    products = session.query(Product).all()
-
-    print(f"[ASYNC] Города: {len(cities)}, Товаров: {len(products)}")
+    # 2) Все пары (товар, запрос): query_text -> [(nm_id, token_id, freq), ...]
+    rows = (
+        session.query(
+            ProductSearchRequest.search_text,
+            ProductSearchRequest.current_freq,
+            Product.nm_id,
+            Product.token_id,
+        )
+        .join(Product, Product.nm_id == ProductSearchRequest.nm_id)
+        .all()
+    )
+    targets_by_query: dict[str, list[tuple]] = {}
+    for query_text, freq, nm_id, token_id in rows:
+        targets_by_query.setdefault(query_text, []).append((nm_id, token_id, freq))
+    all_queries = list(targets_by_query.items())
+
+    print(f"[ASYNC] Города: {len(cities)}, пар товар/запрос: {len(rows)}, уникальных запросов: {len(all_queries)}")
+
+    # Единица работы — (город, запрос). Если прошлый обход не доработал
+    # (упал, перезапуск), продолжаем его и пропускаем уже выполненные единицы
+    run = start_or_resume_run(session, CRAWL_KIND, total_units=len(cities) * len(all_queries))
+    done_units = completed_units(session, run)
+
+    # История позиций — миллионы строк за обход, пишем её через COPY, а не ORM
+    history_writer = CopyWriter(session, ProductPositions, POSITIONS_COPY_COLUMNS)
 
     for city in cities:
-        print(f"[ASYNC] Обработка города {city.city} (dest={city.dest})")
-
-        for product in products:
-            nm_id = product.nm_id
-            token_id = product.token_id
-            if not nm_id:
-                continue
-
-            # 3) Берём все запросы для данного nm_id из product_search_requests
-            #    которые вы заранее сохранили из JAM
-            search_reqs = session.query(ProductSearchRequest)\
-                .filter_by(nm_id=nm_id)\
-                .all()
-
-            if not search_reqs:
-                continue
-
-            # Сформируем список [(query_text, current_freq), ...]
-            all_queries = [(sr.search_text, sr.current_freq) for sr in search_reqs]
-
-            # 4) chunk'ами обрабатываем
-            for chunk in chunk_list(all_queries, CHUNK_SIZE):
-                tasks = []
-                for (qtext, freq) in chunk:
-                    tasks.append(find_article_in_search_with_sema(
-                        nm_id, qtext, city.dest, max_pages=30
+        city_queries = [
+            (query_text, targets) for query_text, targets in all_queries
+            if unit_key(city.id, query_text) not in done_units
+        ]
+        if not city_queries:
+            print(f"[ASYNC] Город {city.city} уже обработан в обходе id={run.id}, пропускаем")
+            continue
+
+        print(f"[ASYNC] Обработка города {city.city} (dest={city.dest}), осталось запросов: {len(city_queries)}")
+        cache = SearchPageCache()
+        last_pages = load_last_pages(session, city.id)
+
+        # 3) chunk'ами обрабатываем
+        for chunk in chunk_list(city_queries, CHUNK_SIZE):
+            tasks = [
+                find_query_positions_with_sema(
+                    {nm_id for nm_id, _, _ in targets}, query_text, city.dest, cache, max_pages=30,
+                    hints={
+                        nm_id: last_pages[(nm_id, query_text)]
+                        for nm_id, _, _ in targets if (nm_id, query_text) in last_pages
+                    },
+                )
+                for query_text, targets in chunk
+            ]
+
+            # Запускаем асинхронно
+            results = await asyncio.gather(*tasks)
+
+            # Сохраняем в product_positions (история), product_positions_current (снимок)
+            # и product_positions_daily (лучшая позиция за день)
+            check_dt = datetime.datetime.utcnow()
+            current_rows = []
+            daily_rows = []
+            for (query_text, targets), positions in zip(chunk, results):
+                for nm_id, token_id, req_freq in targets:
+                    page, pos = positions.get(nm_id, (None, None))
+                    await history_writer.put((
+                        token_id, nm_id, city.id, query_text, req_freq, page, pos, check_dt
                     ))
-
-                # Запускаем асинхронно
-                results = await asyncio.gather(*tasks)
-
-                # Сохраняем в product_positions
-                for i, (page, pos) in enumerate(results):
-                    query_text, req_freq = chunk[i]
-                    
-                    # записываем (page, pos) в product_positions
-                    new_pp = ProductPositions(
-                        nm_id = nm_id,
-                        token_id=token_id,
-                        city_id = city.id,
-                        query_text = query_text,
-                        request_count = req_freq,
-                        page = page,
-                        position = pos,
-                        check_dt = datetime.datetime.utcnow()
-                    )
-                    session.add(new_pp)
-
-                session.commit()
-    
+                    current_rows.append({
+                        "token_id": token_id,
+                        "nm_id": nm_id,
+                        "query_text": query_text,
+                        "city_id": city.id,
+                        "request_count": req_freq,
+                        "page": page,
+                        "position": pos,
+                        "check_dt": check_dt,
+                    })
+                    daily_rows.append({
+                        "token_id": token_id,
+                        "nm_id": nm_id,
+                        "query_text": query_text,
+                        "city_id": city.id,
+                        "day": check_dt.date(),
+                        "request_count": req_freq,
+                        "page": page,
+                        "position": pos,
+                    })
+
+            bulk_upsert(
+                session, ProductPositionCurrent, current_rows,
+                ("token_id", "nm_id", "query_text", "city_id"), position_current_changes,
+            )
+            bulk_upsert(
+                session, ProductPositionDaily, daily_rows,
+                ("token_id", "nm_id", "query_text", "city_id", "day"), position_daily_changes,
+            )
+            # Хвост истории дописываем COPY до коммита — в той же транзакции
+            await history_writer.flush_async()
+            # Отметки о выполненных (город, запрос) — в той же транзакции, что и позиции
+            mark_units_done(session, run, (unit_key(city.id, query_text) for query_text, _ in chunk))
+            session.commit()
+            print(f"[ASYNC] Прогресс обхода id={run.id}: {run.done_units}/{run.total_units}")
+
+        print(f"[ASYNC] {city.city}: запросов к поиску {cache.fetched}, "
+              f"из кэша {cache.hits} (раньше было бы {sum(len(t) for _, t in city_queries) * 30})")
+
+    finish_run(session, run)
     session.close()
     print("[ASYNC] Готово! Позиции обновлены .")
-
-
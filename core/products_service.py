@@ -4,10 +4,10 @@ from sqlalchemy.orm import Session
 from parse_wb import parse_wildberries
 import datetime
 import re
-import requests
-import io
-import PIL.Image as PILImage
+import asyncio
 from db.models import Order, Product
+from config import IMAGE_WRITE_BATCH, PRODUCT_ONBOARD_CONCURRENCY
+from core.image_pipeline import load_images, save_images, is_image_url
 
 async def fill_new_products_from_orders():
     """
@@ -37,106 +37,160 @@ async def fill_new_products_from_orders():
 
     print(f"Найдено {len(results)} уникальных пар (token_id, nm_id) в orders.")
 
-    # Закроем сессию и откроем заново внутри цикла или передадим session внутрь upsert_product
-    # (Если upsert_product сама создает session, то нам достаточно list(…)
     session.close()
 
-    # 2) Идём в цикле по найденным записям
-    for row in results:
-        token_id = row[0]
-        nm_id = row[1]
-        subject_name = row[2] or ""
-        brand_name = row[3] or ""
-        supplier_article = row[4] or ""
-        techSize = row[5] or ""
-
-        # 3) Вызываем upsert_product (асинхронную)
-        #    Предполагая, что upsert_product сама создаёт SessionLocal()
-        await upsert_product(
-            nm_id=nm_id,
-            subject_name=subject_name,
-            brand_name=brand_name,
-            supplier_article=supplier_article,
-            token_id=token_id,
-            techSize=techSize
-        )
+    # 2) Создаём недостающие товары пачками (картинки качаются параллельно)
+    await upsert_products([
+        {
+            "nm_id": row[1],
+            "subject_name": row[2] or "",
+            "brand_name": row[3] or "",
+            "supplier_article": row[4] or "",
+            "token_id": row[0],
+            "techSize": row[5] or "",
+        }
+        for row in results
+    ])
 
     print("Заполнение новой таблицы Products из Orders завершено.")
 
 async def upsert_product(nm_id: int, subject_name: str, brand_name: str, supplier_article: str, token_id: int, techSize: str):
     """
     Создаёт или обновляет запись в таблице products по nm_id.
-    + Загружает данные (rating, reviews, image_url) через parse_wildberries()
-    + Скачивает и сохраняет "resize_img" (200x200) в BLOB
+    То же, что upsert_products() для одного товара.
     """
+    await upsert_products([{
+        "nm_id": nm_id,
+        "subject_name": subject_name,
+        "brand_name": brand_name,
+        "supplier_article": supplier_article,
+        "token_id": token_id,
+        "techSize": techSize,
+    }])
+
+async def upsert_products(items: list[dict]):
+    """
+    Создаёт или обновляет записи в таблице products.
+    items — словари с ключами nm_id, subject_name, brand_name, supplier_article, token_id, techSize.
+
+    Для новых товаров:
+    + Загружает данные (rating, reviews, image_url) через parse_wildberries() — параллельно
+    + Скачивает картинку (200x200) в хранилище media_blobs и рисует миниатюры
+      для отчётов (core/image_pipeline.py), не занимая цикл событий
+    Пишем пачками по IMAGE_WRITE_BATCH товаров. Пока идут сетевые запросы,
+    транзакция не открыта: до них и после — по короткой транзакции на пачку.
+    """
+    items = list({item["nm_id"]: item for item in items if item.get("nm_id")}.values())
+    sema = asyncio.Semaphore(PRODUCT_ONBOARD_CONCURRENCY)
 
-    session: Session = SessionLocal()
-    product = session.query(Product).filter_by(nm_id=nm_id).first()
-
-    if not product:
-        product = Product(
-            token_id=token_id,
-            nm_id=nm_id,
-            subject_name=subject_name,
-            brand_name=brand_name,
-            supplier_article=supplier_article,
-            techSize=techSize,
-            last_update=datetime.datetime.utcnow()
-        )
-
-        # 1) Парсим данные c WB (rating, reviews, image_url)
-        wb_url = f"https://www.wildberries.ru/catalog/{nm_id}/detail.aspx"
-        parse_result = await parse_wildberries(wb_url)
+    async def _build(item: dict) -> Product:
+        async with sema:
+            return await _build_new_product(item)
 
-        rating_str = parse_result.get("rating", "")
-        reviews_str = parse_result.get("reviews", "")
-        reviews_str = re.sub(r"[^\d]", "", reviews_str)  # оставляем только цифры
-        image_url = parse_result.get("image_url", "")
+    for i in range(0, len(items), IMAGE_WRITE_BATCH):
+        batch = items[i:i + IMAGE_WRITE_BATCH]
 
-        # Преобразуем rating, reviews из строк в числа (если получается)
+        # 1) Короткая транзакция: обновляем известные товары, отбираем новые
+        session: Session = SessionLocal()
         try:
-            product.rating = float(rating_str.replace(",", "."))  # например "4,7" -> 4.7
-        except:
-            product.rating = None
+            existing = get_products_map(session, (item["nm_id"] for item in batch))
+
+            new_items = []
+            for item in batch:
+                product = existing.get(item["nm_id"])
+                if product is None:
+                    new_items.append(item)
+                    continue
+                product.subject_name = item["subject_name"]
+                product.brand_name = item["brand_name"]
+                product.supplier_article = item["supplier_article"]
+                product.last_update = datetime.datetime.utcnow()
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+
+        if not new_items:
+            continue
+
+        # 2) Сеть (карточки WB и картинки) — без открытой транзакции
+        new_products = await asyncio.gather(*(_build(item) for item in new_items))
+        images = await load_images(
+            {p.nm_id: p.image_url for p in new_products if is_image_url(p.image_url)}
+        )
 
+        # 3) Короткая транзакция на запись: картинки в media_blobs, в товаре только ссылка на них
+        session = SessionLocal()
         try:
-            product.reviews = int(reviews_str)
-        except:
-            product.reviews = None
-
-        product.image_url = image_url
-
-        # 2) Если image_url валидный, скачаем картинку и сохраним в resize_img (200x200)
-        if image_url and "не найден" not in image_url.lower():
-            try:
-                resp = requests.get(image_url, timeout=10)
-                if resp.status_code == 200:
-                    pil_img = PILImage.open(io.BytesIO(resp.content))
+            # Пока качали, товар мог добавить кто-то другой
+            added = get_products_map(session, (p.nm_id for p in new_products))
+            new_products = [p for p in new_products if p.nm_id not in added]
+
+            image_hashes = save_images(session, images)
+            for product in new_products:
+                product.image_hash = image_hashes.get(product.nm_id)
+            session.add_all(new_products)
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+
+async def _build_new_product(item: dict) -> Product:
+    """Новый товар (ещё не в сессии) с данными из parse_wildberries()."""
+    product = Product(
+        token_id=item["token_id"],
+        nm_id=item["nm_id"],
+        subject_name=item["subject_name"],
+        brand_name=item["brand_name"],
+        supplier_article=item["supplier_article"],
+        techSize=item["techSize"],
+        last_update=datetime.datetime.utcnow()
+    )
 
-                    # Масштабируем до 200x200
-                    pil_img = pil_img.resize((200, 200), PILImage.Resampling.LANCZOS)
+    # Парсим данные c WB (rating, reviews, image_url)
+    wb_url = f"https://www.wildberries.ru/catalog/{item['nm_id']}/detail.aspx"
+    try:
+        parse_result = await parse_wildberries(wb_url)
+    except Exception as e:
+        print(f"Ошибка при парсинге nm_id={item['nm_id']}: {e}")
+        return product
 
-                    out_bytes = io.BytesIO()
-                    pil_img.save(out_bytes, format="PNG")
-                    out_bytes.seek(0)
+    rating_str = str(parse_result.get("rating", ""))
+    reviews_str = str(parse_result.get("reviews", ""))
+    reviews_str = re.sub(r"[^\d]", "", reviews_str)  # оставляем только цифры
 
-                    # Записываем сырые байты PNG в поле resize_img
-                    product.resize_img = out_bytes.getvalue()
-            except Exception as e:
-                print(f"Ошибка при скачивании/обработке картинки для nm_id={nm_id}: {e}")
+    # Преобразуем rating, reviews из строк в числа (если получается)
+    try:
+        product.rating = float(rating_str.replace(",", "."))  # например "4,7" -> 4.7
+    except:
+        product.rating = None
 
-        session.add(product)
-        session.commit()
-    else:
-        product.subject_name = subject_name
-        product.brand_name = brand_name
-        product.supplier_article = supplier_article
-        product.last_update = datetime.datetime.utcnow()
+    try:
+        product.reviews = int(reviews_str)
+    except:
+        product.reviews = None
 
+    product.image_url = parse_result.get("image_url", "")
+    return product
 
-        # 3) Сохраняем изменения
-        session.commit()
-        session.close()
+def get_products_map(session: Session, nm_ids) -> dict[int, Product]:
+    """
+    Все товары по списку nm_id одним запросом: {nm_id: Product}.
+    Товаров, которых нет в БД, в словаре просто нет.
+    """
+    nm_ids = {nm_id for nm_id in nm_ids if nm_id}
+    if not nm_ids:
+        return {}
+    products = (
+        session.query(Product)
+        .filter(Product.nm_id.in_(nm_ids))
+        .all()
+    )
+    return {p.nm_id: p for p in products}
 
 def update_product_rating_reviews(nm_id: int, rating: float, reviews: int, image_url: str = None):
     """
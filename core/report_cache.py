@@ -0,0 +1,199 @@
+# core/report_cache.py
+import asyncio
+import hashlib
+import os
+import time
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from config import REPORT_CACHE_DIR, REPORT_CACHE_MAX_MB, REPORT_CACHE_TTL, DAILY_REPORT_CACHE_TTL
+from core.report_service import run_report
+from db.database import SessionLocal
+from db.models import Order, Sale, Stock, Product, ProductPositionCurrent, ProductPositionDaily
+from utils.logger import logger
+
+# Из каких таблиц собирается отчёт и по какому столбцу видно, что данные поменялись
+REPORT_SOURCES = {
+    "my_products":    (Order.last_change_date, Sale.last_change_date, Stock.last_change_date, Product.last_update),
+    "orders":         (Order.last_change_date,),
+    "daily":          (Order.last_change_date, Sale.last_change_date, Stock.last_change_date, Product.last_update),
+    "report_for_day": (Order.last_change_date, Sale.last_change_date, Stock.last_change_date, Product.last_update),
+    "positions":      (ProductPositionCurrent.check_dt, ProductPositionDaily.day),
+}
+
+
+def data_watermark(session: Session, token_id: int, columns) -> str:
+    """
+    «Версия» данных токена: по каждой таблице-источнику — максимум столбца
+    изменения и число строк (чтобы заметить и вставки со старой датой).
+    Пока водяной знак тот же, отчёт собирать заново незачем.
+    """
+    parts = []
+    for column in columns:
+        model = column.class_
+        latest, count = (
+            session.query(func.max(column), func.count())
+            .select_from(model)
+            .filter(model.token_id == token_id)
+            .one()
+        )
+        parts.append(f"{model.__tablename__}:{latest}:{count}")
+    return "|".join(parts)
+
+
+def load_watermark(kind: str, token_id: int) -> str:
+    """data_watermark() в собственной сессии — для вызова через asyncio.to_thread."""
+    session = SessionLocal()
+    try:
+        return data_watermark(session, token_id, REPORT_SOURCES[kind])
+    finally:
+        session.close()
+
+
+class ReportCache:
+    """
+    Готовые отчёты на диске: один файл на ключ (вид отчёта, token_id, период,
+    водяной знак данных). Новые данные меняют водяной знак, а значит и ключ —
+    старый файл просто перестаёт запрашиваться и со временем вытесняется.
+
+    Время последнего чтения храним в atime файла (LRU), время сборки — в mtime:
+    файлы старше ttl не отдаём, потому что периоды «за N дней» сдвигаются
+    вместе с текущим временем. Общий размер держим в пределах max_bytes.
+
+    get()/put() блокирующие; из цикла событий — только через asyncio.to_thread
+    (так делает get_or_build).
+    """
+
+    def __init__(self, directory: str = REPORT_CACHE_DIR, max_bytes: int = REPORT_CACHE_MAX_MB * 1024 * 1024,
+                 ttl: int = REPORT_CACHE_TTL):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._inflight: dict[str, asyncio.Future] = {}
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def make_key(kind: str, token_id: int, period: str, watermark: str) -> str:
+        raw = f"{kind}|{token_id}|{period}|{watermark}"
+        return f"{kind}_{token_id}_{hashlib.sha1(raw.encode()).hexdigest()}"
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.xlsx")
+
+    def get(self, key: str) -> bytes | None:
+        path = self._path(key)
+        try:
+            st = os.stat(path)
+            if time.time() - st.st_mtime > self.ttl:
+                return None
+            with open(path, "rb") as f:
+                data = f.read()
+            os.utime(path, (time.time(), st.st_mtime))  # отметка чтения для LRU
+            return data
+        except FileNotFoundError:
+            return None
+
+    def put(self, key: str, data: bytes) -> None:
+        path = self._path(key)
+        tmp = f"{path}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+        self._evict()
+
+    def _evict(self) -> None:
+        """Удаляет устаревшие файлы, затем давно не читанные — пока кэш больше max_bytes."""
+        entries = []
+        now = time.time()
+        for entry in os.scandir(self.directory):
+            if not entry.is_file() or not entry.name.endswith(".xlsx"):
+                continue
+            try:
+                st = entry.stat()
+                if now - st.st_mtime > self.ttl:
+                    os.remove(entry.path)
+                    continue
+            except FileNotFoundError:
+                continue
+            entries.append((st.st_atime, st.st_size, entry.path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    async def get_or_build(self, kind: str, token_id: int, period: str, build_fn, *args,
+                           watermark: str | None = None) -> bytes:
+        """
+        Отчёт из кэша, а если его нет — сборка через core/report_service.py и запись в кэш.
+        Одновременные запросы одного и того же отчёта (например, коллеги с общим
+        токеном) ждут одну сборку.
+        watermark — для отчётов-«снимков» с фиксированным концом периода:
+        тогда новые данные ключ не меняют и водяной знак из БД не считаем.
+        """
+        # Запросы к БД и чтение файла — в потоке, чтобы не останавливать бота
+        if watermark is None:
+            watermark = await asyncio.to_thread(load_watermark, kind, token_id)
+        key = self.make_key(kind, token_id, period, watermark)
+        data = await asyncio.to_thread(self.get, key)
+        if data is not None:
+            logger.info(f"[report_cache] {kind} token_id={token_id} {period}: из кэша")
+            return data
+
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            return await asyncio.shield(inflight)
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            data = await run_report(build_fn, *args)
+            if data is not None:
+                await asyncio.to_thread(self.put, key, data)
+            future.set_result(data)
+            return data
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()  # ожидающих может не быть — не ругаемся «exception was never retrieved»
+            raise
+        finally:
+            self._inflight.pop(key, None)
+
+
+_cache: ReportCache | None = None
+
+
+def get_report_cache() -> ReportCache:
+    global _cache
+    if _cache is None:
+        _cache = ReportCache()
+    return _cache
+
+
+_snapshots: ReportCache | None = None
+
+
+def get_snapshot_cache() -> ReportCache:
+    """
+    Отдельный кэш для отчётов-«снимков» (ежедневная рассылка): они собираются
+    заранее и должны дожить до отправки, поэтому срок жизни у них свой
+    (DAILY_REPORT_CACHE_TTL), а размер ограничен так же, как у основного кэша.
+    """
+    global _snapshots
+    if _snapshots is None:
+        _snapshots = ReportCache(directory=os.path.join(REPORT_CACHE_DIR, "snapshots"), ttl=DAILY_REPORT_CACHE_TTL)
+    return _snapshots
+
+
+async def cached_report(kind: str, token_id: int, period: str, build_fn, *args) -> bytes:
+    """Сокращение для get_report_cache().get_or_build(...)."""
+    return await get_report_cache().get_or_build(kind, token_id, period, build_fn, *args)
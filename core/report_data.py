@@ -0,0 +1,156 @@
+# core/report_data.py
+import datetime
+from collections import defaultdict
+from dataclasses import dataclass, field
+
+from sqlalchemy import func, case
+from sqlalchemy.orm import Session
+
+from db.models import Order, Sale, Stock
+
+
+@dataclass
+class ProductDetailData:
+    """Всё, что нужно детальному листу одного товара за период (handlers/report_handler.py)."""
+    orders_count: int = 0
+    orders_sum: float = 0
+    orders_cnt_cancel: int = 0
+    orders_sum_cancel: float = 0
+    sales_count: int = 0
+    sales_sum: float = 0
+    sales_cnt_return: int = 0
+    sales_sum_return: float = 0
+    # день -> [заказы, отказы, выкупы, возвраты]
+    daily: dict[datetime.date, list[int]] = field(default_factory=dict)
+    regions: list[tuple[str, int]] = field(default_factory=list)          # (регион, заказов), по убыванию
+    warehouses: list[tuple[str, int]] = field(default_factory=list)       # (склад, заказов), по убыванию
+    stocks: list[tuple[str, int, int]] = field(default_factory=list)      # (склад, остаток, в пути), по убыванию
+
+    def daily_stats(self, days: list[datetime.date]) -> list[tuple]:
+        """[(день, заказы, отказы, выкупы, возвраты), ...] для каждого дня периода, включая пустые."""
+        return [(d, *self.daily.get(d, (0, 0, 0, 0))) for d in days]
+
+
+def load_product_details(session: Session, token_id: int,
+                         date_from: datetime.datetime, date_to: datetime.datetime) -> dict[int, ProductDetailData]:
+    """
+    Данные для детальных листов всех товаров токена за период — несколькими
+    GROUP BY запросами (по nm_id, по (nm_id, день), по (nm_id, регион/склад))
+    вместо отдельных запросов на каждый товар и каждый день.
+    Товаров без заказов/продаж/остатков в словаре нет.
+    """
+    details: dict[int, ProductDetailData] = defaultdict(ProductDetailData)
+    day_from = date_from.date()
+    day_to = date_to.date() + datetime.timedelta(days=1)
+
+    # 1) Итоги по заказам за период
+    rows = (
+        session.query(
+            Order.nm_id,
+            func.count(Order.id),
+            func.sum(Order.price_with_disc),
+            func.sum(case((Order.is_cancel == True, 1), else_=0)),
+            func.sum(case((Order.is_cancel == True, Order.price_with_disc), else_=0)),
+        )
+        .filter(Order.token_id == token_id, Order.date >= date_from, Order.date <= date_to)
+        .group_by(Order.nm_id)
+        .all()
+    )
+    for nm_id, cnt, total, cnt_cancel, sum_cancel in rows:
+        d = details[nm_id]
+        d.orders_count = cnt or 0
+        d.orders_sum = total or 0
+        d.orders_cnt_cancel = cnt_cancel or 0
+        d.orders_sum_cancel = sum_cancel or 0
+
+    # 2) Итоги по выкупам за период
+    is_return = Sale.sale_id.like("R%")
+    rows = (
+        session.query(
+            Sale.nm_id,
+            func.count(Sale.id),
+            func.sum(Sale.price_with_disc),
+            func.sum(case((is_return, 1), else_=0)),
+            func.sum(case((is_return, Sale.price_with_disc), else_=0)),
+        )
+        .filter(Sale.token_id == token_id, Sale.date >= date_from, Sale.date <= date_to)
+        .group_by(Sale.nm_id)
+        .all()
+    )
+    for nm_id, cnt, total, cnt_return, sum_return in rows:
+        d = details[nm_id]
+        d.sales_count = cnt or 0
+        d.sales_sum = total or 0
+        d.sales_cnt_return = cnt_return or 0
+        d.sales_sum_return = sum_return or 0
+
+    # 3) По дням: заказы/отказы и выкупы/возвраты (дни периода целиком)
+    order_day = func.date(Order.date)
+    rows = (
+        session.query(
+            Order.nm_id, order_day,
+            func.count(Order.id),
+            func.sum(case((Order.is_cancel == True, 1), else_=0)),
+        )
+        .filter(Order.token_id == token_id, Order.date >= day_from, Order.date < day_to)
+        .group_by(Order.nm_id, order_day)
+        .all()
+    )
+    for nm_id, day, cnt, cnt_cancel in rows:
+        counts = details[nm_id].daily.setdefault(day, [0, 0, 0, 0])
+        counts[0] = cnt or 0
+        counts[1] = cnt_cancel or 0
+
+    sale_day = func.date(Sale.date)
+    rows = (
+        session.query(
+            Sale.nm_id, sale_day,
+            func.count(Sale.id),
+            func.sum(case((is_return, 1), else_=0)),
+        )
+        .filter(Sale.token_id == token_id, Sale.date >= day_from, Sale.date < day_to)
+        .group_by(Sale.nm_id, sale_day)
+        .all()
+    )
+    for nm_id, day, cnt, cnt_return in rows:
+        counts = details[nm_id].daily.setdefault(day, [0, 0, 0, 0])
+        counts[2] = cnt or 0
+        counts[3] = cnt_return or 0
+
+    # 4) Заказы (без отказов) по регионам и по складам
+    for column, attr in ((Order.region_name, "regions"), (Order.warehouse_name, "warehouses")):
+        rows = (
+            session.query(Order.nm_id, column, func.count(Order.id))
+            .filter(
+                Order.token_id == token_id,
+                Order.date >= date_from,
+                Order.date <= date_to,
+                Order.is_cancel == False,
+            )
+            .group_by(Order.nm_id, column)
+            .all()
+        )
+        for nm_id, name, cnt in rows:
+            getattr(details[nm_id], attr).append((name, cnt))
+
+    # 5) Текущие остатки по складам
+    rows = (
+        session.query(
+            Stock.nm_id,
+            Stock.warehouseName,
+            func.sum(Stock.quantity),
+            func.sum(func.coalesce(Stock.inWayToClient, 0)),
+        )
+        .filter(Stock.token_id == token_id)
+        .group_by(Stock.nm_id, Stock.warehouseName)
+        .all()
+    )
+    for nm_id, warehouse, quantity, in_way in rows:
+        details[nm_id].stocks.append((warehouse, quantity or 0, in_way or 0))
+
+    for d in details.values():
+        d.regions.sort(key=lambda r: r[1], reverse=True)
+        d.warehouses.sort(key=lambda r: r[1], reverse=True)
+        d.stocks.sort(key=lambda r: r[1], reverse=True)
+
+    return dict(details)
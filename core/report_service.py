@@ -0,0 +1,133 @@
+# core/report_service.py
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from config import REPORT_WORKERS, REPORT_TIMEOUT, REPORT_MAX_MEMORY_MB, REPORT_MAX_TASKS_PER_CHILD
+from utils.logger import logger
+
+
+class ReportError(Exception):
+    """Отчёт не удалось собрать; текст можно показать пользователю."""
+
+
+class ReportTimeout(ReportError):
+    pass
+
+
+class ReportTooLarge(ReportError):
+    pass
+
+
+def _init_worker(max_memory_mb: int) -> None:
+    """Инициализация процесса-сборщика: ограничиваем ему адресное пространство."""
+    if max_memory_mb <= 0:
+        return
+    try:
+        import resource
+    except ImportError:  # Windows — лимита памяти нет
+        return
+    limit = max_memory_mb * 1024 * 1024
+    resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+
+class ReportService:
+    """
+    Сборка Excel-отчётов (openpyxl, графики, картинки) в отдельных процессах,
+    чтобы тяжёлый отчёт не останавливал цикл событий бота.
+
+    Задание — функция верхнего уровня, которая сама открывает сессию к БД
+    и возвращает байты файла: run(build_fn, *args). Одновременно собирается
+    не больше REPORT_WORKERS отчётов, каждому процессу ограничена память
+    (REPORT_MAX_MEMORY_MB), каждому отчёту — время (REPORT_TIMEOUT).
+    В пул отдаём не больше заданий, чем в нём процессов, остальные ждут
+    своей очереди здесь — так время считается с начала сборки, а не с
+    постановки в очередь. Отчёт, превысивший время, останавливаем вместе
+    с пулом процессов: остальные задания пула при этом один раз
+    перезапускаются на новом пуле.
+    """
+
+    def __init__(self, workers: int = REPORT_WORKERS, timeout: float = REPORT_TIMEOUT,
+                 max_memory_mb: int = REPORT_MAX_MEMORY_MB):
+        self.workers = max(1, workers)
+        self.timeout = timeout
+        self.max_memory_mb = max_memory_mb
+        self._pool: ProcessPoolExecutor | None = None
+        self._slots = asyncio.Semaphore(self.workers)  # сколько заданий сейчас в пуле
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            # spawn: дочерний процесс не наследует цикл событий, соединения с БД и сокеты бота
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+                initargs=(self.max_memory_mb,),
+                max_tasks_per_child=REPORT_MAX_TASKS_PER_CHILD,
+            )
+        return self._pool
+
+    def _kill_pool(self, pool: ProcessPoolExecutor) -> None:
+        """Останавливает процессы пула (зависший отчёт иначе не прервать)."""
+        if self._pool is pool:
+            self._pool = None
+        for proc in list((pool._processes or {}).values()):
+            proc.terminate()
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    async def run(self, build_fn, *args) -> bytes:
+        """Собирает отчёт build_fn(*args) в процессе-сборщике и возвращает его байты."""
+        name = getattr(build_fn, "__name__", str(build_fn))
+        async with self._slots:
+            return await self._run(name, build_fn, *args)
+
+    async def _run(self, name: str, build_fn, *args) -> bytes:
+        """Сборка при занятом слоте: свободный процесс в пуле есть, задание стартует сразу."""
+        for attempt in (1, 2):
+            pool = self._get_pool()
+            future = asyncio.wrap_future(pool.submit(build_fn, *args))
+            try:
+                return await asyncio.wait_for(future, timeout=self.timeout)
+            except asyncio.TimeoutError:
+                logger.error(f"[reports] {name}{args}: не уложился в {self.timeout:.0f} сек, останавливаем")
+                self._kill_pool(pool)
+                raise ReportTimeout("Отчёт собирается слишком долго, попробуйте позже или выберите период короче.")
+            except MemoryError:
+                logger.error(f"[reports] {name}{args}: превышен лимит памяти {self.max_memory_mb} МБ")
+                raise ReportTooLarge("Отчёт слишком большой: не хватило памяти на сборку.")
+            except BrokenProcessPool:
+                # Пул остановили из-за чужого зависшего отчёта (или процесс упал) — пробуем ещё раз
+                if self._pool is pool:
+                    self._pool = None
+                if attempt == 2:
+                    logger.error(f"[reports] {name}{args}: процесс-сборщик упал")
+                    raise ReportError("Не удалось собрать отчёт, попробуйте позже.")
+                logger.warning(f"[reports] {name}{args}: пул сборщиков перезапущен, повторяем")
+
+    def shutdown(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+
+_service: ReportService | None = None
+
+
+def get_report_service() -> ReportService:
+    global _service
+    if _service is None:
+        _service = ReportService()
+    return _service
+
+
+async def run_report(build_fn, *args) -> bytes:
+    """Сокращение для get_report_service().run(build_fn, *args)."""
+    return await get_report_service().run(build_fn, *args)
+
+
+def shutdown_report_service() -> None:
+    global _service
+    if _service is not None:
+        _service.shutdown()
+        _service = None
@@ -5,140 +5,157 @@ from sqlalchemy.orm import Session
 from utils.logger import logger
 from core.wildberries_api import get_sales
 from utils.token_utils import get_active_tokens  # Импортируем функцию для получения активных токенов
+from core.token_executor import run_for_tokens
+from core.products_service import get_products_map
+from db.bulk import bulk_upsert
+from core.sync_cursors import get_date_from, advance_cursor, parse_wb_change_date
 
-LAST_CHECK_DATETIME_SALES = datetime.datetime.utcnow() - datetime.timedelta(minutes=30)
+# dateFrom берём из курсора токена (таблица sync_cursors), окно PERIOD_DAYS — только для первой загрузки
+CURSOR_ENDPOINT = "sales"
 PERIOD_DAYS = 90
 async def check_new_sales() -> list[dict]:
     """
     1) Берёт все токены (tokens),
-    2) Для каждого токена делает запрос к WB /sales,
+    2) Для каждого токена делает запрос к WB /sales начиная с курсора токена,
     3) Сохраняет/обновляет записи в таблице Sales (sale.token_id=...),
     4) Возвращает общий список новых/обновлённых выкупов в формате [{"token_id":..., "sale_id":..., ...}, ...].
     """
     logger.info("Запуск проверки новых/обновлённых выкупов (sales)...")
-    global LAST_CHECK_DATETIME_SALES
 
-    session: Session = SessionLocal()
-
-    tokens = get_active_tokens(session)
+    tokens = get_active_tokens()
 
-    date_from_str = (datetime.datetime.now() - datetime.timedelta(days=PERIOD_DAYS)).isoformat()
-    logger.debug(f"date_from = {date_from_str}")
+    # Токены опрашиваются параллельно, результат склеиваем в порядке токенов
+    results = await run_for_tokens(tokens, _check_token_sales, label="sales")
 
     all_new_sales_list = []
+    for sales_dicts in results:
+        all_new_sales_list.extend(sales_dicts)
 
-    for token_obj in tokens:
-        token_value = token_obj.token_value
+    return all_new_sales_list
 
-        # Запрашиваем /sales c учётом date_from_str
-        sales_data = await get_sales(date_from_str, token_value, flag=0) 
-        # get_sales(token_value, date_from: str, flag=0) -> ваш вариант
+async def _check_token_sales(token_obj: Token) -> list[dict]:
+    """
+    Обрабатывает выкупы одного токена в собственной сессии.
+    Возвращает список словарей для уведомлений.
+    """
+    session: Session = SessionLocal()
+    try:
+        return await _process_token_sales(session, token_obj)
+    finally:
+        session.close()
 
-        logger.info(f"Token_id={token_obj.id}, получено {len(sales_data)} выкупов.")
+async def _process_token_sales(session: Session, token_obj: Token) -> list[dict]:
+    all_new_sales_list = []
+    token_value = token_obj.token_value
 
-        if not sales_data:
-            continue
+    # Забираем только то, что изменилось с прошлого опроса этого токена
+    date_from_str = get_date_from(session, token_obj.id, CURSOR_ENDPOINT, PERIOD_DAYS)
+    # Не держим транзакцию (и соединение из пула) открытой, пока ждём WB
+    session.rollback()
+    logger.debug(f"token_id={token_obj.id}, date_from = {date_from_str}")
 
-        # Тут можно сделать отдельный max_change_date, если хотим
-        # (но тогда хранить LAST_CHECK_DATETIME_SALES на токен)
-        # Для упрощения оставим глобальный
-        max_change_date = LAST_CHECK_DATETIME_SALES
+    # Запрашиваем /sales c учётом date_from_str
+    sales_data = await get_sales(date_from_str, token_value, flag=0) 
 
-        new_or_updated_sales = []
+    logger.info(f"Token_id={token_obj.id}, получено {len(sales_data)} выкупов.")
 
-        for data in sales_data:
-            sale_id = data.get("saleID") or data.get("saleId")
-            last_change_date_str = data.get("lastChangeDate")
-            if not sale_id or not last_change_date_str:
-                logger.debug(f"Пропускаем некорректную запись {data}")
-                continue
+    if not sales_data:
+        return all_new_sales_list
 
-            # Парсим дату
+    max_change_date = None
+
+    sale_rows = []
+    raw_by_sale_id = {}  # saleID -> сырая строка WB (для priceWithDisc/spp в уведомлении)
+    for data in sales_data:
+        sale_id = data.get("saleID") or data.get("saleId")
+        last_change_date_str = data.get("lastChangeDate")
+        if not sale_id or not last_change_date_str:
+            logger.debug(f"Пропускаем некорректную запись {data}")
+            continue
+
+        # Парсим дату
+        try:
+            dt = datetime.datetime.fromisoformat(last_change_date_str)
+            dt_utc = dt.astimezone(datetime.timezone.utc)
+            last_change_date_obj = dt_utc.replace(tzinfo=None)
+        except ValueError:
+            last_change_date_obj = datetime.datetime.utcnow()
+
+        sale_date_str = data.get("date") or ""
+        sale_date = None
+        if sale_date_str:
+            # убираем "Z" или парсим c ISO
+            sale_date_str = sale_date_str.replace("Z", "")
             try:
-                dt = datetime.datetime.fromisoformat(last_change_date_str)
-                dt_utc = dt.astimezone(datetime.timezone.utc)
-                last_change_date_obj = dt_utc.replace(tzinfo=None)
-            except ValueError:
-                last_change_date_obj = LAST_CHECK_DATETIME_SALES
-
-            existing_sale = (
-                session.query(Sale)
-                .filter_by(sale_id=sale_id, token_id=token_obj.id)
-                .first()
-            )
-
-            if not existing_sale:
-                # Новый выкуп
-                logger.debug(f"Новый выкуп sale_id={sale_id} для token_id={token_obj.id}.")
-                subject = data.get("subject", "")
-                sale_date_str = data.get("date") or ""
-                sale_date = None
-                if sale_date_str:
-                    # убираем "Z" или парсим c ISO
-                    sale_date_str = sale_date_str.replace("Z", "")
-                    try:
-                        sale_date = datetime.datetime.fromisoformat(sale_date_str)
-                    except:
-                        pass
-
-                new_sale = Sale(
-                    token_id=token_obj.id,
-                    sale_id=sale_id,
-                    last_change_date=last_change_date_obj,
-                    date=sale_date,
-                    warehouse_name=data.get("warehouseName"),
-                    region_name=data.get("regionName"),
-                    subject=subject,
-                    nm_id=data.get("nmId"),
-                    brand=data.get("brand"),
-                    price_with_disc=data.get("priceWithDisc"),
-                    total_price=data.get("totalPrice"),
-                    spp=data.get("spp"),
-                    # is_cancel=... (если нужно)
-                )
-                session.add(new_sale)
-                new_or_updated_sales.append(new_sale)
-            else:
-                # Обновляем, если lastChangeDate стал больше
-                if last_change_date_obj > existing_sale.last_change_date:
-                    logger.debug(f"Выкуп sale_id={sale_id} обновился.")
-                    existing_sale.last_change_date = last_change_date_obj
-                    # existing_sale.is_cancel = data.get("isCancel", False) # или иные поля
-                    new_or_updated_sales.append(existing_sale)
-
-            if last_change_date_obj > max_change_date:
-                max_change_date = last_change_date_obj
-
-        session.commit()
-
-        # Теперь преобразуем new_or_updated_sales -> список словарей
-        for s in new_or_updated_sales:
-            # Находим сырые данные
-            raw_data = next((x for x in sales_data if (x.get("saleID") or x.get("saleId")) == s.sale_id), {})
-            nm_id = s.nm_id
-            product = session.query(Product).filter_by(nm_id=nm_id).first()
-
-            base_price = float(raw_data.get("priceWithDisc", 0.0))
-            spp_value = float(raw_data.get("spp", 0.0))
-
-            all_new_sales_list.append({
-                "token_id": token_obj.id,       # <-- ключевой момент
-                "sale_id": s.sale_id,
-                "last_change_date": s.last_change_date.isoformat() if s.last_change_date else None,
-                "date": s.date.isoformat() if s.date else None,
-                "itemName": s.subject,
-                "nm_id": s.nm_id,
-                "warehouseName": s.warehouse_name,
-                "regionName": s.region_name,
-                "price_with_disc": base_price,
-                "spp": spp_value,
-                "rating": product.rating if product else "N/A",
-                "reviews": product.reviews if product else "N/A",
-                "image_url": product.image_url if product else None
-            })
-
-        # Обновляем глобальный 
-        LAST_CHECK_DATETIME_SALES = max_change_date
-
-    session.close()
+                sale_date = datetime.datetime.fromisoformat(sale_date_str)
+            except:
+                pass
+
+        raw_by_sale_id[sale_id] = data
+        sale_rows.append({
+            "token_id": token_obj.id,
+            "sale_id": sale_id,
+            "last_change_date": last_change_date_obj,
+            "date": sale_date,
+            "warehouse_name": data.get("warehouseName"),
+            "region_name": data.get("regionName"),
+            "subject": data.get("subject", ""),
+            "nm_id": data.get("nmId"),
+            "brand": data.get("brand"),
+            "price_with_disc": data.get("priceWithDisc"),
+            "total_price": data.get("totalPrice"),
+            "spp": data.get("spp"),
+        })
+
+        raw_change_date = parse_wb_change_date(last_change_date_str)
+        if raw_change_date and (max_change_date is None or raw_change_date > max_change_date):
+            max_change_date = raw_change_date
+
+    # Новые и изменившиеся выкупы — пачками, без запроса на каждую строку
+    upserted = bulk_upsert(session, Sale, sale_rows, ("sale_id",), sale_changes)
+    new_or_updated_sales = upserted.changed
+    logger.debug(
+        f"Token_id={token_obj.id}: новых выкупов {len(upserted.inserted)}, "
+        f"обновлено {len(upserted.updated)}."
+    )
+
+    # Курсор сдвигаем в той же транзакции, что и сами выкупы
+    advance_cursor(session, token_obj.id, CURSOR_ENDPOINT, max_change_date)
+    session.commit()
+
+    # Теперь преобразуем new_or_updated_sales -> список словарей
+    # Сырые строки — из словаря, товары — одним запросом
+    products = get_products_map(session, (s["nm_id"] for s in new_or_updated_sales))
+    for s in new_or_updated_sales:
+        raw_data = raw_by_sale_id.get(s["sale_id"], {})
+        product = products.get(s["nm_id"])
+
+        base_price = float(raw_data.get("priceWithDisc", 0.0))
+        spp_value = float(raw_data.get("spp", 0.0))
+
+        all_new_sales_list.append({
+            "token_id": token_obj.id,       # <-- ключевой момент
+            "sale_id": s["sale_id"],
+            "last_change_date": s["last_change_date"].isoformat() if s["last_change_date"] else None,
+            "date": s["date"].isoformat() if s["date"] else None,
+            "itemName": s["subject"],
+            "nm_id": s["nm_id"],
+            "warehouseName": s["warehouse_name"],
+            "regionName": s["region_name"],
+            "price_with_disc": base_price,
+            "spp": spp_value,
+            "rating": product.rating if product else "N/A",
+            "reviews": product.reviews if product else "N/A",
+            "image_url": product.image_url if product else None
+        })
+
     return all_new_sales_list
+
+def sale_changes(new: dict, old: dict) -> dict:
+    """
+    Какие поля существующего выкупа нужно обновить (для db.bulk.bulk_upsert).
+    """
+    # Обновляем, если lastChangeDate стал больше
+    if old["last_change_date"] is None or new["last_change_date"] > old["last_change_date"]:
+        return {"last_change_date": new["last_change_date"]}
+    return {}
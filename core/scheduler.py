@@ -3,15 +3,20 @@ from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from core.orders_tracking import check_new_orders
 from core.sales_tracking import check_new_sales
 from core.fetch_report_details import save_report_details
-from utils.notifications import notify_new_orders, notify_new_sales, send_daily_reports_to_all_users, notify_free_incomes, notify_free_acceptance, notify_subscription_expiring, notify_cancellations
+from utils.notifications import notify_new_orders, notify_new_sales, send_daily_reports_to_all_users, prebuild_daily_reports, notify_free_incomes, notify_free_acceptance, notify_subscription_expiring, notify_cancellations
 from core.stocks_tracking import check_stocks  
 from core.incomes_tracking import check_new_incomes
 from core.products_service import fill_new_products_from_orders
-from core.parse_popular_req_products import update_product_positions_chunked_async
+from core.parse_popular_req_products import update_product_positions_chunked_async, CRAWL_KIND as POSITIONS_CRAWL_KIND
+from core.crawl_state import has_unfinished_run
+from core.thumbnails import backfill_thumbnails
 from core.coefficient_tracking import check_acceptance_coeffs
 from core.fill_pop import fill_product_search_requests_async
 from core.update_products import update_products_if_outdated
 from core.fill_logistic_tariffs import refresh_logistic_tariffs
+from core.card_cache import refresh_card_cache
+from config import CARD_CACHE_REFRESH_MIN, DAILY_REPORT_PREBUILD_HOUR, DAILY_REPORT_PREBUILD_MINUTE
+import datetime
 
 def start_scheduler(bot):
     scheduler = AsyncIOScheduler()
@@ -20,9 +25,20 @@ def start_scheduler(bot):
     scheduler.add_job(fill_new_products_from_orders, 'cron', hour=1)  # Заполнение новых товаров и заказов в 1:00
     scheduler.add_job(refresh_logistic_tariffs, 'interval', seconds=90)  # Проверка тарифов каждые 90 секунд
     scheduler.add_job(run_check_and_notify_all, 'interval', minutes=2 , args=[bot])  # Проверка и уведомления каждые 2 минуты
+    scheduler.add_job(prebuild_daily_reports, 'cron', hour=DAILY_REPORT_PREBUILD_HOUR,
+                      minute=DAILY_REPORT_PREBUILD_MINUTE)  # Сборка ежедневных отчётов заранее
     scheduler.add_job(send_daily_reports_to_all_users, 'cron', hour=9, minute=0, args=[bot])  # Ежедневные отчёты в 9:00
     scheduler.add_job(notify_subscription_expiring, 'cron', hour=10, minute=0, args=[bot])  # Уведомление об окончании подписки в 10:00
     scheduler.add_job(fill_then_update, 'interval', days=1)  # Заполнение и обновление товаров каждые 1 день
+    if has_unfinished_run(POSITIONS_CRAWL_KIND):
+        # Обход позиций прервался (падение/перезапуск) — продолжаем его сразу,
+        # пока незавершённый обход не устарел (CRAWL_RUN_MAX_AGE_HOURS)
+        scheduler.add_job(update_product_positions_chunked_async, 'date',
+                          run_date=datetime.datetime.now())
+    scheduler.add_job(backfill_thumbnails, 'date',
+                      run_date=datetime.datetime.now())  # Дорисовка недостающих миниатюр (разово при старте, в потоке)
+    scheduler.add_job(refresh_card_cache, 'interval', minutes=CARD_CACHE_REFRESH_MIN,
+                      next_run_time=datetime.datetime.now())  # Прогрев/обновление кэша карточек WB (сразу при старте)
 
 
     scheduler.start()
@@ -0,0 +1,159 @@
+# core/search_governor.py
+import asyncio
+import random
+import time
+
+from config import (
+    SEARCH_RATE,
+    SEARCH_RATE_MIN,
+    SEARCH_RATE_MAX,
+    SEARCH_RATE_STEP,
+    SEARCH_RATE_DECREASE,
+    SEARCH_BACKOFF_BASE,
+    SEARCH_BACKOFF_MAX,
+    SEARCH_MAX_INFLIGHT,
+    SEARCH_MAX_ATTEMPTS,
+)
+from core.http_client import get_http_client
+from utils.logger import logger
+
+
+class SearchGovernor:
+    """
+    Единый на процесс регулятор запросов к поисковым эндпоинтам WB.
+
+    • token bucket: не больше `rate` запросов в секунду на весь процесс,
+      слоты резервируются сразу, поэтому параллельные корутины не толкаются;
+    • AIMD: каждый успешный ответ чуть поднимает rate (до rate_max),
+      429 — умножает его на rate_decrease (не ниже rate_min);
+    • общий backoff: после 429 все запросы ждут одну и ту же паузу
+      (экспонента от серии 429 подряд, со случайным разбросом, либо Retry-After),
+      а не спят каждый свои 120 секунд;
+    • не больше max_inflight запросов одновременно.
+
+    Все краулеры выдачи (core/search_pages.py, track_pos.py) ходят через get_json().
+    """
+
+    def __init__(self,
+                 rate: float = SEARCH_RATE,
+                 rate_min: float = SEARCH_RATE_MIN,
+                 rate_max: float = SEARCH_RATE_MAX,
+                 rate_step: float = SEARCH_RATE_STEP,
+                 rate_decrease: float = SEARCH_RATE_DECREASE,
+                 backoff_base: float = SEARCH_BACKOFF_BASE,
+                 backoff_max: float = SEARCH_BACKOFF_MAX,
+                 max_inflight: int = SEARCH_MAX_INFLIGHT,
+                 max_attempts: int = SEARCH_MAX_ATTEMPTS):
+        self.rate_min = max(0.1, rate_min)
+        self.rate_max = max(self.rate_min, rate_max)
+        self.rate = min(max(rate, self.rate_min), self.rate_max)
+        self.rate_step = rate_step
+        self.rate_decrease = rate_decrease
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.max_attempts = max(1, max_attempts)
+        self._inflight = asyncio.Semaphore(max(1, max_inflight))
+        self._next_at = 0.0
+        self._backoff_until = 0.0
+        self._throttle_streak = 0
+        self.requests = 0    # отправлено запросов
+        self.throttled = 0   # из них получили 429
+
+    # ---------- темп ----------
+
+    async def _acquire(self) -> None:
+        """Ждёт конца общего backoff и своего слота в token bucket."""
+        while True:
+            now = time.monotonic()
+            if now < self._backoff_until:
+                await asyncio.sleep(self._backoff_until - now)
+                continue
+            slot = max(now, self._next_at)
+            self._next_at = slot + 1.0 / self.rate
+            if slot > now:
+                await asyncio.sleep(slot - now)
+            # Пока ждали слот, кто-то мог словить 429 — тогда ждём вместе со всеми
+            if time.monotonic() >= self._backoff_until:
+                return
+
+    def on_success(self) -> None:
+        """Additive increase: примерно +rate_step запросов/сек за каждую секунду без 429."""
+        self._throttle_streak = 0
+        self.rate = min(self.rate_max, self.rate + self.rate_step / self.rate)
+
+    def on_throttle(self, retry_after: float | None = None) -> None:
+        """
+        Multiplicative decrease + общий backoff.
+        429 от запросов, улетевших до начала текущей паузы, — это та же
+        «волна», повторно скорость не режем.
+        """
+        now = time.monotonic()
+        if now < self._backoff_until:
+            return
+
+        self._throttle_streak += 1
+        self.rate = max(self.rate_min, self.rate * self.rate_decrease)
+
+        if retry_after is None:
+            delay = min(self.backoff_max, self.backoff_base * 2 ** (self._throttle_streak - 1))
+            delay *= random.uniform(1.0, 1.5)  # разброс, чтобы процессы не возвращались разом
+        else:
+            delay = min(self.backoff_max, retry_after)
+
+        self._backoff_until = now + delay
+        self._next_at = max(self._next_at, self._backoff_until)
+        logger.warning(f"[search] 429 от WB: пауза {delay:.1f} сек, скорость снижена до {self.rate:.2f} запр/сек")
+
+    # ---------- запросы ----------
+
+    async def get_json(self, url: str, params: dict, timeout: float = 30, label: str = "search") -> dict | None:
+        """
+        GET с учётом общего темпа. 429 повторяем (до max_attempts попыток),
+        любой другой не-200 статус или ошибка — None.
+        """
+        for attempt in range(1, self.max_attempts + 1):
+            async with self._inflight:
+                await self._acquire()
+                self.requests += 1
+                try:
+                    async with get_http_client().get(url, params=params, timeout=timeout) as resp:
+                        if resp.status == 429:
+                            self.throttled += 1
+                            self.on_throttle(_retry_after(resp))
+                            continue
+                        if resp.status != 200:
+                            logger.warning(f"[search] {label}: status={resp.status}, пропускаем.")
+                            return None
+                        # WB отдаёт JSON с Content-Type text/plain
+                        data = await resp.json(content_type=None)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    logger.warning(f"[search] {label}: ошибка {type(e).__name__}: {e}")
+                    return None
+
+            self.on_success()
+            return data
+
+        logger.error(f"[search] {label}: не удалось получить ответ за {self.max_attempts} попыток (429).")
+        return None
+
+
+def _retry_after(resp) -> float | None:
+    """Retry-After в секундах, если WB его прислал."""
+    value = resp.headers.get("Retry-After")
+    try:
+        return float(value) if value else None
+    except ValueError:
+        return None
+
+
+_governor: SearchGovernor | None = None
+
+
+def get_search_governor() -> SearchGovernor:
+    """Общий на весь процесс регулятор. Создаётся при первом вызове."""
+    global _governor
+    if _governor is None:
+        _governor = SearchGovernor()
+    return _governor
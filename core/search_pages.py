@@ -0,0 +1,167 @@
+# core/search_pages.py
+import asyncio
+
+from config import SEARCH_PROBE_WINDOW
+from core.search_governor import get_search_governor
+
+SEARCH_URL = "https://search.wb.ru/exactmatch/ru/common/v9/search"
+
+
+async def fetch_search_page(query_text: str, dest_value: int, page_num: int) -> list[int] | None:
+    """
+    Одна страница выдачи search.wb.ru (через общий регулятор core/search_governor.py).
+
+    Возвращает список id товаров в порядке выдачи,
+    [] — если страница пустая (выдача закончилась),
+    None — если страницу получить не удалось.
+    """
+    params = {
+        "ab_testid": "pers_norm_no_boost",
+        "appType": "1",
+        "curr": "rub",
+        "dest": str(dest_value),
+        "hide_dtype": "10",
+        "lang": "ru",
+        "page": str(page_num),
+        "query": query_text,
+        "resultset": "catalog",
+        "sort": "popular",
+        "spp": "30",
+        "suppressSpellcheck": "false"
+    }
+
+    data = await get_search_governor().get_json(
+        SEARCH_URL, params, timeout=30, label=f"'{query_text}' dest={dest_value} page={page_num}"
+    )
+    if data is None:
+        return None
+
+    products = data.get("data", {}).get("products", [])
+    return [product.get("id") for product in products]
+
+
+class SearchPageCache:
+    """
+    Кэш страниц поиска на один прогон краулера: (query, dest, page) -> [id товаров].
+
+    Одна и та же страница скачивается не больше одного раза, даже если её
+    одновременно ждут несколько корутин (они ждут общий Future). Позиции всех
+    наших nm_id по запросу потом ищутся в уже скачанных страницах.
+    Неудачные загрузки (None) не кэшируются — следующий запрос попробует снова.
+    Если загрузку отменили все, кто её ждал, — отменяем и сам запрос.
+    """
+
+    def __init__(self):
+        self._pages: dict[tuple[str, int], dict[int, asyncio.Future]] = {}
+        self._waiters: dict[asyncio.Future, int] = {}
+        self.fetched = 0   # реальных запросов к search.wb.ru
+        self.hits = 0      # страниц, отданных из кэша
+
+    async def get_page(self, query_text: str, dest_value: int, page_num: int) -> list[int] | None:
+        pages = self._pages.setdefault((query_text, int(dest_value)), {})
+        fut = pages.get(page_num)
+        if fut is None:
+            fut = asyncio.ensure_future(fetch_search_page(query_text, dest_value, page_num))
+            pages[page_num] = fut
+            self.fetched += 1
+        else:
+            self.hits += 1
+
+        self._waiters[fut] = self._waiters.get(fut, 0) + 1
+        try:
+            # shield: отмена одного ожидающего не отменяет общую загрузку
+            result = await asyncio.shield(fut)
+        except asyncio.CancelledError:
+            if self._waiters[fut] == 1 and not fut.done():
+                fut.cancel()
+                if pages.get(page_num) is fut:
+                    pages.pop(page_num, None)
+            raise
+        finally:
+            self._waiters[fut] -= 1
+            if not self._waiters[fut]:
+                del self._waiters[fut]
+
+        if result is None and pages.get(page_num) is fut:
+            pages.pop(page_num, None)
+        return result
+
+    def discard(self, query_text: str, dest_value: int) -> None:
+        """Забываем страницы запроса, когда позиции по нему уже посчитаны (экономим память)."""
+        self._pages.pop((query_text, int(dest_value)), None)
+
+
+def probe_order(max_pages: int, hints) -> list[int]:
+    """
+    Порядок обхода страниц: сначала те, что ближе к последним известным
+    страницам товаров (hints), дальше — расходимся в обе стороны.
+    Без подсказок — просто 1, 2, 3, ...
+    """
+    hints = [h for h in hints if h and 1 <= h <= max_pages] or [1]
+    return sorted(
+        range(1, max_pages + 1),
+        key=lambda page: (min(abs(page - h) for h in hints), page),
+    )
+
+
+async def find_positions_in_search(
+    nm_ids,
+    query_text: str,
+    dest_value: int,
+    max_pages: int = 30,
+    cache: SearchPageCache | None = None,
+    hints: dict[int, int] | None = None,
+    window: int = SEARCH_PROBE_WINDOW,
+) -> dict[int, tuple]:
+    """
+    Позиции сразу нескольких товаров по одному запросу в одном городе.
+
+    Вместо всех max_pages страниц разом качаем окнами по `window` страниц,
+    начиная с последней известной страницы товара (hints: {nm_id: page})
+    и расширяясь в обе стороны. Как только все товары найдены — оставшиеся
+    загрузки отменяем. Пустая страница означает конец выдачи: страницы
+    дальше неё не запрашиваем. Страницы берутся через cache — без повторов.
+
+    Возвращает {nm_id: (page, position)} или (None, None), если товар не найден.
+    """
+    if cache is None:
+        cache = SearchPageCache()
+    hints = hints or {}
+
+    wanted = set(nm_ids)
+    found: dict[int, tuple] = {}
+    order = probe_order(max_pages, [hints.get(nm_id) for nm_id in wanted])
+    last_page = max_pages  # дальше пустой страницы выдачи нет
+    window = max(1, window)
+
+    for start in range(0, len(order), window):
+        if len(found) == len(wanted):
+            break
+        window_pages = [page for page in order[start:start + window] if page <= last_page]
+        if not window_pages:
+            continue
+
+        tasks = {
+            asyncio.ensure_future(cache.get_page(query_text, dest_value, page)): page
+            for page in window_pages
+        }
+        pending = set(tasks)
+        try:
+            while pending and len(found) < len(wanted):
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    page_num = tasks[task]
+                    ids = task.result()
+                    if ids == []:
+                        last_page = min(last_page, page_num - 1)
+                    for idx, product_id in enumerate(ids or [], start=1):
+                        if product_id in wanted and (product_id not in found or (page_num, idx) < found[product_id]):
+                            found[product_id] = (page_num, idx)
+        finally:
+            # Все нашлись — недокачанные страницы окна больше не нужны
+            for task in pending:
+                task.cancel()
+            if pending:
+                await asyncio.gather(*pending, return_exceptions=True)
+
+    return {nm_id: found.get(nm_id, (None, None)) for nm_id in wanted}
@@ -5,103 +5,129 @@ from db.models import Stock, Token
 from sqlalchemy.orm import Session
 from utils.logger import logger
 from utils.token_utils import get_active_tokens  # Импортируем функцию для получения активных токенов
+from core.token_executor import run_for_tokens
+from db.bulk import bulk_upsert
+from core.sync_cursors import get_date_from, advance_cursor, parse_wb_change_date
 
-# Глобальная переменная для хранения времени последней проверки
-LAST_CHECK_DATETIME = datetime.datetime.utcnow() - datetime.timedelta(minutes=30)
+# dateFrom берём из курсора токена (таблица sync_cursors), окно PERIOD_DAYS — только для первой загрузки
+CURSOR_ENDPOINT = "stocks"
 PERIOD_DAYS = 90
 
 async def check_stocks() -> list[Stock]:
     """
     Опрос /stocks, сохранение новых/обновлённых данных в БД.
     Возвращает список новых или изменённых записей.
+    Токены опрашиваются параллельно (см. core.token_executor).
     """
     
     logger.info("Запуск проверки остатков товаров...")
-    global LAST_CHECK_DATETIME
 
-    session: Session = SessionLocal()
+    tokens_list = get_active_tokens()
 
-    tokens_list = get_active_tokens(session)
+    # Токены опрашиваются параллельно, результат склеиваем в порядке токенов
+    results = await run_for_tokens(tokens_list, _check_token_stocks, label="stocks")
 
     all_new_stocks_dicts = []
+    for stocks_dicts in results:
+        all_new_stocks_dicts.extend(stocks_dicts)
+
+    return all_new_stocks_dicts
+
+async def _check_token_stocks(token_obj: Token) -> list[dict]:
+    """
+    Обрабатывает остатки одного токена в собственной сессии.
+    Возвращает список словарей новых/изменённых записей.
+    """
+    session: Session = SessionLocal()
+    try:
+        return await _process_token_stocks(session, token_obj)
+    finally:
+        session.close()
 
-    # Формируем dateFrom в формате RFC3339 (UTC)
-    date_from_str = (datetime.datetime.now() - datetime.timedelta(days=PERIOD_DAYS)).isoformat()
-    for token_obj in tokens_list:
-        token_value = token_obj.token_value
+async def _process_token_stocks(session: Session, token_obj: Token) -> list[dict]:
+    all_new_stocks_dicts = []
+    max_change_date = None
 
-        logger.info(f"Обрабатываем токен id={token_obj.id}")
+    # Забираем только то, что изменилось с прошлого опроса этого токена
+    date_from_str = get_date_from(session, token_obj.id, CURSOR_ENDPOINT, PERIOD_DAYS)
+    # Не держим транзакцию (и соединение из пула) открытой, пока ждём WB
+    session.rollback()
+    token_value = token_obj.token_value
 
-        stocks_data = await get_stocks(date_from_str, token_value)
-        if not stocks_data:
+    logger.info(f"Обрабатываем токен id={token_obj.id}")
+
+    stocks_data = await get_stocks(date_from_str, token_value)
+    if not stocks_data:
+        return all_new_stocks_dicts
+
+    stock_rows = []
+    for data in stocks_data:
+        nm_id = data.get("nmId")
+        warehouse_name = data.get("warehouseName")
+        last_change_date_str = data.get("lastChangeDate")
+
+        if not nm_id or not warehouse_name:
             continue
 
-        new_or_updated_stocks = []
-        max_change_date = LAST_CHECK_DATETIME
-
-        for data in stocks_data:
-            nm_id = data.get("nmId")
-            warehouse_name = data.get("warehouseName")
-            last_change_date_str = data.get("lastChangeDate")
-
-            if not nm_id or not warehouse_name:
-                continue
-
-            quantity = data.get("quantity")
-            in_way_to_client = data.get("inWayToClient")
-
-            try:
-                dt = datetime.datetime.fromisoformat(last_change_date_str)
-                dt_utc = dt.astimezone(datetime.timezone.utc)
-                last_change_date_obj = dt_utc.replace(tzinfo=None)
-            except ValueError:
-                last_change_date_obj = LAST_CHECK_DATETIME
-
-            existing_stock = (
-                session.query(Stock)
-                .filter_by(nm_id=nm_id, warehouseName=warehouse_name, token_id=token_obj.id)
-                .first()
-            )
-
-            if not existing_stock:
-                logger.debug(f"Новый остаток, NM_ID={nm_id}, склад {warehouse_name}. Сохраняем в БД.")
-                new_stock = Stock(
-                    token_id=token_obj.id,
-                    nm_id=nm_id,
-                    warehouseName=warehouse_name,
-                    quantity=quantity,
-                    last_change_date=last_change_date_obj,
-                    quantity_full=data.get("quantityFull"),
-                    subject=data.get("subject"),
-                    inWayToClient=in_way_to_client,
-                )
-                session.add(new_stock)
-                new_or_updated_stocks.append(new_stock)
-            else:
-                if last_change_date_obj > existing_stock.last_change_date:
-                    logger.debug(f"Остаток NM_ID={nm_id}, склад {warehouse_name} обновился. Обновляем поля.")
-                    existing_stock.quantity = quantity
-                    existing_stock.inWayToClient = in_way_to_client
-                    existing_stock.last_change_date = last_change_date_obj
-                    new_or_updated_stocks.append(existing_stock)
-
-            if last_change_date_obj > max_change_date:
-                max_change_date = last_change_date_obj
-
-        session.commit()
-
-        for s in new_or_updated_stocks:
-            all_new_stocks_dicts.append({
-                "token_id": token_obj.id,
-                "nm_id": s.nm_id,
-                "warehouseName": s.warehouseName,
-                "quantity": s.quantity,
-                "inWayToClient": s.inWayToClient,
-                "last_change_date": s.last_change_date.isoformat(),
-                "subject": s.subject,
-            })
-
-        LAST_CHECK_DATETIME = max_change_date
-
-    session.close()
+        try:
+            dt = datetime.datetime.fromisoformat(last_change_date_str)
+            dt_utc = dt.astimezone(datetime.timezone.utc)
+            last_change_date_obj = dt_utc.replace(tzinfo=None)
+        except ValueError:
+            last_change_date_obj = datetime.datetime.utcnow()
+
+        stock_rows.append({
+            "token_id": token_obj.id,
+            "nm_id": nm_id,
+            "warehouseName": warehouse_name,
+            "quantity": data.get("quantity"),
+            "last_change_date": last_change_date_obj,
+            "quantity_full": data.get("quantityFull"),
+            "subject": data.get("subject"),
+            "inWayToClient": data.get("inWayToClient"),
+        })
+
+        raw_change_date = parse_wb_change_date(last_change_date_str)
+        if raw_change_date and (max_change_date is None or raw_change_date > max_change_date):
+            max_change_date = raw_change_date
+
+    # Новые и изменившиеся остатки — пачками, без запроса на каждую строку
+    upserted = bulk_upsert(
+        session, Stock, stock_rows,
+        ("token_id", "nm_id", "warehouseName"),
+        stock_changes,
+    )
+    new_or_updated_stocks = upserted.changed
+    logger.debug(
+        f"Token_id={token_obj.id}: новых остатков {len(upserted.inserted)}, "
+        f"обновлено {len(upserted.updated)}."
+    )
+
+    # Курсор сдвигаем в той же транзакции, что и сами данные
+    advance_cursor(session, token_obj.id, CURSOR_ENDPOINT, max_change_date)
+    session.commit()
+
+    for s in new_or_updated_stocks:
+        all_new_stocks_dicts.append({
+            "token_id": token_obj.id,
+            "nm_id": s["nm_id"],
+            "warehouseName": s["warehouseName"],
+            "quantity": s["quantity"],
+            "inWayToClient": s["inWayToClient"],
+            "last_change_date": s["last_change_date"].isoformat(),
+            "subject": s["subject"],
+        })
+
     return all_new_stocks_dicts
+
+def stock_changes(new: dict, old: dict) -> dict:
+    """
+    Какие поля существующего остатка нужно обновить (для db.bulk.bulk_upsert).
+    """
+    if old["last_change_date"] is None or new["last_change_date"] > old["last_change_date"]:
+        return {
+            "quantity": new["quantity"],
+            "inWayToClient": new["inWayToClient"],
+            "last_change_date": new["last_change_date"],
+        }
+    return {}
@@ -0,0 +1,69 @@
+# core/sync_cursors.py
+import datetime
+
+from sqlalchemy.orm import Session
+
+from db.models import SyncCursor
+
+
+def parse_wb_change_date(value: str | None) -> datetime.datetime | None:
+    """
+    Парсит lastChangeDate из ответа WB как есть (время WB, без перевода в UTC),
+    чтобы его можно было без искажений отправить обратно в dateFrom.
+    """
+    if not value:
+        return None
+    try:
+        return datetime.datetime.fromisoformat(value.replace("Z", "")).replace(tzinfo=None)
+    except ValueError:
+        return None
+
+
+def get_cursor(session: Session, token_id: int, endpoint: str) -> datetime.datetime | None:
+    """
+    Последний lastChangeDate, который мы уже забрали у WB
+    для пары (токен, метод). None — если токен ещё ни разу не опрашивался.
+    """
+    cursor = (
+        session.query(SyncCursor)
+        .filter_by(token_id=token_id, endpoint=endpoint)
+        .first()
+    )
+    return cursor.last_change_date if cursor else None
+
+
+def get_date_from(session: Session, token_id: int, endpoint: str, period_days: int) -> str:
+    """
+    dateFrom для очередного опроса: курсор токена, а при первом запуске —
+    начало окна now − period_days (первичная загрузка).
+    Чтение открывает транзакцию: перед запросом к WB вызывающий её завершает
+    (session.rollback()), чтобы не держать соединение, пока ждёт ответа.
+    """
+    cursor = get_cursor(session, token_id, endpoint)
+    if cursor is None:
+        cursor = datetime.datetime.now() - datetime.timedelta(days=period_days)
+    return cursor.isoformat()
+
+
+def advance_cursor(session: Session, token_id: int, endpoint: str,
+                   last_change_date: datetime.datetime | None) -> None:
+    """
+    Сдвигает курсор вперёд (назад — никогда). Коммит делает вызывающий,
+    вместе с сохранёнными строками, чтобы курсор не обогнал данные.
+    """
+    if last_change_date is None:
+        return
+
+    cursor = (
+        session.query(SyncCursor)
+        .filter_by(token_id=token_id, endpoint=endpoint)
+        .first()
+    )
+    if cursor is None:
+        session.add(SyncCursor(
+            token_id=token_id,
+            endpoint=endpoint,
+            last_change_date=last_change_date,
+        ))
+    elif last_change_date > cursor.last_change_date:
+        cursor.last_change_date = last_change_date
@@ -0,0 +1,130 @@
+# core/thumbnails.py
+import io
+
+import PIL.Image as PILImage
+from sqlalchemy import func, select
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+
+from config import IMAGE_WRITE_BATCH
+from core.media_store import get_product_images
+from db.database import SessionLocal
+from db.models import Product, ProductThumbnail
+from utils.logger import logger
+
+# Размеры миниатюр, которые используют отчёты (ширина, высота)
+THUMB_DETAIL = (152, 200)     # «Мои товары», топы, детальные листы (handlers/report_handler.py)
+THUMB_POSITIONS = (182, 160)  # отчёты по позициям (handlers/positions_hanlder.py)
+THUMB_ORDERS = (168, 140)     # отчёт по заказам (handlers/orders_handler.py)
+THUMB_DAILY = (80, 80)        # ежедневные отчёты и отчёт за день
+
+THUMB_SIZES = (THUMB_DETAIL, THUMB_POSITIONS, THUMB_ORDERS, THUMB_DAILY)
+
+
+def size_key(size: tuple[int, int]) -> str:
+    return f"{size[0]}x{size[1]}"
+
+
+def render_thumbnails(source: bytes) -> dict[str, bytes]:
+    """Все варианты миниатюр из исходной картинки: {"152x200": JPEG-байты, ...}."""
+    img = PILImage.open(io.BytesIO(source)).convert("RGB")
+    variants = {}
+    for size in THUMB_SIZES:
+        out = io.BytesIO()
+        img.resize(size, PILImage.Resampling.LANCZOS).save(out, format="JPEG", optimize=True, quality=70)
+        variants[size_key(size)] = out.getvalue()
+    return variants
+
+
+def upsert_thumbnails(session: Session, items) -> None:
+    """
+    Записывает уже нарисованные миниатюры одним INSERT:
+    items — [(nm_id, source_hash, {"152x200": bytes, ...}), ...],
+    source_hash — хэш картинки товара (products.image_hash), из которой нарисованы миниатюры.
+    Коммит делает вызывающий.
+    """
+    rows = [
+        {"nm_id": nm_id, "size": key, "image": data, "source_hash": source_hash}
+        for nm_id, source_hash, variants in items
+        for key, data in variants.items()
+    ]
+    if not rows:
+        return
+
+    stmt = insert(ProductThumbnail.__table__).values(rows)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["nm_id", "size"],
+        set_={
+            "image": stmt.excluded.image,
+            "source_hash": stmt.excluded.source_hash,
+            "created_at": stmt.excluded.created_at,
+        },
+    )
+    session.execute(stmt)
+
+
+def get_thumbnails(session: Session, nm_ids, size: tuple[int, int]) -> dict[int, bytes]:
+    """
+    Готовые миниатюры размера size для списка товаров одним запросом: {nm_id: JPEG-байты}.
+    Только чтение: сборка отчёта ничего не пишет. Товаров без миниатюр в словаре нет
+    (их дорисовывает backfill_thumbnails()).
+    """
+    key = size_key(size)
+    nm_ids = {nm_id for nm_id in nm_ids if nm_id}
+    if not nm_ids:
+        return {}
+
+    return dict(
+        session.query(ProductThumbnail.nm_id, ProductThumbnail.image)
+        .filter(ProductThumbnail.size == key, ProductThumbnail.nm_id.in_(nm_ids))
+        .all()
+    )
+
+
+def backfill_thumbnails(batch_size: int = IMAGE_WRITE_BATCH) -> int:
+    """
+    Дорисовка миниатюр (шедулер запускает при старте бота, в потоке):
+    товарам, у которых каких-то размеров нет или они нарисованы с другой
+    картинки (source_hash != image_hash), рисуем их из картинки товара
+    в media_blobs. Пишем пачками по batch_size товаров, коммит — на пачку.
+    Возвращает, скольким товарам дорисовали миниатюры.
+    """
+    session = SessionLocal()
+    try:
+        fresh = (
+            select(func.count())
+            .select_from(ProductThumbnail)
+            .where(
+                ProductThumbnail.nm_id == Product.nm_id,
+                ProductThumbnail.source_hash == Product.image_hash,
+            )
+            .scalar_subquery()
+        )
+        image_hashes = dict(
+            session.query(Product.nm_id, Product.image_hash)
+            .filter(Product.image_hash.isnot(None), fresh < len(THUMB_SIZES))
+            .all()
+        )
+        session.rollback()
+
+        nm_ids = list(image_hashes)
+        done = 0
+        for i in range(0, len(nm_ids), batch_size):
+            items = []
+            for nm_id, source in get_product_images(session, nm_ids[i:i + batch_size]).items():
+                try:
+                    items.append((nm_id, image_hashes[nm_id], render_thumbnails(source)))
+                except Exception as e:
+                    logger.warning(f"[thumbnails] nm_id={nm_id}: не удалось нарисовать миниатюры: {e}")
+            upsert_thumbnails(session, items)
+            session.commit()
+            done += len(items)
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+
+    if done:
+        logger.info(f"[thumbnails] дорисованы миниатюры для {done} товаров из {len(nm_ids)}")
+    return done
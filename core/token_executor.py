@@ -0,0 +1,50 @@
+# core/token_executor.py
+import asyncio
+from typing import Awaitable, Callable, TypeVar
+
+from config import TOKEN_CONCURRENCY, TOKEN_TIMEOUT, DB_POOL_SIZE
+from db.models import Token
+from utils.logger import logger
+
+T = TypeVar("T")
+
+
+async def run_for_tokens(
+    tokens: list[Token],
+    worker: Callable[[Token], Awaitable[T]],
+    concurrency: int = TOKEN_CONCURRENCY,
+    timeout: float | None = TOKEN_TIMEOUT,
+    label: str = "tokens",
+) -> list[T]:
+    """
+    Запускает worker(token_obj) для всех токенов параллельно,
+    но не больше `concurrency` одновременно.
+
+    • каждый токен ограничен `timeout` секунд (None — без ограничения);
+    • ошибка или таймаут одного токена не валит остальные — такой токен
+      просто пропускается (пишем в лог);
+    • результат — список ответов worker в порядке списка tokens
+      (без пропущенных), поэтому склейка результатов детерминирована.
+
+    worker должен сам открывать/закрывать свою SessionLocal():
+    одну сессию SQLAlchemy нельзя делить между параллельными задачами.
+    """
+    if not tokens:
+        return []
+
+    # У каждого воркера своя сессия: токенов сверх пула соединений БД параллельно
+    # не запускаем — иначе синхронное ожидание соединения встанет посреди цикла событий
+    sem = asyncio.Semaphore(max(1, min(concurrency, DB_POOL_SIZE)))
+
+    async def _run_one(token_obj: Token):
+        async with sem:
+            try:
+                return True, await asyncio.wait_for(worker(token_obj), timeout=timeout)
+            except asyncio.TimeoutError:
+                logger.warning(f"[{label}] token_id={token_obj.id}: превышен таймаут {timeout} сек, пропускаем.")
+            except Exception as e:
+                logger.exception(f"[{label}] token_id={token_obj.id}: ошибка {type(e).__name__}: {e}")
+            return False, None
+
+    results = await asyncio.gather(*(_run_one(t) for t in tokens))
+    return [value for ok, value in results if ok]
@@ -4,9 +4,9 @@ import logging
 import sys
 from db.database import SessionLocal
 from db.models import Product
-from PIL import Image as PILImage
 from parse_wb import parse_wildberries
 from core.wildberries_api import get_rating_and_feedbacks
+from core.image_pipeline import fetch_and_store_images
 
 
 logging.basicConfig(
@@ -23,7 +23,8 @@ async def update_products_if_outdated():
     """
     Проверяет товары, у которых last_update > 30 дней назад или rating/reviews=NULL.
     Парсит актуальные данные с помощью parse_wildberries(url) и обновляет рейтинг, отзывы, image_url.
-    Создаёт/обновляет миниатюру изображения (resize_img) размером 200x200 пикселей и устанавливает current timestamp в last_update.
+    Создаёт/обновляет миниатюру изображения (media_blobs) размером 200x200 пикселей и устанавливает current timestamp в last_update.
+    Картинки скачиваются в конце, все вместе, через core/image_pipeline.py.
     """
     logger.info("Начало процедуры обновления товаров...")
     
@@ -32,19 +33,23 @@ async def update_products_if_outdated():
     # Определяем границу дат для отбора товаров (30 дней назад)
     cutoff_date = datetime.datetime.utcnow() - datetime.timedelta(days=30)
     
-    # Выбираем товары, удовлетворяющие условиям фильтрации
-    products_to_update = session.query(Product).filter(
-        (Product.last_update < cutoff_date) |
-        (Product.rating.is_(None)) |
-        (Product.reviews.is_(None))
-    ).all()
+    # Выбираем товары, удовлетворяющие условиям фильтрации.
+    # Берём только (id, nm_id): сессию закрываем до запросов к WB
+    try:
+        products_to_update = session.query(Product.id, Product.nm_id).filter(
+            (Product.last_update < cutoff_date) |
+            (Product.rating.is_(None)) |
+            (Product.reviews.is_(None))
+        ).all()
+    finally:
+        session.close()
     
     logger.info(f"Найдено {len(products_to_update)} товаров для обновления.")
+    image_urls = {}  # nm_id -> URL картинки
     
-    for idx, product in enumerate(products_to_update, start=1):
-        nm_id = product.nm_id
+    for idx, (product_id, nm_id) in enumerate(products_to_update, start=1):
         if not nm_id:
-            logger.warning(f"Пропускаем продукт #{product.id} (нет nm_id)")
+            logger.warning(f"Пропускаем продукт #{product_id} (нет nm_id)")
             continue
         
         logger.info(f"{idx}/{len(products_to_update)}. Обрабатываю nm_id={nm_id}")
@@ -66,45 +71,35 @@ async def update_products_if_outdated():
             logger.error(f"Ошибка при парсинге nm_id={nm_id}: {e}")
             continue
         
-        # Обновляем рейтинг и отзывы
-        product.rating = float(rating) if rating is not None else None
-        product.reviews = int(reviews) if reviews is not None else None
-        
-        # Обновляем URL изображения
         new_image_url = parse_result.get("image_url", "")
-        product.image_url = new_image_url
-        
-        # Загружаем и масштабируем изображение до размера 200x200 px
-        if new_image_url and "не найден" not in new_image_url.lower():
-            try:
-                from PIL import Image
-                import requests
-                from io import BytesIO
-                
-                response = requests.get(new_image_url, stream=True, timeout=10)
-                response.raise_for_status()
-                
-                img = Image.open(BytesIO(response.content)).convert("RGB")
-                resized_img = img.resize((200, 200), resample=Image.Resampling.LANCZOS)
-                
-                output_buffer = BytesIO()
-                resized_img.save(output_buffer, format="JPEG")
-                output_buffer.seek(0)
-                
-                product.resize_img = output_buffer.read()
-            except Exception as ex:
-                logger.warning(f"Ошибка при обработке изображения nm_id={nm_id}: {ex}")
         
-        # Устанавливаем отметку времени последнего обновления
-        product.last_update = datetime.datetime.utcnow()
+        # Картинку скачаем потом, вместе с остальными (core/image_pipeline.py)
+        image_urls[nm_id] = new_image_url
         
-        # Фиксируем изменения в базе данных
+        # Короткая транзакция на запись (ответы WB уже получены)
+        session = SessionLocal()
         try:
+            product = session.get(Product, product_id)
+            if product is None:
+                continue
+            # Обновляем рейтинг и отзывы
+            product.rating = float(rating) if rating is not None else None
+            product.reviews = int(reviews) if reviews is not None else None
+            # Обновляем URL изображения
+            product.image_url = new_image_url
+            # Устанавливаем отметку времени последнего обновления
+            product.last_update = datetime.datetime.utcnow()
             session.commit()
             logger.info(f"Успешно обновлён nm_id={nm_id}")
         except Exception as exc:
             session.rollback()
             logger.error(f"Ошибка сохранения nm_id={nm_id}: {exc}")
+        finally:
+            session.close()
     
-    session.close()
+    # Картинки: параллельное скачивание, ресайз в пуле потоков, запись пачками
+    if image_urls:
+        image_hashes = await fetch_and_store_images(image_urls)
+        logger.info(f"Обновлено картинок: {len(image_hashes)} из {len(image_urls)}")
+
     logger.info("Завершение процедуры обновления товаров.")
@@ -6,6 +6,7 @@ from typing import List, Dict, Any
 import traceback
 import json
 import re
+from core.http_client import get_http_client
 
 BASE_URL = "https://statistics-api.wildberries.ru/api"
 SUPPLIES_BASE_URL = "https://supplies-api.wildberries.ru/api"
@@ -39,10 +40,9 @@ async def get_orders(date_from: str, user_token:str, flag: int = 0):
     url = f"{BASE_URL}/v1/supplier/orders"
 
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url, headers=headers, params=params, timeout=30) as resp:
-                resp.raise_for_status()
-                return await resp.json()
+        async with get_http_client().get(url, headers=headers, params=params, timeout=30) as resp:
+            resp.raise_for_status()
+            return await resp.json()
     except Exception as e:
         print(f"Ошибка при запросе к Wildberries /orders: {e}")
         return []
@@ -70,22 +70,22 @@ async def get_report_detail_by_period(
     }
     url = f"{BASE_URL}/v5/supplier/reportDetailByPeriod"
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url, headers=headers, params=params, timeout=30) as resp:
-                resp.raise_for_status()
-                return await resp.json()
+        async with get_http_client().get(url, headers=headers, params=params, timeout=30) as resp:
+            resp.raise_for_status()
+            return await resp.json()
     except Exception as e:
         print(f"Ошибка при запросе к Wildberries /report_detail: {e}")
         return []
 
-async def fetch_full_report(date_from: str, date_to: str, user_token: str) -> list[dict]:
+async def fetch_full_report(date_from: str, date_to: str, user_token: str, rrdid: int = 0) -> list[dict]:
     """
     Выгружает все строки отчёта за период [date_from, date_to],
     используя постраничный (построчный) подход по rrdid.
+    rrdid: последний уже сохранённый rrd_id — тогда WB отдаст только строки после него.
     Возвращает общий список (list) со всеми записями.
     """
     all_data = []
-    current_rrdid = 0
+    current_rrdid = rrdid
     limit = 100000
 
     while True:
@@ -123,10 +123,9 @@ async def get_sales(date_from: str, user_token:str, flag: int = 0) -> list[dict]
     }
     url = f"{BASE_URL}/v1/supplier/sales"
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url, headers=headers, params=params, timeout=30) as resp:
-                resp.raise_for_status()
-                return await resp.json()
+        async with get_http_client().get(url, headers=headers, params=params, timeout=30) as resp:
+            resp.raise_for_status()
+            return await resp.json()
     except Exception as e:
         print(f"Ошибка при запросе к Wildberries /sales: {e}")
         return []
@@ -143,10 +142,9 @@ async def get_stocks(date_from: str, user_token:str) -> list[dict]:
     }
     url = f"{BASE_URL}/v1/supplier/stocks"
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url, headers=headers, params=params, timeout=30) as resp:
-                resp.raise_for_status()
-                return await resp.json()
+        async with get_http_client().get(url, headers=headers, params=params, timeout=30) as resp:
+            resp.raise_for_status()
+            return await resp.json()
     except Exception as e:
         print(f"Ошибка при запросе к Wildberries /stocks: {e}")
         return []
@@ -164,10 +162,9 @@ async def get_incomes(date_from: str, user_token: str) -> list[dict]:
     url = f"{BASE_URL}/v1/supplier/incomes"
 
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url, headers=headers, params=params, timeout=30) as resp:
-                resp.raise_for_status()
-                return await resp.json()
+        async with get_http_client().get(url, headers=headers, params=params, timeout=30) as resp:
+            resp.raise_for_status()
+            return await resp.json()
     except Exception as e:
         print(f"Ошибка при запросе к Wildberries /incomes: {e}")
         return []
@@ -213,10 +210,9 @@ async def get_tariffs_for_date(user_token: str, kind: str = "box",  dt: datetime
     params = {"date": dt}
     timeout = aiohttp.ClientTimeout(total=30)
 
-    async with aiohttp.ClientSession(timeout=timeout) as s:
-        async with s.get(url, headers=headers, params=params) as r:
-            r.raise_for_status()
-            full = await r.json()
+    async with get_http_client().get(url, headers=headers, params=params, timeout=timeout) as r:
+        r.raise_for_status()
+        full = await r.json()
 
     # аккуратнее достаём список складов
     data = full.get("response", {}).get("data", {})
@@ -272,10 +268,9 @@ async def get_acceptance_coefficients(user_token: str) -> list[dict]:
     url = f"{SUPPLIES_BASE_URL}/v1/acceptance/coefficients"
 
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url, headers=headers, timeout=30) as resp:
-                resp.raise_for_status()
-                return await resp.json()
+        async with get_http_client().get(url, headers=headers, timeout=30) as resp:
+            resp.raise_for_status()
+            return await resp.json()
     except Exception as e:
         print(f"Ошибка при запросе к Wildberries /accept_coef: {e}")
         return []
@@ -320,25 +315,72 @@ async def get_promo_text_card(nm_id: int) -> str:
     }
 
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(BASE_CARDS_URL, headers=headers, params=params, timeout=20) as resp:
-                if resp.status != 200:
-                    print(f"[get_promo_text_card] nm_id={nm_id}, status={resp.status}")
-                    return ""
-                text_data = await resp.text()
-                data = json.loads(text_data)
-                products = data.get("data", {}).get("products", [])
-                if not products:
-                    return ""
-                # Берём первую запись
-                product = products[0]
-                promo_text = product.get("promoTextCard", "")
-                return promo_text or ""
+        async with get_http_client().get(BASE_CARDS_URL, headers=headers, params=params, timeout=20) as resp:
+            if resp.status != 200:
+                print(f"[get_promo_text_card] nm_id={nm_id}, status={resp.status}")
+                return ""
+            text_data = await resp.text()
+            data = json.loads(text_data)
+            products = data.get("data", {}).get("products", [])
+            if not products:
+                return ""
+            # Берём первую запись
+            product = products[0]
+            promo_text = product.get("promoTextCard", "")
+            return promo_text or ""
     except Exception as e:
         print(f"[get_promo_text_card] nm_id={nm_id}, исключение: {type(e).__name__} => {e}")
         traceback.print_exc()
         return ""
 
+async def get_cards_batch(nm_ids: list[int]) -> dict[int, dict] | None:
+    """
+    Карточки сразу нескольких товаров одним запросом (card.wb.ru принимает nm=a;b;c).
+
+    Возвращает {nm_id: {"promo_text": str, "rating": float | None, "feedbacks": int | None}}.
+    Товаров, которых WB не вернул, в словаре нет. При ошибке запроса — None
+    (в отличие от пустого словаря: «WB ответил, но таких товаров нет»).
+    """
+    if not nm_ids:
+        return {}
+
+    params = {
+        "appType": "1",
+        "curr": "rub",
+        "dest": "-1785058",
+        "hide_dtype": "13",
+        "spp": "30",
+        "ab_testing": "false",
+        "lang": "ru",
+        "nm": ";".join(str(nm_id) for nm_id in nm_ids)
+    }
+    headers = {
+        "accept": "*/*",
+        "user-agent": "Mozilla/5.0 (compatible; WBWizardBot/1.0; +https://example.com)"
+    }
+
+    try:
+        async with get_http_client().get(BASE_CARDS_URL, headers=headers, params=params, timeout=20) as resp:
+            if resp.status != 200:
+                print(f"[get_cards_batch] {len(nm_ids)} nm_id, status={resp.status}")
+                return None
+            data = json.loads(await resp.text())
+    except Exception as e:
+        print(f"[get_cards_batch] {len(nm_ids)} nm_id, исключение: {type(e).__name__} => {e}")
+        return None
+
+    cards = {}
+    for product in data.get("data", {}).get("products", []):
+        nm_id = product.get("id")
+        if not nm_id:
+            continue
+        cards[nm_id] = {
+            "promo_text": product.get("promoTextCard", "") or "",
+            "rating": product.get("reviewRating"),
+            "feedbacks": product.get("feedbacks"),
+        }
+    return cards
+
 async def get_search_queries_mayak(nm_id: int) -> list[dict]:
     """
     Делает запрос к сервису https://app.mayak.bz/api/v1/wb/products/{nm_id}/word_ranks,
@@ -362,17 +404,16 @@ async def get_search_queries_mayak(nm_id: int) -> list[dict]:
     }
 
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url, headers=headers, timeout=30) as resp:
-                if resp.status != 200:
-                    print(f"[get_search_queries_mayak] nm_id={nm_id}, status={resp.status}")
-                    return []
-                text_data = await resp.text()
-                data = json.loads(text_data)
-                # Предположим, API возвращает что-то вроде {"data": {...}}
-                # Надо смотреть реальный формат. Если "word_ranks" - это ключ, ищите data["word_ranks"] и т.д.
-                # Ниже просто пример, как вернуть data
-                return data  # Или data.get("word_ranks", [])
+        async with get_http_client().get(url, headers=headers, timeout=30) as resp:
+            if resp.status != 200:
+                print(f"[get_search_queries_mayak] nm_id={nm_id}, status={resp.status}")
+                return []
+            text_data = await resp.text()
+            data = json.loads(text_data)
+            # Предположим, API возвращает что-то вроде {"data": {...}}
+            # Надо смотреть реальный формат. Если "word_ranks" - это ключ, ищите data["word_ranks"] и т.д.
+            # Ниже просто пример, как вернуть data
+            return data  # Или data.get("word_ranks", [])
 
     except Exception as e:
         print(f"[get_search_queries_mayak] nm_id={nm_id}, исключение: {type(e).__name__} => {e}")
@@ -403,10 +444,9 @@ async def get_rating_and_feedbacks(nm_id: int,
     }
 
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(CARD_BASE_URL, params=params, timeout=15) as resp:
-                resp.raise_for_status()
-                data = await resp.json()
+        async with get_http_client().get(CARD_BASE_URL, params=params, timeout=15) as resp:
+            resp.raise_for_status()
+            data = await resp.json()
 
         product = data.get("data", {}).get("products", [{}])[0]
         rating   = product.get("reviewRating")        # float 4.6
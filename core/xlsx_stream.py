@@ -0,0 +1,96 @@
+# core/xlsx_stream.py
+from collections import defaultdict
+
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.utils.cell import coordinate_from_string, column_index_from_string, get_column_letter
+
+
+def streaming_workbook() -> Workbook:
+    """
+    Книга в режиме write_only: готовые листы сразу уходят во временные файлы,
+    в памяти держится только лист, который сейчас пишется.
+    """
+    return Workbook(write_only=True)
+
+
+class StreamSheet:
+    """
+    Лист потоковой книги с привычным адресным доступом: ws.cell(row, column),
+    ws["A1"], merge_cells(), add_image(), add_chart(), размеры строк и столбцов.
+
+    Ячейки копятся только в пределах этого листа; close() выписывает их
+    строками по порядку и закрывает лист — после этого он больше не занимает
+    память (кроме картинок и графиков, которые openpyxl пишет при save).
+    Лист нужно закрыть до того, как браться за следующий.
+    """
+
+    def __init__(self, wb: Workbook, title: str):
+        self.ws = wb.create_sheet(title=title)
+        self._cells: dict[int, dict[int, WriteOnlyCell]] = defaultdict(dict)
+        self.max_row = 0
+        self.max_column = 0
+
+    @property
+    def title(self) -> str:
+        return self.ws.title
+
+    @property
+    def column_dimensions(self):
+        return self.ws.column_dimensions
+
+    @property
+    def row_dimensions(self):
+        return self.ws.row_dimensions
+
+    @property
+    def sheet_state(self) -> str:
+        return self.ws.sheet_state
+
+    @sheet_state.setter
+    def sheet_state(self, value: str) -> None:
+        self.ws.sheet_state = value
+
+    def cell(self, row: int, column: int, value=None) -> WriteOnlyCell:
+        """Ячейка (создаётся при первом обращении); стили можно задавать до close()."""
+        cells = self._cells[row]
+        c = cells.get(column)
+        if c is None:
+            c = cells[column] = WriteOnlyCell(self.ws)
+            self.max_row = max(self.max_row, row)
+            self.max_column = max(self.max_column, column)
+        if value is not None:
+            c.value = value
+        return c
+
+    def __getitem__(self, coordinate: str) -> WriteOnlyCell:
+        col, row = coordinate_from_string(coordinate)
+        return self.cell(row=row, column=column_index_from_string(col))
+
+    def merge_cells(self, range_string: str = None, start_row: int = None, start_column: int = None,
+                    end_row: int = None, end_column: int = None) -> None:
+        if range_string is None:
+            range_string = (
+                f"{get_column_letter(start_column)}{start_row}:"
+                f"{get_column_letter(end_column)}{end_row}"
+            )
+        self.ws.merged_cells.add(range_string)
+
+    def add_image(self, img, anchor: str) -> None:
+        self.ws.add_image(img, anchor)
+
+    def add_chart(self, chart, anchor: str) -> None:
+        self.ws.add_chart(chart, anchor)
+
+    def close(self) -> None:
+        """Выписывает строки листа и закрывает его."""
+        # Строки без ячеек, но с заданной высотой (например, под картинки) тоже пишем
+        last_row = max([self.max_row, *self.ws.row_dimensions.keys()])
+        for row in range(1, last_row + 1):
+            cells = self._cells.pop(row, None)
+            if not cells:
+                self.ws.append([])
+                continue
+            self.ws.append([cells.get(col) for col in range(1, max(cells) + 1)])
+        self._cells.clear()
+        self.ws.close()
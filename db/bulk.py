@@ -0,0 +1,128 @@
+# db/bulk.py
+from dataclasses import dataclass, field
+from typing import Any, Callable, Sequence
+
+from sqlalchemy import literal_column, select, tuple_
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+
+# Строк в одном SELECT/INSERT. 1000 строк × ~20 колонок — с запасом
+# укладываемся в лимит 65535 параметров PostgreSQL.
+BULK_CHUNK = 1000
+
+
+@dataclass
+class UpsertResult:
+    """
+    Что реально записалось в БД. Строки — словари «колонка → значение»
+    в том виде, в каком их вернул RETURNING, в порядке входных данных.
+    """
+    inserted: list[dict] = field(default_factory=list)
+    updated: list[dict] = field(default_factory=list)
+    changed: list[dict] = field(default_factory=list)  # inserted + updated вперемешку, в порядке входа
+
+
+def bulk_upsert(
+    session: Session,
+    model,
+    rows: Sequence[dict],
+    key_columns: Sequence[str],
+    diff: Callable[[dict, dict], dict | None],
+    chunk_size: int = BULK_CHUNK,
+) -> UpsertResult:
+    """
+    Пакетный upsert вместо пары query().first() + add()/commit() на каждую строку.
+
+    Для каждой пачки из chunk_size строк:
+      1) одним SELECT забираем уже существующие записи по ключу key_columns;
+      2) в памяти решаем, что делать: строки без записи в БД — вставляем,
+         для существующих вызываем diff(new_row, old_row), который возвращает
+         словарь изменённых колонок (пустой/None — строка не изменилась);
+      3) новые и изменённые строки пишем одним
+         INSERT ... ON CONFLICT (key_columns) DO UPDATE ... RETURNING.
+
+    Требования:
+      • на key_columns в таблице есть уникальный индекс/ограничение;
+      • у всех rows одинаковый набор ключей (имена колонок таблицы).
+
+    Дубликаты ключа внутри rows схлопываются — побеждает последняя строка
+    (WB отдаёт данные по возрастанию lastChangeDate).
+    Коммит не делаем — это решает вызывающий.
+    """
+    result = UpsertResult()
+    if not rows:
+        return result
+
+    table = model.__table__
+    key_columns = list(key_columns)
+    columns = list(rows[0].keys())
+
+    def _key(row: dict) -> tuple:
+        return tuple(row[k] for k in key_columns)
+
+    # Схлопываем дубликаты ключа, сохраняя порядок первого появления
+    unique_rows: dict[tuple, dict] = {}
+    for row in rows:
+        unique_rows[_key(row)] = row
+    batch_rows = list(unique_rows.values())
+
+    key_cols = [table.c[k] for k in key_columns]
+    update_cols = [c for c in columns if c not in key_columns and not table.c[c].primary_key]
+
+    for i in range(0, len(batch_rows), chunk_size):
+        chunk = batch_rows[i:i + chunk_size]
+
+        # 1) Существующие записи одной выборкой
+        if len(key_cols) == 1:
+            cond = key_cols[0].in_([row[key_columns[0]] for row in chunk])
+        else:
+            cond = tuple_(*key_cols).in_([_key(row) for row in chunk])
+        existing = {
+            _key(old): dict(old)
+            for old in session.execute(select(table).where(cond)).mappings()
+        }
+
+        # 2) Диф в памяти
+        payload: list[dict] = []
+        for row in chunk:
+            old = existing.get(_key(row))
+            if old is None:
+                payload.append({c: row.get(c) for c in columns})
+                continue
+            changes = diff(row, old)
+            if not changes:
+                continue
+            merged = {c: old.get(c) for c in columns}
+            merged.update({c: v for c, v in changes.items() if c in merged})
+            payload.append(merged)
+
+        if not payload:
+            continue
+
+        # 3) Запись одной командой
+        stmt = insert(table).values(payload)
+        if update_cols:
+            stmt = stmt.on_conflict_do_update(
+                index_elements=key_columns,
+                set_={c: stmt.excluded[c] for c in update_cols},
+            )
+        else:
+            stmt = stmt.on_conflict_do_nothing(index_elements=key_columns)
+        # xmax = 0 только у только что вставленной версии строки
+        stmt = stmt.returning(*table.c, literal_column("(xmax = 0)").label("_inserted"))
+
+        written: dict[tuple, tuple[dict[str, Any], bool]] = {}
+        for ret in session.execute(stmt).mappings():
+            ret = dict(ret)
+            is_inserted = ret.pop("_inserted")
+            written[_key(ret)] = (ret, is_inserted)
+
+        for row in payload:
+            hit = written.get(_key(row))
+            if hit is None:
+                continue
+            ret, is_inserted = hit
+            (result.inserted if is_inserted else result.updated).append(ret)
+            result.changed.append(ret)
+
+    return result
@@ -0,0 +1,94 @@
+# db/copy_writer.py
+import asyncio
+import datetime
+import io
+from typing import Sequence
+
+from sqlalchemy.orm import Session
+
+# Строк в одной команде COPY. Буфер держим ограниченным:
+# когда он полон, продюсер ждёт, пока пачка уйдёт в БД.
+COPY_BATCH = 10000
+
+
+def _copy_value(value) -> str:
+    """Значение в текстовом формате COPY (NULL — \\N, спецсимволы экранируем)."""
+    if value is None:
+        return "\\N"
+    if isinstance(value, bool):
+        return "t" if value else "f"
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    text = str(value)
+    return (
+        text.replace("\\", "\\\\")
+            .replace("\t", "\\t")
+            .replace("\n", "\\n")
+            .replace("\r", "\\r")
+    )
+
+
+class CopyWriter:
+    """
+    Потоковая запись большого числа строк в одну таблицу через PostgreSQL COPY
+    вместо session.add() на каждую строку.
+
+    Строки копятся кортежами в порядке columns; каждые batch_size строк
+    уходят одной командой COPY ... FROM STDIN (psycopg2 copy_expert).
+    COPY идёт через соединение переданной сессии, то есть в её транзакции:
+    коммит (вместе с прочими изменениями) делает вызывающий.
+
+    Асинхронный код пишет через put()/flush_async(): сама команда COPY
+    выполняется в отдельном потоке, а продюсер ждёт её завершения —
+    так краулер не может обогнать запись больше чем на одну пачку.
+    Пока идёт flush_async, сессию больше никто использовать не должен.
+    """
+
+    def __init__(self, session: Session, model, columns: Sequence[str], batch_size: int = COPY_BATCH):
+        self.session = session
+        self.table = model.__table__.name
+        self.columns = list(columns)
+        self.batch_size = max(1, batch_size)
+        self._rows: list[tuple] = []
+        self.written = 0
+
+    def add(self, row: tuple) -> None:
+        """Добавить строку; при заполнении буфера пачка пишется сразу (синхронно)."""
+        self._rows.append(row)
+        if len(self._rows) >= self.batch_size:
+            self.flush()
+
+    async def put(self, row: tuple) -> None:
+        """Добавить строку; при заполнении буфера ждём, пока пачка уйдёт в БД."""
+        self._rows.append(row)
+        if len(self._rows) >= self.batch_size:
+            await self.flush_async()
+
+    def flush(self) -> None:
+        """Записать всё накопленное одной командой COPY."""
+        rows, self._rows = self._rows, []
+        if rows:
+            self._copy(self.session.connection().connection, rows)
+
+    async def flush_async(self) -> None:
+        """То же, что flush(), но COPY выполняется в отдельном потоке."""
+        rows, self._rows = self._rows, []
+        if rows:
+            # Соединение берём в потоке цикла событий, в рабочем только пишем в него
+            dbapi_conn = self.session.connection().connection
+            await asyncio.to_thread(self._copy, dbapi_conn, rows)
+
+    def _copy(self, dbapi_conn, rows: list[tuple]) -> None:
+        buf = io.StringIO()
+        for row in rows:
+            buf.write("\t".join(_copy_value(v) for v in row))
+            buf.write("\n")
+        buf.seek(0)
+
+        columns = ", ".join(f'"{c}"' for c in self.columns)
+        cursor = dbapi_conn.cursor()
+        try:
+            cursor.copy_expert(f'COPY "{self.table}" ({columns}) FROM STDIN', buf)
+        finally:
+            cursor.close()
+        self.written += len(rows)
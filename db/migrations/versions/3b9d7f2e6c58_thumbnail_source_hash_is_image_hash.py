@@ -0,0 +1,36 @@
+"""Thumbnail source_hash is the product image_hash
+
+Revision ID: 3b9d7f2e6c58
+Revises: 7e4a1c9d2b63
+Create Date: 2026-10-17 20:41:53.120587
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3b9d7f2e6c58'
+down_revision: Union[str, None] = '7e4a1c9d2b63'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Раньше при загрузке товара source_hash был хэшем скачанного исходника,
+    # а при дорисовке — хэшем картинки 200x200. Теперь это всегда products.image_hash:
+    # миниатюры, нарисованные при загрузке, к картинке товара и относятся.
+    op.execute("""
+        UPDATE product_thumbnails t
+        SET source_hash = p.image_hash
+        FROM products p
+        WHERE p.nm_id = t.nm_id
+          AND p.image_hash IS NOT NULL
+    """)
+
+
+def downgrade() -> None:
+    # Хэши исходников не сохранялись — вернуть их нельзя (и не нужно)
+    pass
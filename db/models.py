@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, Boolean, Float, LargeBinary, Text, BigInteger, ForeignKey, LargeBinary, UniqueConstraint, Numeric, text
+from sqlalchemy import Column, Integer, String, DateTime, Date, Boolean, Float, LargeBinary, Text, BigInteger, ForeignKey, LargeBinary, UniqueConstraint, Numeric, text, Index
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.sql import func
 from sqlalchemy.orm import relationship
@@ -121,6 +121,10 @@ class Order(Base):
     spp = Column(Integer)  # скидка в процентах
     is_cancel = Column(Boolean, default=False)  # отменен ли заказ (отказ)
 
+    __table_args__ = (
+        Index('ix_orders_token_change', 'token_id', 'last_change_date'),  # водяной знак отчётов (core/report_cache.py)
+    )
+
 
 class Product(Base):
     __tablename__ = "products"
@@ -136,7 +140,45 @@ class Product(Base):
     rating = Column(Float, nullable=True)  # рейтинг
     reviews = Column(Integer, nullable=True)  # количество отзывов
     last_update = Column(DateTime, default=datetime.datetime.utcnow)  # дата последнего обновления
-    resize_img = Column(LargeBinary, nullable=True)  # уменьшенное изображение
+    image_hash = Column(String(64), ForeignKey("media_blobs.hash"), nullable=True)  # sha256 картинки 200x200
+
+    __table_args__ = (
+        Index('ix_products_token_update', 'token_id', 'last_update'),  # водяной знак отчётов (core/report_cache.py)
+    )
+
+class MediaBlob(Base):
+    """
+    Хранилище картинок по содержимому: ключ — sha256 байтов,
+    одинаковые картинки хранятся один раз (core/media_store.py).
+    Товары ссылаются на картинку через Product.image_hash,
+    поэтому выборки по products не тянут байты картинок.
+    """
+    __tablename__ = "media_blobs"
+
+    hash       = Column(String(64), primary_key=True)  # sha256, hex
+    data       = Column(LargeBinary, nullable=False)
+    size       = Column(Integer, nullable=False)  # размер в байтах
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+
+class ProductThumbnail(Base):
+    """
+    Готовые миниатюры товара для отчётов: по одной на (nm_id, размер).
+    Рисуются один раз, когда товар скачивает картинку (core/thumbnails.py),
+    source_hash — products.image_hash картинки, с которой они нарисованы:
+    не совпадает — backfill_thumbnails() перерисовывает.
+    """
+    __tablename__ = "product_thumbnails"
+
+    id          = Column(Integer, primary_key=True, autoincrement=True)
+    nm_id       = Column(Integer, nullable=False)
+    size        = Column(String(20), nullable=False)   # "152x200", "80x80", ...
+    image       = Column(LargeBinary, nullable=False)  # JPEG
+    source_hash = Column(String(64), nullable=False)
+    created_at  = Column(DateTime, default=datetime.datetime.utcnow)
+
+    __table_args__ = (
+        UniqueConstraint('nm_id', 'size', name='uq_product_thumbnail_nm_size'),  # 1 миниатюра – 1 товар+размер
+    )
 
 class ReportDetails(Base):
     __tablename__ = "report_details"
@@ -148,6 +190,12 @@ class ReportDetails(Base):
     order_dt = Column(String, nullable=False)  # дата заказа
     commission_percent = Column(Float, default=0.0)  # процент комиссии
     report_type = Column(Integer, server_default="0", nullable=True)  # тип отчета
+    token_id = Column(Integer, ForeignKey("tokens.id"), nullable=False)  # чей отчёт
+    rrd_id = Column(BigInteger, nullable=False)  # номер строки отчёта WB (rrd_id)
+
+    __table_args__ = (
+        UniqueConstraint('token_id', 'rrd_id', name='uq_report_details_token_rrd'),  # 1 строка отчёта – 1 запись
+    )
 
 
 class Sale(Base):
@@ -168,6 +216,10 @@ class Sale(Base):
     total_price = Column(Float, default=0.0)
     spp = Column(Float, default=0.0)
 
+    __table_args__ = (
+        Index('ix_sales_token_change', 'token_id', 'last_change_date'),  # водяной знак отчётов (core/report_cache.py)
+    )
+
 
 class Stock(Base):
     __tablename__ = "stocks"
@@ -182,6 +234,11 @@ class Stock(Base):
     subject = Column(String(50), nullable=True)  # Предмет
     inWayToClient = Column(Integer, nullable=True)  # Количество товара в пути к клиенту
 
+    __table_args__ = (
+        UniqueConstraint('token_id', 'nm_id', 'warehouseName', name='uq_stock_token_nm_warehouse'),  # 1 остаток – 1 товар+склад
+        Index('ix_stocks_token_change', 'token_id', 'last_change_date'),  # водяной знак отчётов (core/report_cache.py)
+    )
+
 class Income(Base):
     __tablename__ = "incomes"
 
@@ -204,6 +261,10 @@ class Income(Base):
     nm_id = Column(Integer, nullable=True)           # nmId
     status = Column(String(50), nullable=True)       # status
 
+    __table_args__ = (
+        UniqueConstraint('token_id', 'income_id', 'nm_id', name='uq_income_token_income_nm'),  # 1 поставка – 1 товар
+    )
+
 
 class AcceptanceCoefficient(Base):
     __tablename__ = "acceptance_coefficients"
@@ -262,6 +323,56 @@ class ProductPositions(Base):
 
     city_id = Column(Integer, ForeignKey("dest_city.id"), nullable=False)
 
+class ProductPositionCurrent(Base):
+    """
+    Последняя известная позиция товара по запросу в городе.
+    product_positions — история (дописывается каждым обходом),
+    здесь — по одной строке на (token_id, nm_id, query_text, city_id),
+    краулер обновляет её upsert'ом.
+    """
+    __tablename__ = "product_positions_current"
+
+    id            = Column(Integer, primary_key=True, autoincrement=True)
+    token_id      = Column(Integer, ForeignKey("tokens.id"), nullable=False)
+    nm_id         = Column(Integer, nullable=False)
+    query_text    = Column(Text, nullable=False)
+    city_id       = Column(Integer, ForeignKey("dest_city.id"), nullable=False)
+    request_count = Column(Integer, nullable=True)
+    page          = Column(Integer, nullable=True)
+    position      = Column(Integer, nullable=True)
+    check_dt      = Column(DateTime, nullable=False, default=datetime.datetime.utcnow)
+
+    __table_args__ = (
+        UniqueConstraint('token_id', 'nm_id', 'query_text', 'city_id',
+                         name='uq_positions_current_key'),        # 1 строка – 1 товар+запрос+город
+        Index('ix_positions_current_city_nm', 'city_id', 'nm_id'),  # подсказки страниц для краулера
+    )
+
+class ProductPositionDaily(Base):
+    """
+    Лучшая позиция товара по запросу в городе за день.
+    Краулер обновляет строку дня после каждого обхода, отчёт по динамике
+    читает только эту таблицу, а не всю историю product_positions.
+    page/position = None — за день товар ни разу не нашли.
+    """
+    __tablename__ = "product_positions_daily"
+
+    id            = Column(Integer, primary_key=True, autoincrement=True)
+    token_id      = Column(Integer, ForeignKey("tokens.id"), nullable=False)
+    nm_id         = Column(Integer, nullable=False)
+    query_text    = Column(Text, nullable=False)
+    city_id       = Column(Integer, ForeignKey("dest_city.id"), nullable=False)
+    day           = Column(Date, nullable=False)
+    request_count = Column(Integer, nullable=True)
+    page          = Column(Integer, nullable=True)
+    position      = Column(Integer, nullable=True)
+
+    __table_args__ = (
+        UniqueConstraint('token_id', 'nm_id', 'query_text', 'city_id', 'day',
+                         name='uq_positions_daily_key'),                  # 1 строка – 1 товар+запрос+город+день
+        Index('ix_positions_daily_token_city_day', 'token_id', 'city_id', 'day'),  # отчёт по динамике
+    )
+
 class ProductSearchRequest(Base):
     __tablename__ = "product_search_requests"
 
@@ -304,4 +415,69 @@ class LogisticTariff(Base):
     __table_args__ = (
         UniqueConstraint('warehouse_id', 'box_type_id',
                          name='uq_wh_box_type'),           # 1 запись – 1 склад+тара
-    )
\ No newline at end of file
+    )
+class SyncCursor(Base):
+    __tablename__ = "sync_cursors"
+
+    id               = Column(Integer, primary_key=True, autoincrement=True)
+    token_id         = Column(Integer, ForeignKey("tokens.id"), nullable=False)
+    endpoint         = Column(String(50), nullable=False)   # orders / sales / stocks / incomes
+    last_change_date = Column(DateTime, nullable=False)      # максимальный lastChangeDate (время WB, как пришло)
+    updated_at       = Column(DateTime, default=datetime.datetime.utcnow,
+                                         onupdate=datetime.datetime.utcnow)
+
+    __table_args__ = (
+        UniqueConstraint('token_id', 'endpoint',
+                         name='uq_sync_cursor_token_endpoint'),  # 1 курсор – 1 токен+метод
+    )
+
+class CrawlRun(Base):
+    """
+    Один обход выдачи (позиции товаров, популярные запросы).
+    Незавершённый обход после падения/перезапуска продолжается с того же места.
+    """
+    __tablename__ = "crawl_runs"
+
+    id          = Column(Integer, primary_key=True, autoincrement=True)
+    kind        = Column(String(50), nullable=False)                  # positions / popular
+    status      = Column(String(20), nullable=False, default="running")  # running / finished / abandoned
+    total_units = Column(Integer, nullable=True)                      # сколько единиц работы в обходе
+    done_units  = Column(Integer, nullable=False, default=0)          # курсор прогресса
+    started_at  = Column(DateTime, nullable=False, default=datetime.datetime.utcnow)
+    updated_at  = Column(DateTime, default=datetime.datetime.utcnow,
+                                   onupdate=datetime.datetime.utcnow)
+    finished_at = Column(DateTime, nullable=True)
+
+    __table_args__ = (
+        Index('ix_crawl_runs_kind_status', 'kind', 'status'),
+    )
+
+class CrawlUnit(Base):
+    """
+    Отметка о завершённой единице работы обхода, например (запрос, город).
+    Пишется в той же транзакции, что и результаты этой единицы.
+    """
+    __tablename__ = "crawl_units"
+
+    id           = Column(Integer, primary_key=True, autoincrement=True)
+    run_id       = Column(Integer, ForeignKey("crawl_runs.id", ondelete="CASCADE"), nullable=False)
+    unit_key     = Column(Text, nullable=False)
+    completed_at = Column(DateTime, nullable=False, default=datetime.datetime.utcnow)
+
+    __table_args__ = (
+        UniqueConstraint('run_id', 'unit_key',
+                         name='uq_crawl_unit_run_key'),  # единица работы выполняется один раз за обход
+    )
+
+class BasketHost(Base):
+    """
+    Выученная карта «vol -> хост CDN с картинками» (vol = nm_id // 100000).
+    Пополняется после успешных проверок картинок (core/basket_hosts.py),
+    чтобы в обычном случае адрес картинки определялся одним HEAD-запросом.
+    """
+    __tablename__ = "basket_hosts"
+
+    vol        = Column(Integer, primary_key=True, autoincrement=False)
+    host       = Column(String(100), nullable=False)  # например basket-12.wbbasket.ru
+    updated_at = Column(DateTime, default=datetime.datetime.utcnow,
+                                  onupdate=datetime.datetime.utcnow)
@@ -7,12 +7,22 @@ from openpyxl.worksheet.worksheet import Worksheet
 from openpyxl.styles import PatternFill, Alignment, Border, Side
 from openpyxl.drawing.image import Image as ExcelImage
 from openpyxl.utils import get_column_letter
-from PIL import Image as PILImage
 from db.database import SessionLocal
-from db.models import Order, Sale, Stock, Product
+from db.models import Order, Sale, Stock
+from core.thumbnails import get_thumbnails, THUMB_DAILY
+from core.report_cache import cached_report
 from states.user_state import user_states
 
 async def generate_excel_report_for_date(token_id: int, day_str: str) -> bytes:
+    """
+    Excel-отчёт за день: собирается в процессе-сборщике (core/report_service.py),
+    цикл событий при этом свободен; пока данные не менялись — берётся из
+    кэша (core/report_cache.py). См. build_excel_report_for_date.
+    """
+    return await cached_report("report_for_day", token_id, day_str, build_excel_report_for_date, token_id, day_str)
+
+
+def build_excel_report_for_date(token_id: int, day_str: str) -> bytes:
     """
     Формирует Excel-отчёт (в виде байтов) за указанный день (формат YYYY-MM-DD),
     по конкретному токену (т.е. для конкретного пользователя).
@@ -57,6 +67,8 @@ async def generate_excel_report_for_date(token_id: int, day_str: str) -> bytes:
             cell.fill = PatternFill(start_color="FF00B050", end_color="FF00B050", fill_type="solid")
 
     row_index = 2
+    # Готовые миниатюры 80x80 (core/thumbnails.py) — одним запросом на лист
+    thumbs = get_thumbnails(session, (o.nm_id for o in orders), THUMB_DAILY)
     for o in orders:
         date_val = o.date.strftime("%Y-%m-%d %H:%M:%S") if o.date else ""
         nm_id = o.nm_id or ""
@@ -72,19 +84,11 @@ async def generate_excel_report_for_date(token_id: int, day_str: str) -> bytes:
         ws_orders.cell(row=row_index, column=6, value=warehouse_val)
         ws_orders.cell(row=row_index, column=7, value=region_val)
 
-        # Картинка
-        product = session.query(Product).filter_by(nm_id=o.nm_id, token_id=token_id).first()
-        if product and product.resize_img:
+        # Картинка — готовая миниатюра 80x80
+        thumb = thumbs.get(o.nm_id)
+        if thumb:
             try:
-                img_data = io.BytesIO(product.resize_img)
-                pil_img = PILImage.open(img_data)
-                pil_img = pil_img.resize((80, 80), PILImage.Resampling.LANCZOS)
-                new_img_bytes = io.BytesIO()
-                pil_img = pil_img.convert("RGB")
-                pil_img.save(new_img_bytes, format="JPEG", optimize=True, quality=70)
-                new_img_bytes.seek(0)
-
-                excel_img = ExcelImage(new_img_bytes)
+                excel_img = ExcelImage(io.BytesIO(thumb))
                 cell_position = f"A{row_index}"
                 ws_orders.add_image(excel_img, cell_position)
                 ws_orders.row_dimensions[row_index].height = 60
@@ -114,6 +118,8 @@ async def generate_excel_report_for_date(token_id: int, day_str: str) -> bytes:
             cell.fill = PatternFill(start_color="FF92D050", end_color="FF92D050", fill_type="solid")
 
     row_index = 2
+    # Готовые миниатюры 80x80 (core/thumbnails.py) — одним запросом на лист
+    thumbs = get_thumbnails(session, (s.nm_id for s in sales), THUMB_DAILY)
     for s in sales:
         date_val = s.date.strftime("%Y-%m-%d %H:%M:%S") if s.date else ""
         nm_id = s.nm_id or ""
@@ -129,19 +135,11 @@ async def generate_excel_report_for_date(token_id: int, day_str: str) -> bytes:
         ws_sales.cell(row=row_index, column=6, value=warehouse_val)
         ws_sales.cell(row=row_index, column=7, value=region_val)
 
-        # Картинка
-        product = session.query(Product).filter_by(nm_id=s.nm_id, token_id=token_id).first()
-        if product and product.resize_img:
+        # Картинка — готовая миниатюра 80x80
+        thumb = thumbs.get(s.nm_id)
+        if thumb:
             try:
-                img_data = io.BytesIO(product.resize_img)
-                pil_img = PILImage.open(img_data)
-                pil_img = pil_img.resize((80, 80), PILImage.Resampling.LANCZOS)
-                new_img_bytes = io.BytesIO()
-                pil_img = pil_img.convert("RGB")
-                pil_img.save(new_img_bytes, format="JPEG", optimize=True, quality=70)
-                new_img_bytes.seek(0)
-
-                excel_img = ExcelImage(new_img_bytes)
+                excel_img = ExcelImage(io.BytesIO(thumb))
                 cell_position = f"A{row_index}"
                 ws_sales.add_image(excel_img, cell_position)
                 ws_sales.row_dimensions[row_index].height = 60
@@ -172,6 +170,8 @@ async def generate_excel_report_for_date(token_id: int, day_str: str) -> bytes:
             cell.fill = PatternFill(start_color="FFFF0000", end_color="FFFF0000", fill_type="solid")
 
     row_index = 2
+    # Готовые миниатюры 80x80 (core/thumbnails.py) — одним запросом на лист
+    thumbs = get_thumbnails(session, (c.nm_id for c in cancels), THUMB_DAILY)
     for c in cancels:
         date_val = c.date.strftime("%Y-%m-%d %H:%M:%S") if c.date else ""
         nm_id = c.nm_id or ""
@@ -189,18 +189,11 @@ async def generate_excel_report_for_date(token_id: int, day_str: str) -> bytes:
         ws_cancels.cell(row=row_index, column=7, value=region_val)
         ws_cancels.cell(row=row_index, column=8, value=is_cancel_val)
 
-        product = session.query(Product).filter_by(nm_id=c.nm_id, token_id=token_id).first()
-        if product and product.resize_img:
+        # Картинка — готовая миниатюра 80x80
+        thumb = thumbs.get(c.nm_id)
+        if thumb:
             try:
-                img_data = io.BytesIO(product.resize_img)
-                pil_img = PILImage.open(img_data)
-                pil_img = pil_img.resize((80, 80), PILImage.Resampling.LANCZOS)
-                new_img_bytes = io.BytesIO()
-                pil_img = pil_img.convert("RGB")
-                pil_img.save(new_img_bytes, format="JPEG", optimize=True, quality=70)
-                new_img_bytes.seek(0)
-
-                excel_img = ExcelImage(new_img_bytes)
+                excel_img = ExcelImage(io.BytesIO(thumb))
                 cell_position = f"A{row_index}"
                 ws_cancels.add_image(excel_img, cell_position)
                 ws_cancels.row_dimensions[row_index].height = 60
@@ -228,6 +221,8 @@ async def generate_excel_report_for_date(token_id: int, day_str: str) -> bytes:
         cell.fill = PatternFill(start_color="FFED7D31", end_color="FFED7D31", fill_type="solid")
 
     row_index = 2
+    # Готовые миниатюры 80x80 (core/thumbnails.py) — одним запросом на лист
+    thumbs = get_thumbnails(session, (z.nm_id for z in zero_stocks), THUMB_DAILY)
     for z in zero_stocks:
         nm_id = z.nm_id or ""
         warehouse_val = z.warehouseName or ""
@@ -239,18 +234,11 @@ async def generate_excel_report_for_date(token_id: int, day_str: str) -> bytes:
         ws_out_of_stock.cell(row=row_index, column=4, value=quantity_val)
         ws_out_of_stock.cell(row=row_index, column=5, value=date_val)
 
-        product = session.query(Product).filter_by(nm_id=z.nm_id, token_id=token_id).first()
-        if product and product.resize_img:
+        # Картинка — готовая миниатюра 80x80
+        thumb = thumbs.get(z.nm_id)
+        if thumb:
             try:
-                img_data = io.BytesIO(product.resize_img)
-                pil_img = PILImage.open(img_data)
-                pil_img = pil_img.resize((80, 80), PILImage.Resampling.LANCZOS)
-                new_img_bytes = io.BytesIO()
-                pil_img = pil_img.convert("RGB")
-                pil_img.save(new_img_bytes, format="JPEG", optimize=True, quality=70)
-                new_img_bytes.seek(0)
-
-                excel_img = ExcelImage(new_img_bytes)
+                excel_img = ExcelImage(io.BytesIO(thumb))
                 cell_position = f"A{row_index}"
                 ws_out_of_stock.add_image(excel_img, cell_position)
                 ws_out_of_stock.row_dimensions[row_index].height = 60
@@ -8,8 +8,10 @@ from openpyxl.drawing.image import Image as ExcelImage
 from openpyxl.styles import PatternFill, Font, Alignment, Border, Side
 from core.sub import user_has_role
 from db.database import SessionLocal
-from db.models import User, Order, Product
-from PIL import Image as PILImage
+from db.models import User, Order
+from core.thumbnails import get_thumbnails, THUMB_ORDERS
+from core.report_service import ReportError
+from core.report_cache import cached_report
 from collections import defaultdict
 
 MAX_TELEGRAM_FILE_SIZE = 50 * 1024 * 1024  # 50 MB
@@ -73,21 +75,48 @@ async def cmd_orders(message: types.Message, user_id:int = None, days:int = 0):
         session.close()
         return
 
-    # 3) Получаем заказы за нужный период
+    token_id = db_user.token_id
+    session.close()
+
+    # 3) Сборка — в отдельном процессе (core/report_service.py), повторно — из кэша (core/report_cache.py)
+    try:
+        workbook_bytes = await cached_report("orders", token_id, f"{days}d", build_orders_report, token_id, days)
+    except ReportError as e:
+        await message.answer(str(e))
+        return
+
+    if workbook_bytes is None:
+        await message.answer(f"За {days} дней заказов нет.")
+        return
+
+    file_size = len(workbook_bytes)
+    if file_size > MAX_TELEGRAM_FILE_SIZE:
+        await message.answer("Извините, итоговый файл слишком большой для отправки.")
+        return
+
+    doc = types.BufferedInputFile(workbook_bytes, filename=f"Заказы за {days} дней.xlsx")
+    await message.answer_document(document=doc, caption=f"Отчёт по заказам за {days} дней.")
+
+def build_orders_report(token_id: int, days: int) -> bytes | None:
+    """
+    Собирает отчёт по заказам за days дней и возвращает байты xlsx (None — заказов нет).
+    Выполняется в процессе-сборщике (core/report_service.py).
+    """
+    # 1) Получаем заказы за нужный период
     date_from = datetime.datetime.utcnow() - datetime.timedelta(days=days)
+    session = SessionLocal()
     orders = (
         session.query(Order)
-        .filter(Order.token_id == db_user.token_id)
+        .filter(Order.token_id == token_id)
         .filter(Order.date >= date_from)
         .all()
     )
     session.close()
 
     if not orders:
-        await message.answer(f"За {days} дней заказов нет.")
-        return
+        return None
 
-    # 4) Создаём Excel
+    # 2) Создаём Excel
     wb = Workbook()
     ws = wb.active
     ws.title = "Отчёт"
@@ -131,7 +160,7 @@ async def cmd_orders(message: types.Message, user_id:int = None, days:int = 0):
             hdr_cell.fill = col_fills[col_idx]
         hdr_cell.border = thin_border
 
-    # 5) Группируем заказы (nm_id, techSize)
+    # 3) Группируем заказы (nm_id, techSize)
     data_map = defaultdict(list)
     nm_ids = set()
     for o in orders:
@@ -140,10 +169,10 @@ async def cmd_orders(message: types.Message, user_id:int = None, days:int = 0):
         nm_ids.add(o.nm_id)
 
     # Подтягиваем продукты
+    # Готовые миниатюры товаров (core/thumbnails.py) — без ресайза в отчёте
     session2 = SessionLocal()
-    products_db = session2.query(Product).filter(Product.nm_id.in_(nm_ids)).all()
+    thumbs = get_thumbnails(session2, nm_ids, THUMB_ORDERS)
     session2.close()
-    products_map = {p.nm_id: p for p in products_db}
 
     inserted_images_for = set()  # чтобы не вставлять картинку повторно
     sorted_keys = sorted(data_map.keys(), key=lambda x: (x[0], x[1]))
@@ -181,17 +210,10 @@ async def cmd_orders(message: types.Message, user_id:int = None, days:int = 0):
 
         # (2) Если для этого nm_id ещё не вставляли картинку – вставляем
         if nm_id not in inserted_images_for:
-            product = products_map.get(nm_id)
-            if product and product.resize_img:
+            thumb = thumbs.get(nm_id)
+            if thumb:
                 try:
-                    img_bytes = io.BytesIO(product.resize_img)
-                    pil_img = PILImage.open(img_bytes)
-                    pil_img = pil_img.resize((168, 140), PILImage.Resampling.LANCZOS)
-                    out_bytes = io.BytesIO()
-                    pil_img = pil_img.convert("RGB")
-                    pil_img.save(out_bytes, format="JPEG", optimize=True, quality=70)
-                    out_bytes.seek(0)
-                    excel_img = ExcelImage(out_bytes)
+                    excel_img = ExcelImage(io.BytesIO(thumb))
 
                     # Ставим картинку в ту же колонку A, но на строку ниже
                     img_row = current_row + 1
@@ -215,19 +237,10 @@ async def cmd_orders(message: types.Message, user_id:int = None, days:int = 0):
         current_row += 1
         last_nm_id = nm_id
 
-    # Теперь преобразуем workbook в байты, и отсылаем пользователю
+    # Теперь преобразуем workbook в байты
     output = io.BytesIO()
     wb.save(output)
-    output.seek(0)
-    workbook_bytes = output.getvalue()
-
-    file_size = len(workbook_bytes)
-    if file_size > MAX_TELEGRAM_FILE_SIZE:
-        await message.answer("Извините, итоговый файл слишком большой для отправки.")
-        return
-
-    doc = types.BufferedInputFile(workbook_bytes, filename=f"Заказы за {days} дней.xlsx")
-    await message.answer_document(document=doc, caption=f"Отчёт по заказам за {days} дней.")
+    return output.getvalue()
 
 def register_orders_handler(dp: Dispatcher):
     dp.message.register(cmd_orders, Command("orders"))
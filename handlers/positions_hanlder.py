@@ -6,11 +6,14 @@ from openpyxl.styles import Alignment, PatternFill, Font
 from aiogram.filters import Command
 from openpyxl.utils import get_column_letter
 from aiogram.types import BufferedInputFile
-from PIL import Image as PILImage
-from db.models import DestCity, ProductPositions, Product, User
+from db.models import DestCity, ProductPositionCurrent, ProductPositionDaily, Product, User
 from aiogram import types, Dispatcher
 from sqlalchemy import func
+from sqlalchemy.dialects.postgresql import array_agg, aggregate_order_by
 from core.sub import user_has_role
+from core.thumbnails import get_thumbnails, THUMB_POSITIONS
+from core.report_service import ReportError
+from core.report_cache import cached_report
 from db.database import SessionLocal
 from collections import defaultdict
 
@@ -39,21 +42,16 @@ async def cmd_positions(message: types.Message, user_id: int = None):
             )
             return
 
-        # 3) Готовим Excel
-        wb = Workbook()
-        # Удаляем дефолтный лист "Sheet"
-        wb.remove(wb.active)
+        session.close()
 
-        # Основной лист с позициями
-        generate_positions_report(session, wb, token_id)
-        # Листы c динамикой по городам
-        generate_dynamic_positions_report(session, wb, token_id)
+        # 3) Готовим Excel — в процессе-сборщике (core/report_service.py) или берём из кэша (core/report_cache.py)
+        try:
+            workbook_bytes = await cached_report("positions", token_id, "all", build_positions_report, token_id)
+        except ReportError as e:
+            await message.answer(str(e))
+            return
 
         # 4) Отправляем файл
-        output = io.BytesIO()
-        wb.save(output)
-        output.seek(0)
-        workbook_bytes = output.getvalue()
 
         if len(workbook_bytes) > 50 * 1024 * 1024:
             await message.answer("Слишком большой Excel для отправки!")
@@ -65,26 +63,51 @@ async def cmd_positions(message: types.Message, user_id: int = None):
     finally:
         session.close()
 
-def get_default_period(session) -> tuple:
+def build_positions_report(token_id: int) -> bytes:
+    """
+    Собирает отчёт по позициям и возвращает байты xlsx.
+    Выполняется в процессе-сборщике (core/report_service.py), сессию открывает сам.
+    """
+    session = SessionLocal()
+    try:
+        wb = Workbook()
+        # Удаляем дефолтный лист "Sheet"
+        wb.remove(wb.active)
+
+        # Основной лист с позициями
+        generate_positions_report(session, wb, token_id)
+        # Листы c динамикой по городам
+        generate_dynamic_positions_report(session, wb, token_id)
+    finally:
+        session.close()
+
+    output = io.BytesIO()
+    wb.save(output)
+    return output.getvalue()
+
+def get_default_period(session, token_id: int = None) -> tuple:
     """
     Если период не задан, вычисляет его:
-      - start_date: минимальное значение check_dt среди записей в ProductPositions.
+      - start_date: первый день в сводке product_positions_daily (по токену, если указан).
       - end_date: start_date + 3 месяца (приблизительно 90 дней).
     Возвращает кортеж (start_date, end_date) типа (datetime.date, datetime.date).
     """
-    min_dt = session.query(func.min(ProductPositions.check_dt)).scalar()
-    if min_dt is None:
+    query = session.query(func.min(ProductPositionDaily.day))
+    if token_id is not None:
+        query = query.filter(ProductPositionDaily.token_id == token_id)
+    min_day = query.scalar()
+    if min_day is None:
         start_date = datetime.date.today()
     else:
-        start_date = min_dt.date()
+        start_date = min_day
     end_date = start_date + datetime.timedelta(days=90)
     return start_date, end_date
 
 def generate_positions_report(session, wb, token_id: int):
     """
     Создаёт лист "Positions" в книге wb:
-      - Собирает данные из product_positions (page, position, request_count, query_text),
-        связав с таблицами Product (чтобы достать nm_id, resize_img) и DestCity (чтобы
+      - Собирает данные из снимка product_positions_current (page, position, request_count, query_text),
+        связав с таблицами Product (чтобы достать nm_id) и product_thumbnails (миниатюры) и DestCity (чтобы
         получить названия городов).
       - Выводит колонки:
          A: Товар (название + картинка)
@@ -131,61 +154,51 @@ def generate_positions_report(session, wb, token_id: int):
         letter = get_column_letter(col_start + i)
         ws.column_dimensions[letter].width = 15
 
-    # 3) Собираем товары, у которых есть записи в product_positions
-    #    (или просто все товары, фильтруем потом).
-
-    # Список distinct nm_id
-    nm_ids_in_positions = session.query(ProductPositions.nm_id).distinct().all()
-    nm_ids_in_positions = [nm_id for (nm_id,) in nm_ids_in_positions]
+    # 3) Текущие позиции токена — одним запросом из снимка product_positions_current
+    #    (история product_positions здесь не нужна).
+    #    query_info_by_nm[nm_id][(query_text, freq)][city_id] = (page, pos)
+    current_positions = (
+        session.query(ProductPositionCurrent)
+        .filter(ProductPositionCurrent.token_id == token_id)
+        .order_by(ProductPositionCurrent.nm_id, ProductPositionCurrent.id)
+        .all()
+    )
+    query_info_by_nm = defaultdict(lambda: defaultdict(dict))
+    for pp in current_positions:
+        key = (pp.query_text, pp.request_count)
+        query_info_by_nm[pp.nm_id][key][pp.city_id] = (pp.page, pp.position)
 
     products = (
         session.query(Product)
         .filter(Product.token_id == token_id)
-        .filter(Product.nm_id.in_(nm_ids_in_positions))
+        .filter(Product.nm_id.in_(list(query_info_by_nm.keys())))
         .all()
-    )
+    ) if query_info_by_nm else []
+    thumbs = get_thumbnails(session, (p.nm_id for p in products), THUMB_POSITIONS)
 
     current_row = 2
 
     for product in products:
         nm_id = product.nm_id
 
-        # Вытаскиваем картинку (resize_img), если есть
-        resize_img_bytes = product.resize_img  # LargeBinary
-        # Создадим картинку excel_img, если не None
-        excel_img = None
-        if resize_img_bytes:
-            try:
-                pil_img = PILImage.open(io.BytesIO(resize_img_bytes))
-                # Подогнать под (150x150)?
-                pil_img = pil_img.resize((182, 160), PILImage.Resampling.LANCZOS)
-                out_bytes = io.BytesIO()
-                pil_img = pil_img.convert("RGB")  # для JPEG нужно RGB
-                pil_img.save(out_bytes, format="JPEG", optimize=True, quality=70)
-                out_bytes.seek(0)
-                excel_img = ExcelImage(out_bytes)
-            except Exception as e:
-                print(f"Не удалось загрузить/преобразовать картинку nm_id={nm_id}: {e}")
-
-        # 4) Собираем все записи product_positions для этого nm_id,
-        #    группируем по query_text (одна строка => 1 query_text => "Частотность" => города).
-        positions_data = session.query(ProductPositions).filter_by(nm_id=nm_id).all()
-        if not positions_data:
+        # 4) Запросы товара: одна строка => 1 query_text => "Частотность" => города.
+        query_info = query_info_by_nm.get(nm_id)
+        if not query_info:
             continue
 
-        # Соберём словарь: key= (query_text, request_count) => city -> (page, pos)
-        from collections import defaultdict
-        # можно хранить query_info[(query_text, freq)][city_id] = (page, pos)
-        query_info = defaultdict(lambda: {})
-
-        for pp in positions_data:
-            key = (pp.query_text, pp.request_count)
-            query_info[key][pp.city_id] = (pp.page, pp.position)
-
          # Если меньше 5 ключевых слов => пропускаем товар
         if len(query_info) < 5:
             continue
 
+        # Готовая миниатюра 182x160, если есть
+        excel_img = None
+        thumb = thumbs.get(nm_id)
+        if thumb:
+            try:
+                excel_img = ExcelImage(io.BytesIO(thumb))
+            except Exception as e:
+                print(f"Не удалось загрузить/преобразовать картинку nm_id={nm_id}: {e}")
+
         # Перед тем как писать строки, сделаем "шапку" для товара:
         # - вставим картинку в A{current_row}
         # - объединим A..C чтобы вписать nm_id или supplier_article
@@ -265,6 +278,7 @@ def generate_dynamic_positions_report(session, wb, token_id: int, start_date: da
     """
     Для каждого города (из таблицы DestCity) создаёт отдельный лист.
     В листе выводится динамика позиций товаров по дням за период [start_date, end_date].
+    Данные — лучшая позиция за день из сводки product_positions_daily, одним запросом на токен.
     
     Структура листа:
       - Первая строка: заголовки: "Товар" (с изображением и гиперссылкой), затем по дням (формат "ДД.MM").
@@ -278,41 +292,63 @@ def generate_dynamic_positions_report(session, wb, token_id: int, start_date: da
 
      # Если период не задан, вычисляем его
     if start_date is None or end_date is None:
-        start_date, end_date = get_default_period(session)
+        start_date, end_date = get_default_period(session, token_id)
         print(f"[INFO] Используем период по умолчанию: {start_date} - {end_date}")
 
+    # Одним запросом по токену — уже сгруппированные по (город, товар, запрос)
+    # дни и лучшие позиции из дневной сводки product_positions_daily
+    daily_rows = (
+        session.query(
+            ProductPositionDaily.city_id,
+            ProductPositionDaily.nm_id,
+            ProductPositionDaily.query_text,
+            array_agg(aggregate_order_by(ProductPositionDaily.request_count, ProductPositionDaily.day.desc()))[1],
+            array_agg(aggregate_order_by(ProductPositionDaily.day, ProductPositionDaily.day)),
+            array_agg(aggregate_order_by(ProductPositionDaily.page, ProductPositionDaily.day)),
+            array_agg(aggregate_order_by(ProductPositionDaily.position, ProductPositionDaily.day)),
+        )
+        .filter(
+            ProductPositionDaily.token_id == token_id,
+            ProductPositionDaily.day >= start_date,
+            ProductPositionDaily.day <= end_date,
+        )
+        .group_by(ProductPositionDaily.city_id, ProductPositionDaily.nm_id, ProductPositionDaily.query_text)
+        .order_by(ProductPositionDaily.city_id, ProductPositionDaily.nm_id, ProductPositionDaily.query_text)
+        .all()
+    )
 
-    # Получаем список дат в нужном диапазоне (каждый день)
-    days_list = []
-    current_day = start_date
-    while current_day <= end_date:
-        days_list.append(current_day)
-        current_day += datetime.timedelta(days=1)
-    
+    # city_id -> nm_id -> {(query_text, freq): {day: (page, pos)}}
+    rows_by_city = defaultdict(lambda: defaultdict(dict))
+    days_by_city = defaultdict(set)
+    for city_id, nm_id, qtext, freq, days, pages, positions in daily_rows:
+        rows_by_city[city_id][nm_id][(qtext, freq)] = {
+            d: (pg, pos) for d, pg, pos in zip(days, pages, positions)
+        }
+        days_by_city[city_id].update(days)
+
+    # Товары токена — один раз на все города
+    all_nm_ids = {nm_id for by_nm in rows_by_city.values() for nm_id in by_nm}
+    products = (
+        session.query(Product)
+        .filter(Product.token_id == token_id)
+        .filter(Product.nm_id.in_(all_nm_ids))
+        .all()
+    ) if all_nm_ids else []
+    thumbs = get_thumbnails(session, all_nm_ids, THUMB_POSITIONS)
 
     # Получаем все города
     cities = session.query(DestCity).order_by(DestCity.city).all()
     
     for city in cities:
-        # Собираем все ProductPositions для данного города в диапазоне дат
-        pps_city = session.query(ProductPositions).filter(
-            ProductPositions.city_id == city.id,
-            ProductPositions.token_id == token_id,
-            ProductPositions.check_dt >= datetime.datetime.combine(start_date, datetime.time.min),
-            ProductPositions.check_dt <= datetime.datetime.combine(end_date, datetime.time.max)
-        ).all()
+        query_maps = rows_by_city.get(city.id)
         
         # Если нет данных для города — просто создаём лист и пропускаем
-        if not pps_city:
+        if not query_maps:
             ws = wb.create_sheet(title=city.city[:31])
             continue
 
-        # Собираем уникальные даты, по которым есть данные
-        days_with_data = set()
-        for pp in pps_city:
-            days_with_data.add(pp.check_dt.date())
-        # Сортируем даты, чтобы идти по порядку
-        days_list = sorted(days_with_data)
+        # Даты, по которым есть данные в городе, по порядку
+        days_list = sorted(days_by_city[city.id])
 
         # Создаём лист для города
         ws = wb.create_sheet(title=city.city[:31])
@@ -345,29 +381,16 @@ def generate_dynamic_positions_report(session, wb, token_id: int, start_date: da
             col_letter = get_column_letter(col_start + i)
             ws.column_dimensions[col_letter].width = 15
 
-        # nm_ids (товары, у которых в этом городе есть позиции)
-        nm_ids = set(pp.nm_id for pp in pps_city)
-        products = (session.query(Product)
-                    .filter(Product.token_id == token_id)
-                    .filter(Product.nm_id.in_(nm_ids))
-                    .all())
-
         current_row = 2
 
         for product in products:
             nm_id = product.nm_id
 
-            # Собираем позиции именно этого товара за нужный период и в этом городе
-            pps_for_product = [pp for pp in pps_city if pp.nm_id == nm_id]
-            if not pps_for_product:
+            # Запросы этого товара в этом городе: (query_text, freq) -> {day: (page, pos)}
+            query_map = query_maps.get(nm_id)
+            if not query_map:
                 continue
 
-            # Группируем pps по (query_text, request_count)
-            query_map = defaultdict(list)
-            for pp in pps_for_product:
-                key = (pp.query_text, pp.request_count)
-                query_map[key].append(pp)
-
             # Если у товара <5 ключевых слов => пропускаем (логика по вашему условию)
             if len(query_map) < 5:
                 continue
@@ -384,15 +407,10 @@ def generate_dynamic_positions_report(session, wb, token_id: int, start_date: da
 
             # Пробуем вставить картинку (если есть)
             excel_img = None
-            if product.resize_img:
+            thumb = thumbs.get(nm_id)
+            if thumb:
                 try:
-                    pil_img = PILImage.open(io.BytesIO(product.resize_img))
-                    pil_img = pil_img.resize((182, 160), PILImage.Resampling.LANCZOS)
-                    out_bytes = io.BytesIO()
-                    pil_img = pil_img.convert("RGB")
-                    pil_img.save(out_bytes, format="JPEG", optimize=True, quality=70)
-                    out_bytes.seek(0)
-                    excel_img = ExcelImage(out_bytes)
+                    excel_img = ExcelImage(io.BytesIO(thumb))
                 except Exception as e:
                     print(f"[generate_dynamic_positions_report] Ошибка с картинкой nm_id={nm_id}: {e}")
 
@@ -402,7 +420,7 @@ def generate_dynamic_positions_report(session, wb, token_id: int, start_date: da
             current_row += 1  # Отступ на 1 строку
 
             # Для каждого (qtext, freq) одна строка с позициями
-            for (qtext, freq), pp_list in query_map.items():
+            for (qtext, freq), daily_positions in query_map.items():
                 if freq == 0:
                     freq_value = "<100"
                 else:
@@ -412,14 +430,6 @@ def generate_dynamic_positions_report(session, wb, token_id: int, start_date: da
                 cell_freq.alignment = Alignment(horizontal="right", vertical="center")
                 ws.cell(row=current_row, column=3, value=qtext)
 
-                # Готовим словарь date->(pp)
-                # Будем брать самую позднюю запись для каждого дня
-                daily_positions = {}
-                for pp in pp_list:
-                    d = pp.check_dt.date()
-                    if d not in daily_positions or pp.check_dt > daily_positions[d].check_dt:
-                        daily_positions[d] = pp
-
                 prev_rank = None
                 # Идём по days_list (только те дни, где есть хоть какие-то записи в городе)
                 for i_day, day_obj in enumerate(days_list):
@@ -427,9 +437,9 @@ def generate_dynamic_positions_report(session, wb, token_id: int, start_date: da
                     cell_obj = ws.cell(row=current_row, column=col_idx)
                     # Если в этот день есть запись для данного (qtext,freq)
                     if day_obj in daily_positions:
-                        pp = daily_positions[day_obj]
-                        if pp.page is not None and pp.position is not None:
-                            rank = (pp.page - 1) * 100 + pp.position
+                        page, pos = daily_positions[day_obj]
+                        if page is not None and pos is not None:
+                            rank = (page - 1) * 100 + pos
                             diff_text = ""
                             fill = None
                             if prev_rank is not None:
@@ -450,7 +460,7 @@ def generate_dynamic_positions_report(session, wb, token_id: int, start_date: da
                                 diff_text = ""
                                 fill = PatternFill(start_color="FF90EE90", end_color="FF90EE90", fill_type="solid")  # зелёный
 
-                            cell_obj.value = f"{pp.page}-{pp.position}{diff_text}"
+                            cell_obj.value = f"{page}-{pos}{diff_text}"
                             if fill:
                                 cell_obj.fill = fill
                             prev_rank = rank
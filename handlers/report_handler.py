@@ -16,7 +16,6 @@ from openpyxl.chart.series import SeriesLabel
 from openpyxl.chart.plotarea import PlotArea
 from openpyxl.chart.shapes import GraphicalProperties
 from openpyxl.drawing.fill import GradientFillProperties, GradientStop
-from PIL import Image as PILImage
 from openpyxl.chart.layout import Layout, ManualLayout
 from openpyxl.chart.label import DataLabelList
 
@@ -26,6 +25,11 @@ from db.database import SessionLocal
 from db.models import Product, Order, Sale, Stock, User
 
 from core.sub import user_has_role
+from core.thumbnails import get_thumbnails, THUMB_DETAIL
+from core.report_data import load_product_details, ProductDetailData
+from core.report_service import ReportError
+from core.report_cache import cached_report
+from core.xlsx_stream import streaming_workbook, StreamSheet
 
 MAX_TELEGRAM_FILE_SIZE = 50 * 1024 * 1024  # 50 MB
 
@@ -79,24 +83,15 @@ async def cmd_my_products(message: types.Message, user_id:int = None, days: int
         return
 
     token_id = db_user.token_id
-
-    products = session.query(Product).filter_by(token_id=token_id).all()
-    wb = Workbook()
-
-    generate_excel_grouped_by_subject(products, wb=wb, token_id=token_id)
-    add_top_two_columns_sheet(wb, session, token_id=token_id, days=days, top_n=50)
-
-    date_from = datetime.utcnow() - timedelta(days=days)
-    date_to = datetime.utcnow()
-    generate_detailed_sheets_for_products(session, wb, token_id, date_from, date_to)
-
     session.close()
 
-    # Сериализация
-    output = io.BytesIO()
-    wb.save(output)
-    output.seek(0)
-    workbook_bytes = output.getvalue()
+    # Сборка — в отдельном процессе (core/report_service.py), бот тем временем отвечает остальным.
+    # Если с прошлой сборки данные не менялись — готовый файл из кэша (core/report_cache.py)
+    try:
+        workbook_bytes = await cached_report("my_products", token_id, f"{days}d", build_my_products_report, token_id, days)
+    except ReportError as e:
+        await message.answer(str(e))
+        return
 
     if len(workbook_bytes) > MAX_TELEGRAM_FILE_SIZE:
         await message.answer("Извините, файл слишком большой для отправки через Telegram!")
@@ -105,16 +100,45 @@ async def cmd_my_products(message: types.Message, user_id:int = None, days: int
     doc = BufferedInputFile(workbook_bytes, filename=f"сводный отчёт за {days} дней.xlsx")
     await message.answer_document(document=doc, caption=f"Ваш отчёт за {days} дней")
 
-def generate_excel_grouped_by_subject(products: list[Product], wb: Workbook, token_id) -> None:
+def build_my_products_report(token_id: int, days: int) -> bytes:
+    """
+    Собирает сводный отчёт «Мои товары» за days дней и возвращает байты xlsx.
+    Выполняется в процессе-сборщике (core/report_service.py), поэтому сессию открывает сам.
     """
-    Создаёт / заполняет первый лист в переданной книге wb:
+    session = SessionLocal()
+    try:
+        products = session.query(Product).filter_by(token_id=token_id).all()
+        # Потоковая книга (core/xlsx_stream.py): листы пишутся на диск по одному,
+        # память не растёт с числом товаров
+        wb = streaming_workbook()
+
+        # Готовые миниатюры (core/thumbnails.py) — одним запросом, без ресайза в отчёте
+        thumbs = get_thumbnails(session, (p.nm_id for p in products), THUMB_DETAIL)
+        generate_excel_grouped_by_subject(products, wb=wb, token_id=token_id, thumbs=thumbs)
+        add_top_two_columns_sheet(wb, session, token_id=token_id, days=days, top_n=50)
+
+        date_from = datetime.utcnow() - timedelta(days=days)
+        date_to = datetime.utcnow()
+        generate_detailed_sheets_for_products(session, wb, token_id, date_from, date_to)
+    finally:
+        session.close()
+
+    # Сериализация
+    output = io.BytesIO()
+    wb.save(output)
+    return output.getvalue()
+
+def generate_excel_grouped_by_subject(products: list[Product], wb: Workbook, token_id, thumbs: dict | None = None) -> None:
+    """
+    Создаёт первый лист в переданной потоковой книге wb (core/xlsx_stream.py):
     - Группирует товары по subject_name
     - Горизонтальный вывод (ID + картинки)
+    thumbs — готовые миниатюры 152x200 {nm_id: JPEG-байты} (core/thumbnails.get_thumbnails).
     """
+    thumbs = thumbs or {}
     from collections import defaultdict
 
-    ws = wb.active
-    ws.title = "Сводка по категориям"
+    ws = StreamSheet(wb, "Сводка по категориям")
 
     # Фильтруем товары по token_id
     products = [p for p in products if p.token_id == token_id]
@@ -170,17 +194,10 @@ def generate_excel_grouped_by_subject(products: list[Product], wb: Workbook, tok
         images_row = current_row
         for col_idx, product in enumerate(products_in_group, start=1):
             col_letter = get_column_letter(col_idx)
-            if product.resize_img:
+            thumb = thumbs.get(product.nm_id)
+            if thumb:
                 try:
-                    img_bytes = io.BytesIO(product.resize_img)
-                    pil_img = PILImage.open(img_bytes)
-                    pil_img = pil_img.resize((152, 200), PILImage.Resampling.LANCZOS)
-                    img_bytes = io.BytesIO()
-                    pil_img = pil_img.convert("RGB")
-                    pil_img.save(img_bytes, format="JPEG", optimize=True, quality=70)
-                    img_bytes.seek(0)
-
-                    excel_img = ExcelImage(img_bytes)
+                    excel_img = ExcelImage(io.BytesIO(thumb))
                     ws.add_image(excel_img, f"{col_letter}{images_row}")
                 except Exception as e:
                     print(f"Ошибка при загрузке картинки для nm_id={product.nm_id}: {e}")
@@ -195,6 +212,8 @@ def generate_excel_grouped_by_subject(products: list[Product], wb: Workbook, tok
         col_letter = get_column_letter(col_idx)
         ws.column_dimensions[col_letter].width = 21.7
 
+    ws.close()
+
 def add_top_two_columns_sheet(wb: Workbook, session, token_id:int, days: int = 90, top_n=50):
     """
     Создаёт в книге wb лист со стилем а-ля «две колонки»: слева ТОП заказов, справа ТОП выкупов.
@@ -204,7 +223,7 @@ def add_top_two_columns_sheet(wb: Workbook, session, token_id:int, days: int = 9
       - token_id: для фильтрации товаров
     """
 
-    ws = wb.create_sheet(title="Топ отчёт")
+    ws = StreamSheet(wb, "Топ отчёт")
 
     # -- 1. Шапка (строка 2) --
     # Сольём колонки A..C для "ТОП ЗАКАЗЫ"
@@ -267,7 +286,6 @@ def add_top_two_columns_sheet(wb: Workbook, session, token_id:int, days: int = 9
             "count_cancel": int(row.cnt_cancel or 0),
             "sum_cancel": float(row.sum_cancel or 0.0),
             "image_url": image_url,
-            "resize_img": product.resize_img if product else None
         })
 
     # 2.2 Топ выкупов (Sale):
@@ -300,9 +318,13 @@ def add_top_two_columns_sheet(wb: Workbook, session, token_id:int, days: int = 9
             "count_return": int(row.cnt_return or 0),
             "sum_return": float(row.sum_return or 0.0),
             "image_url": image_url,
-            "resize_img": product.resize_img if product else None
         })
 
+    # Готовые миниатюры обоих топов — одним запросом
+    thumbs = get_thumbnails(
+        session, [item["nm_id"] for item in top_orders + top_sales], THUMB_DETAIL
+    )
+
     # -- 3. Записываем в виде блоков: слева топ заказов, справа топ выкупов --
     #   Каждый элемент займёт ~6-7 строк. Картинку поставим в первую часть, текст ниже.
 
@@ -333,17 +355,10 @@ def add_top_two_columns_sheet(wb: Workbook, session, token_id:int, days: int = 9
         # -- Левый блок (заказы) в колонках B..C
         if order_item:
             # 3.1 Картинка (вставим в B.. - фактически можно просто B=row_start)
-            if order_item["resize_img"]:
+            thumb = thumbs.get(order_item["nm_id"])
+            if thumb:
                 try:
-                    img_bytes = io.BytesIO(order_item["resize_img"])
-                    pil_img = PILImage.open(img_bytes)
-                    # Масштабируем, скажем, до 150x150
-                    pil_img = pil_img.resize((152,200), PILImage.Resampling.LANCZOS)
-                    img_bytes = io.BytesIO()
-                    pil_img = pil_img.convert("RGB")
-                    pil_img.save(img_bytes, format="JPEG", optimize=True, quality=70)
-                    img_bytes.seek(0)
-                    excel_img = ExcelImage(img_bytes)
+                    excel_img = ExcelImage(io.BytesIO(thumb))
                     # Вставляем в B{row_start}, Excel сам растянет
                     ws.add_image(excel_img, f"B{row_start}")
                     ws.row_dimensions[row_start].height = 150
@@ -368,16 +383,10 @@ def add_top_two_columns_sheet(wb: Workbook, session, token_id:int, days: int = 9
 
         # -- Правый блок (выкупы) в колонках E..F
         if sale_item:
-            if sale_item["resize_img"]:
+            thumb = thumbs.get(sale_item["nm_id"])
+            if thumb:
                 try:
-                    img_bytes = io.BytesIO(sale_item["resize_img"])
-                    pil_img = PILImage.open(img_bytes)
-                    pil_img = pil_img.resize((152,200), PILImage.Resampling.LANCZOS)
-                    img_bytes = io.BytesIO()
-                    pil_img = pil_img.convert("RGB")
-                    pil_img.save(img_bytes, format="JPEG", optimize=True, quality=70)
-                    img_bytes.seek(0)
-                    excel_img = ExcelImage(img_bytes)
+                    excel_img = ExcelImage(io.BytesIO(thumb))
                     ws.add_image(excel_img, f"E{row_start}")
                 except:
                     pass
@@ -406,6 +415,8 @@ def add_top_two_columns_sheet(wb: Workbook, session, token_id:int, days: int = 9
     for r in range(1, max_row + 1):
         ws.cell(row=r, column=4).fill = separator_fill
 
+    ws.close()
+
 def generate_detailed_sheets_for_products(session, wb: Workbook, token_id:int, date_from: datetime, date_to: datetime):
     """
     Для каждого товара создаём отдельный лист, в котором:
@@ -416,17 +427,27 @@ def generate_detailed_sheets_for_products(session, wb: Workbook, token_id:int, d
     """
     # 1) Получаем товары (можно фильтровать только нужные)
     products = session.query(Product).filter_by(token_id=token_id).all()
+    thumbs = get_thumbnails(session, (p.nm_id for p in products), THUMB_DETAIL)
+    # Заказы, выкупы, регионы, склады и остатки всех товаров — несколькими запросами (core/report_data.py)
+    details = load_product_details(session, token_id, date_from, date_to)
+
+    # Дни периода для графика продаж — одинаковые для всех товаров
+    date_list = []
+    cur_date = date_from
+    while cur_date <= date_to:
+        date_list.append(cur_date.date())
+        cur_date += timedelta(days=1)
 
     for product in products:
 
         # Создаём основной лист
         nm_id = product.nm_id
         sheet_name = str(nm_id)[:31]  # Excel не любит имена >31 символ
-        ws = wb.create_sheet(title=sheet_name)
+        ws = StreamSheet(wb, sheet_name)
 
         # Создаём технический лист
         data_sheet_name = f"data{nm_id}"
-        data_ws = wb.create_sheet(title=data_sheet_name[:31])  # тоже обрежем до 31 символа
+        data_ws = StreamSheet(wb, data_sheet_name[:31])  # тоже обрежем до 31 символа
 
         # 2) Зелёная шапка (A1..C1)S
         ws.merge_cells("A1:C1")
@@ -445,19 +466,10 @@ def generate_detailed_sheets_for_products(session, wb: Workbook, token_id:int, d
         ws.row_dimensions[1].height = 30
 
         # 3) В A2 вставим картинку
-        if product.resize_img:
+        thumb = thumbs.get(product.nm_id)
+        if thumb:
             try:
-                img_bytes = io.BytesIO(product.resize_img)
-                pil_img = PILImage.open(img_bytes)
-                # Масштабируем под 152x200
-                pil_img = pil_img.resize((152, 200), PILImage.Resampling.LANCZOS)
-
-                img_bytes = io.BytesIO()
-                pil_img = pil_img.convert("RGB")
-                pil_img.save(img_bytes, format="JPEG", optimize=True, quality=70)
-                img_bytes.seek(0)
-
-                excel_img = ExcelImage(img_bytes)
+                excel_img = ExcelImage(io.BytesIO(thumb))
                 ws.add_image(excel_img, "A2")
 
                 # Поднимаем высоту строки 3 (200 пунктов ~ 266 пикселей, но можно подобрать)
@@ -465,52 +477,18 @@ def generate_detailed_sheets_for_products(session, wb: Workbook, token_id:int, d
             except Exception as e:
                 print(f"Не удалось загрузить картинку для nm_id={nm_id}: {e}")
 
-        # 4) Считаем статистику по заказам (orders) за период
-        total_orders = session.query(func.count(Order.id),func.sum(Order.price_with_disc),
-    # вместо func.case
-        func.sum(case((Order.is_cancel == True, 1),else_=0)).label("cnt_cancel"),func.sum(case((Order.is_cancel == True, Order.price_with_disc),else_=0)).label("sum_cancel"),).filter(
-    Order.nm_id == nm_id,
-    Order.date >= date_from,
-    Order.date <= date_to,
-    Order.token_id == token_id
-).first()
-
-        orders_count = total_orders[0] or 0
-        orders_sum = total_orders[1] or 0
-        orders_cnt_cancel = total_orders[2] or 0
-        orders_sum_cancel = total_orders[3] or 0
-
-        # 5) Считаем статистику по выкупам (sales) за период
-        total_sales = (
-    session.query(
-        func.count(Sale.id),
-        func.sum(Sale.price_with_disc),
-        func.sum(
-            case(
-                (Sale.sale_id.like("R%"), 1),
-                else_=0
-            )
-        ).label("cnt_return"),
-        func.sum(
-            case(
-                (Sale.sale_id.like("R%"), Sale.price_with_disc),
-                else_=0
-            )
-        ).label("sum_return"),
-    )
-    .filter(
-        Sale.nm_id == nm_id,
-        Sale.date >= date_from,
-        Sale.date <= date_to,
-        Sale.token_id == token_id
-    )
-    .first()
-)
+        # 4) Статистика по заказам и выкупам за период — из заранее собранных данных
+        data = details.get(nm_id) or ProductDetailData()
+        orders_count = data.orders_count
+        orders_sum = data.orders_sum
+        orders_cnt_cancel = data.orders_cnt_cancel
+        orders_sum_cancel = data.orders_sum_cancel
 
-        sales_count = total_sales[0] or 0
-        sales_sum = total_sales[1] or 0
-        sales_cnt_return = total_sales[2] or 0
-        sales_sum_return = total_sales[3] or 0
+        # 5) То же по выкупам (sales)
+        sales_count = data.sales_count
+        sales_sum = data.sales_sum
+        sales_cnt_return = data.sales_cnt_return
+        sales_sum_return = data.sales_sum_return
 
         # 6) Выводим всё в B3 (заказы) и C3 (выкупы), чёрный фон, белый текст
         black_fill = PatternFill(start_color="FF000000", end_color="FF000000", fill_type="solid")
@@ -546,123 +524,35 @@ def generate_detailed_sheets_for_products(session, wb: Workbook, token_id:int, d
         ws.column_dimensions["B"].width = 30    
         ws.column_dimensions["C"].width = 30
 
-        date_list = []
-        cur_date = date_from
-        while cur_date <= date_to:
-                date_list.append(cur_date)
-                cur_date += timedelta(days=1)
-
-        daily_stats = []
-        for d in date_list:
-            day_orders_count = session.query(func.count(Order.id)) \
-                .filter(Order.nm_id == nm_id,  func.DATE(Order.date) == d.date()) \
-                .scalar() or 0
-            day_cancel_count = session.query(func.count(Order.id)) \
-                .filter(Order.nm_id == nm_id, Order.is_cancel == True,
-                            func.DATE(Order.date) == d.date()) \
-                .scalar() or 0
-            day_sales_count = session.query(func.count(Sale.id)) \
-                .filter(Sale.nm_id == nm_id, func.DATE(Sale.date) == d.date()) \
-                .scalar() or 0
-            day_return_count = session.query(func.count(Sale.id)) \
-                .filter(Sale.nm_id == nm_id, Sale.sale_id.like("R%"),
-                            func.DATE(Sale.date) == d.date()) \
-                .scalar() or 0
-
-            daily_stats.append((d.date(), day_orders_count, day_cancel_count, day_sales_count, day_return_count))
-
-        # Заказы с регионов
-
-        region_stats = (
-            session.query(
-                Order.region_name,
-                func.count(Order.id).label("cnt_orders")
-            )
-            .filter(
-                Order.nm_id == nm_id,
-                Order.date >= date_from,
-                Order.date <= date_to,
-                Order.is_cancel == False  # если не хотим считать «отменённые»
-            )
-            .group_by(Order.region_name)
-            .order_by(desc("cnt_orders"))
-            .all()
-        )
+        daily_stats = data.daily_stats(date_list)
 
-        # Заказы со складов
-        warehouse_stats = (
-            session.query(
-                Order.warehouse_name,
-                func.count(Order.id).label("cnt_orders")
-            )
-            .filter(
-                Order.nm_id == nm_id,
-                Order.date >= date_from,
-                Order.date <= date_to,
-                Order.is_cancel == False  # Исключаем отменённые заказы
-            )
-            .group_by(Order.warehouse_name)
-            .order_by(desc("cnt_orders"))
-            .all()
-        )
+        # Заказы с регионов и со складов
+        region_stats = data.regions
+        warehouse_stats = data.warehouses
 
-        # Извлекаем данные из таблицы Stock
-        stock_stats = (
-            session.query(
-                Stock.warehouseName,
-                func.sum(Stock.quantity).label("quantity"),
-                func.sum(func.coalesce(Stock.inWayToClient, 0)).label("inWayToClient")
-            )
-            .filter(
-                Stock.nm_id == nm_id  # Фильтруем по артикулу товара
-            )
-            .group_by(Stock.warehouseName)
-            .order_by(desc("quantity"))
-            .all()
-        )
+        # Остатки по складам
+        stock_stats = data.stocks
 
         # Считаем общее количество на всех складах
-        total_stock = sum(row.quantity for row in stock_stats)
-        in_way_total = sum(row.inWayToClient for row in stock_stats)
-
-
-        sales_by_warehouse = (
-            session.query(
-                Order.warehouse_name,
-                func.count(Order.id).label("sales_count")
-            )
-            .filter(
-                Order.nm_id == nm_id,
-                Order.date >= date_from,
-                Order.date <= date_to,
-                Order.is_cancel == False
-            )
-            .group_by(Order.warehouse_name)
-            .all()
-        )
+        total_stock = sum(quantity for _, quantity, _ in stock_stats)
+        in_way_total = sum(in_way for _, _, in_way in stock_stats)
 
         # Шаг 2. Собираем данные о текущих остатках
-        stock_by_warehouse = {
-            row.warehouseName: row.quantity
-            for row in session.query(Stock.warehouseName, Stock.quantity)
-            .filter(Stock.nm_id == nm_id)
-        }
+        stock_by_warehouse = {warehouse: quantity for warehouse, quantity, _ in stock_stats}
 
         # Шаг 3. Рассчитываем средний спрос и рекомендуемые запасы
+        sales_by_warehouse = warehouse_stats
         recommendations = []
         total_stock_available = sum(stock_by_warehouse.values())
-        total_sales = sum(row.sales_count for row in sales_by_warehouse)
         reserve_stock = int(0.1 * total_stock_available)  # 10% от общего запаса в резерв
 
-        for sale in sales_by_warehouse:
-            warehouse = sale.warehouse_name
-            avg_demand = int(sale.sales_count)
+        for warehouse, sales_cnt in sales_by_warehouse:
+            avg_demand = int(sales_cnt)
             current_stock = int(stock_by_warehouse.get(warehouse, 0))
             recommended_stock = int(avg_demand + (reserve_stock / len(sales_by_warehouse)))
             difference = int(recommended_stock - current_stock)
             recommendations.append((warehouse, avg_demand, current_stock, recommended_stock, difference))
 
-# region_stats вернёт список кортежей [(region1, count1), (region2, count2), ...]
 
             # (5) Записываем таблицу для 1 графика
         start_row = 1
@@ -1029,6 +919,10 @@ def generate_detailed_sheets_for_products(session, wb: Workbook, token_id:int, d
             ws.add_chart(bar_chart, "A31")            
             
         data_ws.sheet_state = "hidden"  # скрываем лист с данными
+
+        # Оба листа товара готовы — выписываем их на диск и освобождаем память
+        ws.close()
+        data_ws.close()
             
             
 
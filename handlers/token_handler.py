@@ -7,7 +7,7 @@ from aiogram.fsm.context import FSMContext
 from states.token_state import TokenState
 from db.database import SessionLocal
 from db.models import User, Order, Token
-from core.products_service import upsert_product
+from core.products_service import upsert_products
 from core.fill_orders import fill_orders
 from parse_wb import parse_wildberries
 
@@ -88,37 +88,48 @@ async def process_token(message: types.Message, state: FSMContext):
     await fill_orders(date_from_str, telegram_id=str(message.from_user.id))
 
     session2 = SessionLocal()
-    db_user2 = session2.query(User).filter_by(telegram_id=str(message.from_user.id)).first()
-    if not db_user2 or not db_user2.token_id:
+    try:
+        db_user2 = session2.query(User).filter_by(telegram_id=str(message.from_user.id)).first()
+        user_token_id = db_user2.token_id if db_user2 else None
+        rows = []
+        if user_token_id:
+            # По одной строке заказа на каждый nm_id токена (subject, brand, article) — одним запросом
+            rows = (
+                session2.query(
+                    Order.nm_id,
+                    Order.subject,
+                    Order.brand,
+                    Order.supplier_article,
+                    Order.techSize,
+                )
+                .filter(Order.token_id == user_token_id, Order.nm_id.isnot(None))
+                .distinct(Order.nm_id)
+                .all()
+            )
+    finally:
+        # upsert_products ходит в сеть — соединение с БД на это время не держим
         session2.close()
+
+    if not user_token_id:
         await message.answer("Не найдено ни одного nm_id (нет token_id).")
         return
 
-    # Фильтруем заказы (Order.token_id == db_user2.token_id)
-    nm_ids = (
-        session2.query(Order.nm_id)
-        .filter(Order.token_id == db_user2.token_id)
-        .distinct()
-        .all()
-    )
-
-    upsert_count = 0
-    first_nm_id = None
-    for (nm_id,) in nm_ids:
-        if first_nm_id is None:
-            first_nm_id = nm_id
-        # Нужно ещё узнать subject, brand, article — см. у вас в report_details
-        # Или можно взять "заглушки", если в report_details есть поля subject_name, ...
-        detail = session.query(Order).filter_by(nm_id=nm_id).first()
-        if detail:
-            token_id = detail.token_id
-            subject_name = detail.subject or "unknown"
-            brand_name = detail.brand or "unknown"  # если нужно
-            supplier_article = detail.supplier_article or "unknown"  # если нужно
-            techSize = detail.techSize
-
-            await upsert_product(nm_id, subject_name, brand_name, supplier_article, token_id, techSize)
-            upsert_count += 1
+    first_nm_id = rows[0][0] if rows else None
+    items = [
+        {
+            "nm_id": nm_id,
+            "subject_name": subject or "unknown",
+            "brand_name": brand or "unknown",  # если нужно
+            "supplier_article": supplier_article or "unknown",  # если нужно
+            "token_id": user_token_id,
+            "techSize": tech_size,
+        }
+        for nm_id, subject, brand, supplier_article, tech_size in rows
+    ]
+
+    # Товары продавца загружаем параллельно, картинки — через core/image_pipeline.py
+    await upsert_products(items)
+    upsert_count = len(items)
 
     if first_nm_id:
         url = f"https://www.wildberries.ru/catalog/{first_nm_id}/detail.aspx"
@@ -128,12 +139,15 @@ async def process_token(message: types.Message, state: FSMContext):
         if store_link:
             # Открываем новую сессию, чтобы сохранить user.store_link
             session2 = SessionLocal()
-            db_user2 = session2.query(User).filter_by(telegram_id=str(message.from_user.id)).first()
+            try:
+                db_user2 = session2.query(User).filter_by(telegram_id=str(message.from_user.id)).first()
+                if db_user2:
+                    db_user2.store_link = store_link
+                    session2.commit()
+            finally:
+                session2.close()
             if db_user2:
-                db_user2.store_link = store_link
-                session2.commit()
                 await message.answer(f"Ссылка на магазин получена и сохранена:\n{store_link}")
-            session2.close()
         else:
             await message.answer("Не удалось получить ссылку на магазин.")
     else:
@@ -6,6 +6,7 @@ from db.database import SessionLocal
 from db.models import DestCity, User
 from core.sub import get_user_role
 from handlers.generate_report_day_handler import generate_excel_report_for_date
+from core.report_service import ReportError
 from states.user_state import user_states
 # Предположим, ваша функция поиска:
 # from core.search_tracker import find_article_in_search_async
@@ -124,7 +125,7 @@ async def handle_user_message(message: types.Message):
         # Генерация отчета
         try:
             excel_bytes = await generate_excel_report_for_date(token_id, day_str)
-        except ValueError as e:
+        except (ValueError, ReportError) as e:
             await message.answer(f"Ошибка при формировании отчёта: {e}")
             return
 
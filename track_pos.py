@@ -1,21 +1,21 @@
 import asyncio
-import aiohttp
 import datetime
 from typing import Dict, Any
 from db.database import SessionLocal
 from db.models import PopularRequest, TrackedPosition
+from core.search_governor import get_search_governor
+from core.http_client import close_http_client
+from db.copy_writer import CopyWriter
+from core.crawl_state import start_or_resume_run, completed_units, mark_units_done, finish_run, unit_key
 
 API_BASE_URL = "https://search.wb.ru/exactmatch/ru/common/v9/search"
 MAX_PAGES = 30
-SEMAPHORE_LIMIT = 10  # Параллелим до 3 запросов на WB одновременно
+CRAWL_KIND = "popular"  # вид обхода в crawl_runs (core/crawl_state.py)
 
 async def fetch_page(
-    session_http: aiohttp.ClientSession,
     q_text: str,
     page_num: int,
-    request_counter: Dict[str, int],
     page_progress: Dict[str, int],
-    sem: asyncio.Semaphore
 ) -> Dict[str, Any]:
     """
     Запрашивает WB по странице page_num для поискового запроса q_text.
@@ -26,10 +26,8 @@ async def fetch_page(
         'error': str | None
       }
 
-    - request_counter: словарь-хранилище глобального счётчика запросов (для паузы каждые 200k).
     - page_progress: словарь { 'pages_done': int }, для отображения общего прогресса (по страницам).
-    - total_pages: общее количество страниц, которые нужно отработать (для %).
-    - sem: asyncio.Semaphore(...) чтобы ограничить параллелизм (до 3).
+    Темп, паузы после 429 и повторы — на общем регуляторе core/search_governor.py.
     """
 
     params = {
@@ -49,45 +47,31 @@ async def fetch_page(
         "uv": "AQEAAQIACLpVufFF5jwMPnxB..."  # Пример
     }
 
-    async with sem:  # не более 3 корутин одновременно
-        try:
-            # Проверка на паузу каждые 200k запросов
-            if request_counter["count"] > 0 and request_counter["count"] % 200_000 == 0:
-                print("Достигнуто 200k запросов, делаем паузу на 15 минут...")
-                await asyncio.sleep(15 * 60)
+    data = await get_search_governor().get_json(
+        API_BASE_URL, params, timeout=10, label=f"'{q_text}' page={page_num}"
+    )
 
-            request_counter["count"] += 1
-            async with session_http.get(API_BASE_URL, params=params, timeout=10) as resp:
-                if resp.status != 200:
-                    msg = f"[page={page_num}] Статус {resp.status}, пропускаем."
-                    print(msg)
-                    # Увеличим счётчик страниц, даже если ошибка
-                    page_progress["pages_done"] += 1
-                    return {"page": page_num, "products": [], "error": msg}
+    # Увеличим счётчик страниц, даже если ошибка
+    page_progress["pages_done"] += 1
 
-                # Игнорируем Content-Type text/plain и парсим как JSON
-                data = await resp.json(content_type=None)
-                products = data.get("data", {}).get("products", [])
+    if data is None:
+        msg = f"[page={page_num}] Не удалось получить страницу, пропускаем."
+        print(msg)
+        return {"page": page_num, "products": [], "error": msg}
 
-                # Увеличиваем счётчик обработанных страниц
-                page_progress["pages_done"] += 1
-
-                return {"page": page_num, "products": products, "error": None}
-
-        except Exception as exc:
-            msg = f"[page={page_num}] Ошибка запроса: {exc}"
-            print(msg)
-            page_progress["pages_done"] += 1
-            return {"page": page_num, "products": [], "error": msg}
+    products = data.get("data", {}).get("products", [])
+    return {"page": page_num, "products": products, "error": None}
 
 
 async def track_positions():
     """
     Асинхронно:
       - Перебирает popular_request
-      - Для каждого запроса q_text делает до 30 запросов (по страницам) ПАРАЛЛЕЛЬНО (до 3 одновременно)
+      - Для каждого запроса q_text делает до 30 запросов (по страницам) ПАРАЛЛЕЛЬНО
+        (темп задаёт общий регулятор core/search_governor.py)
       - Сохраняет позиции в TrackedPosition (page, position).
       - Показывает прогресс и по запросам, и по страницам.
+      - После падения/перезапуска продолжает незавершённый обход (core/crawl_state.py).
     """
 
     db_sess = SessionLocal()
@@ -100,69 +84,78 @@ async def track_positions():
 
     print(f"Найдено {total_requests} запросов для трекинга.")
     
-    # Общий счётчик запросов, чтобы делать паузу каждые 200k
-    request_counter = {"count": 0}
     # Прогресс по страницам
     total_pages = total_requests * MAX_PAGES
     page_progress = {"pages_done": 0}
 
-    async with aiohttp.ClientSession() as session_http:
-        # Идём по всем popular_request
-        for idx_request, popular_req in enumerate(all_requests, start=5262):
-            q_id = popular_req.id
-            q_text = popular_req.query_text
-
-            # Прогресс по запросам
-            percent_requests = (idx_request / total_requests) * 100
-            print(f"\n[{idx_request}/{total_requests}] ({percent_requests:.1f}%) => query_id={q_id}, text='{q_text}'")
-
-            sem = asyncio.Semaphore(SEMAPHORE_LIMIT)
-
-            # Создаём таски на все страницы (1..MAX_PAGES)
-            tasks = []
-            for page_num in range(1, MAX_PAGES + 1):
-                coro = fetch_page(session_http, q_text, page_num,
-                                  request_counter, page_progress, total_pages, sem)
-                tasks.append(asyncio.create_task(coro))
-
-            # Запускаем все страницы для данного запроса параллельно
-            results = await asyncio.gather(*tasks)
-
-            # Записываем позиции в БД
-            need_commit = False
-            for res in results:
-                page = res["page"]
-                error = res["error"]
-                products = res["products"]
-
-                # Если ошибка, пропускаем
-                if error:
-                    continue
-
-                # Пустая страница => вряд ли есть товары
-                if not products:
+    # Прошлый обход не доработал — продолжаем его, выполненные запросы пропускаем
+    run = start_or_resume_run(db_sess, CRAWL_KIND, total_units=total_requests)
+    done_units = completed_units(db_sess, run)
+    writer = CopyWriter(db_sess, TrackedPosition, ("query_id", "product_id", "page", "position", "check_dt"))
+    if done_units:
+        print(f"Продолжаем обход id={run.id}: уже выполнено {len(done_units)} запросов.")
+        page_progress["pages_done"] = len(done_units) * MAX_PAGES
+
+    # Идём по всем popular_request
+    for idx_request, popular_req in enumerate(all_requests, start=1):
+        q_id = popular_req.id
+        q_text = popular_req.query_text
+
+        if unit_key(q_id) in done_units:
+            continue
+
+        # Прогресс по запросам
+        percent_requests = (idx_request / total_requests) * 100
+        print(f"\n[{idx_request}/{total_requests}] ({percent_requests:.1f}%) => query_id={q_id}, text='{q_text}' "
+              f"(страниц {page_progress['pages_done']}/{total_pages})")
+
+        # Создаём таски на все страницы (1..MAX_PAGES)
+        tasks = []
+        for page_num in range(1, MAX_PAGES + 1):
+            coro = fetch_page(q_text, page_num, page_progress)
+            tasks.append(asyncio.create_task(coro))
+
+        # Запускаем все страницы для данного запроса параллельно
+        results = await asyncio.gather(*tasks)
+
+        # Записываем позиции в БД (через COPY, без ORM-объекта на строку)
+        check_dt = datetime.datetime.utcnow()
+        for res in results:
+            page = res["page"]
+            error = res["error"]
+            products = res["products"]
+
+            # Если ошибка, пропускаем
+            if error:
+                continue
+
+            # Пустая страница => вряд ли есть товары
+            if not products:
+                continue
+
+            for pos_idx, product in enumerate(products, start=1):
+                pid = product.get("id")
+                if pid is None:
                     continue
+                await writer.put((q_id, pid, page, pos_idx, check_dt))
 
-                for pos_idx, product in enumerate(products, start=1):
-                    pid = product.get("id")
-                    if pid is None:
-                        continue
-                    db_sess.add(TrackedPosition(
-                        query_id=q_id,
-                        product_id=pid,
-                        page=page,
-                        position=pos_idx,
-                        check_dt=datetime.datetime.utcnow()
-                    ))
-                    need_commit = True
-
-            if need_commit:
-                db_sess.commit()
+        # Хвост — до коммита, отметка о запросе — в одной транзакции с его позициями
+        await writer.flush_async()
+        mark_units_done(db_sess, run, [unit_key(q_id)])
+        db_sess.commit()
 
+    finish_run(db_sess, run)
     db_sess.close()
     print("\nТрекинг позиций завершён.")
 
 
+async def _main():
+    try:
+        await track_positions()
+    finally:
+        await close_http_client()
+
+
 # Пример одиночного запуска
 if __name__ == "__main__":
-    asyncio.run(track_positions())
+    asyncio.run(_main())
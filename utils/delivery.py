@@ -0,0 +1,267 @@
+# utils/delivery.py
+import asyncio
+import time
+from collections import deque
+from dataclasses import dataclass
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramRetryAfter, TelegramForbiddenError
+from aiogram.types import BufferedInputFile
+
+from config import DELIVERY_WORKERS, DELIVERY_GLOBAL_RATE, DELIVERY_CHAT_INTERVAL, DELIVERY_MAX_ATTEMPTS
+from utils.logger import logger
+
+
+@dataclass
+class OutgoingMessage:
+    """
+    Одно исходящее сообщение.
+    photo — url или BufferedInputFile; если фото не ушло, отправляем текстом
+    fallback_text (по умолчанию "url\\ntext").
+    document — BufferedInputFile (например, Excel-отчёт), text идёт в подпись.
+    """
+    chat_id: int | str
+    text: str
+    photo: str | BufferedInputFile | None = None
+    document: BufferedInputFile | None = None
+    parse_mode: str | None = "HTML"
+    fallback_text: str | None = None
+    attempts: int = 0
+
+
+class _Pacer:
+    """
+    Выдаёт «слоты» не чаще одного раза в interval секунд.
+    Слот резервируется сразу, поэтому параллельные воркеры не толкаются.
+    """
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.next_at = 0.0
+
+    def reserve(self) -> float:
+        now = time.monotonic()
+        slot = max(now, self.next_at)
+        self.next_at = slot + self.interval
+        return slot - now
+
+    def pause(self, seconds: float) -> None:
+        """Никаких отправок ближайшие seconds секунд (RetryAfter от Telegram)."""
+        self.next_at = max(self.next_at, time.monotonic() + seconds)
+
+
+class DeliveryQueue:
+    """
+    Очередь отправки в Telegram с несколькими воркерами.
+
+    • общий лимит на бота (global_rate сообщений в секунду);
+    • лимит на чат (не чаще одного сообщения в chat_interval секунд);
+    • TelegramRetryAfter — ждём сколько сказали и повторяем;
+    • фото не отправилось — отправляем текстом;
+    • пользователь заблокировал бота — сообщение выбрасываем.
+
+    У каждого чата своя очередь сообщений, а воркеры берут из общей очереди
+    готовых чатов — тех, чей слот уже наступил. Чат, которому ещё рано
+    (лимит на чат, пауза после ошибки), ставится туда по таймеру и воркеров
+    не занимает: пачка сообщений в один чат не задерживает остальные чаты.
+    В работе у чата всегда не больше одного сообщения, поэтому порядок
+    сообщений внутри чата сохраняется.
+
+    Продюсеры вызывают enqueue() и сразу возвращаются к своей работе.
+    """
+
+    def __init__(self,
+                 bot: Bot,
+                 workers: int = DELIVERY_WORKERS,
+                 global_rate: float = DELIVERY_GLOBAL_RATE,
+                 chat_interval: float = DELIVERY_CHAT_INTERVAL,
+                 max_attempts: int = DELIVERY_MAX_ATTEMPTS):
+        self.bot = bot
+        self.workers = max(1, workers)
+        self.chat_interval = chat_interval
+        self.max_attempts = max(1, max_attempts)
+        self._ready: asyncio.Queue[str] = asyncio.Queue()           # чаты, которым можно отправлять
+        self._pending: dict[str, deque[OutgoingMessage]] = {}       # чат -> его неотправленные сообщения
+        self._unfinished = 0
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._global = _Pacer(1.0 / global_rate if global_rate > 0 else 0)
+        self._chats: dict[str, _Pacer] = {}
+        self._tasks: list[asyncio.Task] = []
+
+    # ---------- управление ----------
+
+    def start(self) -> None:
+        if self._tasks:
+            return
+        self._tasks = [
+            asyncio.create_task(self._worker(i), name=f"tg-delivery-{i}")
+            for i in range(self.workers)
+        ]
+        logger.info(f"[delivery] запущено воркеров: {self.workers}")
+
+    async def stop(self, drain_timeout: float = 10) -> None:
+        """Даём очереди дослать сообщения (не дольше drain_timeout) и гасим воркеров."""
+        if not self._tasks:
+            return
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout=drain_timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"[delivery] не успели отправить {self.qsize()} сообщений до остановки")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def enqueue(self, msg: OutgoingMessage) -> None:
+        key = str(msg.chat_id)
+        self._unfinished += 1
+        self._idle.clear()
+        pending = self._pending.get(key)
+        if pending is not None:
+            # Чат уже в работе — сообщение уйдёт следом за предыдущими
+            pending.append(msg)
+            return
+        self._pending[key] = deque([msg])
+        self._schedule(key)
+
+    def qsize(self) -> int:
+        return self._unfinished
+
+    # ---------- отправка ----------
+
+    def _chat_pacer(self, chat_id) -> _Pacer:
+        key = str(chat_id)
+        pacer = self._chats.get(key)
+        if pacer is None:
+            # Не даём словарю бесконечно расти: выкидываем давно молчавшие чаты
+            if len(self._chats) > 10_000:
+                now = time.monotonic()
+                self._chats = {k: p for k, p in self._chats.items() if p.next_at > now - 60}
+            pacer = self._chats[key] = _Pacer(self.chat_interval)
+        return pacer
+
+    def _schedule(self, key: str) -> None:
+        """Ставит чат в очередь готовых к его слоту (сразу или по таймеру)."""
+        delay = self._chat_pacer(key).reserve()
+        if delay > 0:
+            asyncio.get_running_loop().call_later(delay, self._ready.put_nowait, key)
+        else:
+            self._ready.put_nowait(key)
+
+    def _finish(self) -> None:
+        self._unfinished -= 1
+        if self._unfinished == 0:
+            self._idle.set()
+
+    async def _worker(self, num: int) -> None:
+        while True:
+            key = await self._ready.get()
+            pending = self._pending[key]
+            msg = pending[0]
+            try:
+                done = await self._deliver(msg)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.exception(f"[delivery] воркер {num}: ошибка отправки в {msg.chat_id}: {e}")
+                done = True
+
+            if done:
+                pending.popleft()
+                self._finish()
+            if pending:
+                self._schedule(key)
+            else:
+                del self._pending[key]
+
+    async def _send(self, msg: OutgoingMessage) -> None:
+        if msg.document is not None:
+            await self.bot.send_document(chat_id=msg.chat_id, document=msg.document,
+                                         caption=msg.text or None, parse_mode=msg.parse_mode)
+        elif msg.photo is not None:
+            await self.bot.send_photo(chat_id=msg.chat_id, photo=msg.photo,
+                                      caption=msg.text, parse_mode=msg.parse_mode)
+        else:
+            await self.bot.send_message(chat_id=msg.chat_id, text=msg.text, parse_mode=msg.parse_mode)
+
+    async def _deliver(self, msg: OutgoingMessage) -> bool:
+        """
+        Одна попытка отправки. True — с сообщением покончено (ушло, выброшено
+        или кончились попытки), False — повторить позже (пауза чата уже выставлена).
+        """
+        chat_pacer = self._chat_pacer(msg.chat_id)
+        msg.attempts += 1
+
+        # Слот чата уже наступил (см. _schedule), ждём только общий
+        await asyncio.sleep(self._global.reserve())
+
+        try:
+            await self._send(msg)
+            return True
+        except TelegramRetryAfter as e:
+            logger.warning(f"[delivery] RetryAfter {e.retry_after} сек (chat {msg.chat_id})")
+            self._global.pause(e.retry_after)
+            chat_pacer.pause(e.retry_after)
+            msg.attempts -= 1  # флуд-контроль не считаем за неудачную попытку
+            return False
+        except TelegramForbiddenError as e:
+            logger.info(f"[delivery] чат {msg.chat_id} недоступен ({e}), пропускаем")
+            return True
+        except Exception as e:
+            if msg.photo is not None:
+                # Фото не ушло (битый url и т.п.) — шлём текстом
+                print(f"Фото не отправилось пользователю {msg.chat_id}: {e}. Отправляем текстом.")
+                if not isinstance(msg.photo, BufferedInputFile):
+                    msg.fallback_text = msg.fallback_text or f"{msg.photo}\n{msg.text}"
+                msg.text = msg.fallback_text or msg.text
+                msg.photo = None
+            else:
+                print(f"Ошибка при отправке пользователю {msg.chat_id} (попытка {msg.attempts}): {e}")
+                chat_pacer.pause(min(2 ** msg.attempts, 30))
+
+        if msg.attempts >= self.max_attempts:
+            logger.error(f"[delivery] сообщение в {msg.chat_id} не отправлено за {self.max_attempts} попыток")
+            return True
+        return False
+
+
+_queue: DeliveryQueue | None = None
+
+
+def start_delivery(bot: Bot) -> DeliveryQueue:
+    """Создаёт и запускает общую очередь. Вызывается из bot.py (или лениво из enqueue_message)."""
+    global _queue
+    if _queue is None:
+        _queue = DeliveryQueue(bot)
+    _queue.start()
+    return _queue
+
+
+async def stop_delivery(drain_timeout: float = 10) -> None:
+    global _queue
+    if _queue is not None:
+        await _queue.stop(drain_timeout)
+        _queue = None
+
+
+def enqueue_message(bot: Bot,
+                    chat_id: int | str,
+                    text: str,
+                    photo: str | BufferedInputFile | None = None,
+                    document: BufferedInputFile | None = None,
+                    parse_mode: str | None = "HTML",
+                    fallback_text: str | None = None) -> None:
+    """
+    Ставит сообщение в очередь и сразу возвращает управление.
+    Если очередь ещё не запущена — запускает её для этого бота.
+    """
+    queue = _queue if _queue is not None else start_delivery(bot)
+    queue.enqueue(OutgoingMessage(
+        chat_id=chat_id,
+        text=text,
+        photo=photo,
+        document=document,
+        parse_mode=parse_mode,
+        fallback_text=fallback_text,
+    ))
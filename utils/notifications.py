@@ -1,16 +1,21 @@
 from collections import defaultdict
 from aiogram import Bot
-from core.wildberries_api import get_promo_text_card
+from core.card_cache import get_card_cache, get_cached_card
+from core.thumbnails import get_thumbnails, THUMB_DAILY
+from core.report_service import ReportError
+from core.token_executor import run_for_tokens
+from core.report_cache import cached_report, get_snapshot_cache
 from db.database import SessionLocal
 from sqlalchemy import func, desc
 from db.models import Order, ReportDetails, Stock, User, Product, UserWarehouse, Token, UserBoxType, Media, LogisticTariff, Sale
 from aiogram.types import BufferedInputFile
+from utils.delivery import enqueue_message
+from config import DAILY_REPORT_PREBUILD_HOUR, DAILY_REPORT_PREBUILD_MINUTE
 from openpyxl import Workbook
 from openpyxl.worksheet.worksheet import Worksheet
 from openpyxl.styles import PatternFill, Border, Side, Alignment
 from openpyxl.utils import get_column_letter
 from openpyxl.drawing.image import Image as ExcelImage
-from PIL import Image as PILImage
 import io
 import datetime
 from datetime import timedelta
@@ -177,6 +182,102 @@ def count_today_sales_by_nmId(nm_id: int) -> int:
     session.close()
     return result
 
+def build_nm_stats(session, nm_ids, with_sales: bool = False, with_commission: bool = False, days: int = 90) -> dict[int, dict]:
+    """
+    Пакетный аналог count_today_*/get_*_last_3_months/get_total_stock/
+    get_average_daily_*/get_latest_commision для всех nm_id пачки событий сразу.
+
+    Вместо нескольких запросов на каждое событие — по одному GROUP BY запросу
+    на таблицу (orders, stocks, при необходимости sales и report_details),
+    независимо от размера пачки.
+
+    Возвращает {nm_id: {...}} со значениями:
+      today_orders, orders_3m, avg_daily_orders, today_cancels, cancels_3m,
+      today_sales, sales_3m, avg_daily_sales, total_stock, commission.
+    Для nm_id без данных — нули.
+    """
+    nm_ids = {nm_id for nm_id in nm_ids if nm_id}
+    stats = {
+        nm_id: {
+            "today_orders": 0, "orders_3m": 0, "avg_daily_orders": 0,
+            "today_cancels": 0, "cancels_3m": 0,
+            "today_sales": 0, "sales_3m": 0, "avg_daily_sales": 0,
+            "total_stock": 0, "commission": 0,
+        }
+        for nm_id in nm_ids
+    }
+    if not nm_ids:
+        return stats
+
+    today = datetime.date.today()
+    date_from = today - datetime.timedelta(days=days)
+
+    # 1) Заказы/отказы: одной выборкой с условными счётчиками
+    order_rows = (
+        session.query(
+            Order.nm_id,
+            func.count(Order.id).filter(func.date(Order.date) == today),
+            func.count(Order.id),
+            func.count(Order.id).filter(Order.is_cancel == False),
+            func.count(Order.id).filter(Order.is_cancel == True, func.date(Order.date) == today),
+            func.count(Order.id).filter(Order.is_cancel == True),
+        )
+        .filter(Order.nm_id.in_(nm_ids))
+        .filter(Order.date >= date_from)
+        .group_by(Order.nm_id)
+        .all()
+    )
+    for nm_id, today_cnt, total_cnt, not_cancel_cnt, today_cancel_cnt, cancel_cnt in order_rows:
+        st = stats[nm_id]
+        st["today_orders"] = today_cnt
+        st["orders_3m"] = total_cnt
+        st["avg_daily_orders"] = not_cancel_cnt / days if days > 0 else 0
+        st["today_cancels"] = today_cancel_cnt
+        st["cancels_3m"] = cancel_cnt
+
+    # 2) Остатки по всем складам
+    stock_rows = (
+        session.query(Stock.nm_id, func.sum(Stock.quantity))
+        .filter(Stock.nm_id.in_(nm_ids))
+        .group_by(Stock.nm_id)
+        .all()
+    )
+    for nm_id, total_quantity in stock_rows:
+        stats[nm_id]["total_stock"] = total_quantity or 0
+
+    # 3) Выкупы
+    if with_sales:
+        sale_rows = (
+            session.query(
+                Sale.nm_id,
+                func.count(Sale.id).filter(func.date(Sale.date) == today),
+                func.count(Sale.id),
+            )
+            .filter(Sale.nm_id.in_(nm_ids))
+            .filter(Sale.date >= date_from)
+            .group_by(Sale.nm_id)
+            .all()
+        )
+        for nm_id, today_cnt, total_cnt in sale_rows:
+            st = stats[nm_id]
+            st["today_sales"] = today_cnt
+            st["sales_3m"] = total_cnt
+            st["avg_daily_sales"] = total_cnt / days if days > 0 else 0
+
+    # 4) Комиссия из последней строки отчёта (DISTINCT ON по nm_id)
+    if with_commission:
+        commission_rows = (
+            session.query(ReportDetails.nm_id, ReportDetails.commission_percent)
+            .filter(ReportDetails.nm_id.in_(nm_ids))
+            .distinct(ReportDetails.nm_id)
+            .order_by(ReportDetails.nm_id, desc(ReportDetails.order_dt))
+            .all()
+        )
+        for nm_id, commission in commission_rows:
+            stats[nm_id]["commission"] = commission or 0
+
+    return stats
+
 async def notify_new_orders(bot: Bot, orders_data: list[dict]):
 
     """
@@ -214,6 +315,11 @@ async def notify_new_orders(bot: Bot, orders_data: list[dict]):
     )
     # ──────────────────────────────────────────────────────────────────────────────
 
+    # Счётчики по всем nm_id пачки — несколькими GROUP BY запросами
+    nm_stats = build_nm_stats(session, (o.get("nm_id") for o in orders_data))
+    # Недостающие карточки догружаем в фоне одной пачкой nm=a;b;c
+    get_card_cache().want(o.get("nm_id") for o in orders_data)
+
     # Для каждого token_id достаём пользователей, рассылаем
     for token_id, orders_list in grouped_orders.items():
 
@@ -244,14 +350,18 @@ async def notify_new_orders(bot: Bot, orders_data: list[dict]):
 
             warehouse_name = order.get("warehouseName", "N/A")
             region_name = order.get("regionName", "N/A")
-            today_count = count_today_orders_by_nmId(nm_id)
-            orders_last_3_months = get_orders_last_3_months(nm_id)
-            total_stocks = get_total_stock(nm_id)
-            avg_daily_usage = get_average_daily_orders(nm_id, days=90)  # например, 30 дней
+            st = nm_stats.get(nm_id, {})
+            today_count = st.get("today_orders", 0)
+            orders_last_3_months = st.get("orders_3m", 0)
+            total_stocks = st.get("total_stock", 0)
+            avg_daily_usage = st.get("avg_daily_orders", 0)  # за 90 дней
             days_coverage = total_stocks / avg_daily_usage if avg_daily_usage > 0 else 0
             delivery_rub = tariffs_by_wh.get(warehouse_name)
-            promo_text = await get_promo_text_card(nm_id)
-            promo_line = promo_text if promo_text else ""
+            # Карточка из кэша (core/card_cache.py) — в сеть отсюда не ходим
+            card = get_cached_card(nm_id)
+            promo_line = card["promo_text"]
+            if card["rating"] is not None:
+                rating, reviews = card["rating"], card["feedbacks"]
 
             caption_text = (
                 f"🆕🛍<b>Новый заказ!</b>🛍\n"
@@ -271,29 +381,13 @@ async def notify_new_orders(bot: Bot, orders_data: list[dict]):
                 f"📦 <b>Остаток:</b> {total_stocks} шт. ⏳ <b>Хватит примерно на:</b> {days_coverage:.0f} дн."
             )
 
-            # Рассылаем всем пользователям, у которых token_id == token_id
+            # Рассылаем всем пользователям, у которых token_id == token_id.
+            # Только ставим в очередь (utils/delivery.py) — цикл опроса не ждёт Telegram
             for user in users:
-                chat_id = user.telegram_id
-                try:
-                    if picture_url:
-                        # Пытаемся отправить фото
-                        try:
-                            await bot.send_photo(
-                                chat_id=chat_id,
-                                photo=picture_url,
-                                caption=caption_text,
-                                parse_mode="HTML"
-                            )
-                        except Exception:
-                            fallback_text = f"{picture_url}\n{caption_text}"
-                            await bot.send_message(chat_id=chat_id, text=fallback_text)
-                    else:
-                        await bot.send_message(chat_id=chat_id, text=caption_text, parse_mode="HTML")
-                except Exception as e:
-                    print(f"Ошибка при отправке пользователю {chat_id}: {e}")
+                enqueue_message(bot, user.telegram_id, caption_text, photo=picture_url or None)
 
     session.close()
-    print("Уведомления о новых заказах отправлены!")
+    print("Уведомления о новых заказах поставлены в очередь!")
 
 async def notify_new_sales(bot: Bot, sales_data: list[dict]):
     """
@@ -321,6 +415,14 @@ async def notify_new_sales(bot: Bot, sales_data: list[dict]):
     )
     # ──────────────────────────────────────────────────────────────────────────────
 
+    # Счётчики по всем nm_id пачки — несколькими GROUP BY запросами
+    nm_stats = build_nm_stats(
+        session, (s.get("nm_id") for s in sales_data),
+        with_sales=True, with_commission=True,
+    )
+    # Недостающие карточки догружаем в фоне одной пачкой nm=a;b;c
+    get_card_cache().want(s.get("nm_id") for s in sales_data)
+
     for token_id, sales_list in grouped_by_token.items():
         # Ищем пользователей, у кого user.token_id == token_id
         users = session.query(User).filter_by(
@@ -342,12 +444,13 @@ async def notify_new_sales(bot: Bot, sales_data: list[dict]):
             base_price = float(sale.get("price_with_disc", 0.0))
             spp_value = float(sale.get("spp", 0.0))
             final_price = calc_price_with_spp(base_price, spp_value)
-            commision = get_latest_commision(nm_id)
+            st = nm_stats.get(nm_id, {})
+            commision = st.get("commission", 0)
 
-            today_count = count_today_sales_by_nmId(nm_id)
-            sales_last_3_months = get_sales_last_3_months(nm_id)
-            total_stocks = get_total_stock(nm_id)
-            avg_daily_usage = get_average_daily_sales(nm_id, days=90)  # например, 90 дней
+            today_count = st.get("today_sales", 0)
+            sales_last_3_months = st.get("sales_3m", 0)
+            total_stocks = st.get("total_stock", 0)
+            avg_daily_usage = st.get("avg_daily_sales", 0)  # за 90 дней
             days_coverage = total_stocks / avg_daily_usage if avg_daily_usage > 0 else 0
             delivery_rub = tariffs_by_wh.get(warehouse_name)
 
@@ -356,8 +459,11 @@ async def notify_new_sales(bot: Bot, sales_data: list[dict]):
             image_url = sale.get("image_url", None)
 
             nm_id_link = f"<a href='https://www.wildberries.ru/catalog/{nm_id}/detail.aspx'>{nm_id}</a>"
-            promo_text = await get_promo_text_card(nm_id)
-            promo_line = promo_text if promo_text else ""
+            # Карточка из кэша (core/card_cache.py) — в сеть отсюда не ходим
+            card = get_cached_card(nm_id)
+            promo_line = card["promo_text"]
+            if card["rating"] is not None:
+                rating, reviews = card["rating"], card["feedbacks"]
 
 
             caption_text = (
@@ -379,29 +485,12 @@ async def notify_new_sales(bot: Bot, sales_data: list[dict]):
                 f"📦 <b>Остаток:</b> {total_stocks} шт. ⏳ <b>Хватит примерно на:</b> {days_coverage:.0f} дн."
             )
 
-            # Рассылаем всем пользователям
+            # Рассылаем всем пользователям (через очередь отправки)
             for user in users:
-                chat_id = user.telegram_id
-                try:
-                    if image_url:
-                        try:
-                            await bot.send_photo(
-                                chat_id=chat_id,
-                                photo=image_url,
-                                caption=caption_text,
-                                parse_mode="HTML"
-                            )
-                        except Exception:
-                            fallback_text = f"{image_url}\n{caption_text}"
-                            await bot.send_message(chat_id=chat_id, text=fallback_text, parse_mode="HTML")
-                    else:
-                        await bot.send_message(chat_id=chat_id, text=caption_text, parse_mode="HTML")
-
-                except Exception as e:
-                    print(f"Ошибка при отправке пользователю {chat_id}: {e}")
+                enqueue_message(bot, user.telegram_id, caption_text, photo=image_url or None)
 
     session.close()
-    print("Уведомления о новых выкупах отправлены!")
+    print("Уведомления о новых выкупах поставлены в очередь!")
 
 async def notify_cancellations(bot: Bot, orders_data: list[dict]):
     """
@@ -433,6 +522,11 @@ async def notify_cancellations(bot: Bot, orders_data: list[dict]):
     )
     # ──────────────────────────────────────────────────────────────────────────────
 
+    # Счётчики по всем nm_id пачки — несколькими GROUP BY запросами
+    nm_stats = build_nm_stats(session, (o.get("nm_id") for o in cancels_data))
+    # Недостающие карточки догружаем в фоне одной пачкой nm=a;b;c
+    get_card_cache().want(o.get("nm_id") for o in cancels_data)
+
     for token_id, cancels_list in grouped_orders.items():
         # Можно в БД завести отдельный флаг notify_cancels, или использовать notify_orders.
         # Допустим, используем тот же notify_orders=True.
@@ -459,15 +553,18 @@ async def notify_cancellations(bot: Bot, orders_data: list[dict]):
             region_name = order.get("regionName", "N/A")
 
             delivery_rub = tariffs_by_wh.get(warehouse_name)
-            # Если хотим считать "количество отказов за сегодня" — нужна отдельная функция:
-            today_count = count_today_cancels_by_nmId(nm_id)  # Дописать при желании
-            cancels_last_3_months = get_cancels_last_3_months(nm_id)  # тоже доп. функция
-            total_stocks = get_total_stock(nm_id)
-            avg_daily_usage = get_average_daily_orders(nm_id, days=90)
+            st = nm_stats.get(nm_id, {})
+            today_count = st.get("today_cancels", 0)
+            cancels_last_3_months = st.get("cancels_3m", 0)
+            total_stocks = st.get("total_stock", 0)
+            avg_daily_usage = st.get("avg_daily_orders", 0)
             days_coverage = total_stocks / avg_daily_usage if avg_daily_usage > 0 else 0
 
-            promo_text = await get_promo_text_card(nm_id)
-            promo_line = promo_text if promo_text else ""
+            # Карточка из кэша (core/card_cache.py) — в сеть отсюда не ходим
+            card = get_cached_card(nm_id)
+            promo_line = card["promo_text"]
+            if card["rating"] is not None:
+                rating, reviews = card["rating"], card["feedbacks"]
 
             caption_text = (
                 f"🛑<b>Новый отказ!</b>🛑\n"
@@ -486,27 +583,12 @@ async def notify_cancellations(bot: Bot, orders_data: list[dict]):
                 f"📦 <b>Остаток:</b> {total_stocks} шт. ⏳ <b>Хватит примерно на:</b> {days_coverage:.0f} дн."
             )
 
+            # Через очередь отправки
             for user in users:
-                chat_id = user.telegram_id
-                try:
-                    if picture_url:
-                        try:
-                            await bot.send_photo(
-                                chat_id=chat_id,
-                                photo=picture_url,
-                                caption=caption_text,
-                                parse_mode="HTML"
-                            )
-                        except Exception:
-                            fallback_text = f"{picture_url}\n{caption_text}"
-                            await bot.send_message(chat_id=chat_id, text=fallback_text)
-                    else:
-                        await bot.send_message(chat_id=chat_id, text=caption_text, parse_mode="HTML")
-                except Exception as e:
-                    print(f"Ошибка при отправке пользователю {chat_id}: {e}")
+                enqueue_message(bot, user.telegram_id, caption_text, photo=picture_url or None)
 
     session.close()
-    print("Уведомления об отказах отправлены!")
+    print("Уведомления об отказах поставлены в очередь!")
 
 async def notify_free_incomes(bot: Bot, incomes_data: list[dict]):
     """
@@ -610,14 +692,10 @@ async def notify_free_incomes(bot: Bot, incomes_data: list[dict]):
 
             # 6) Рассылаем всем пользователям
             for user in users:
-                chat_id = user.telegram_id
-                try:
-                    await bot.send_message(chat_id=chat_id, text=msg_text, parse_mode="HTML")
-                except Exception as e:
-                    print(f"Ошибка при отправке пользователю {chat_id}: {e}")
+                enqueue_message(bot, user.telegram_id, msg_text)
 
     session.close()
-    print("Уведомления о бесплатных поставках отправлены.")
+    print("Уведомления о бесплатных поставках поставлены в очередь.")
 
 async def notify_free_acceptance(bot: Bot, new_coeffs: list[dict]):
     """
@@ -633,6 +711,15 @@ async def notify_free_acceptance(bot: Bot, new_coeffs: list[dict]):
 
     session = SessionLocal()
 
+    # Картинка для уведомления одна на всех — достаём один раз
+    media_record = session.query(Media).order_by(Media.created_at.desc()).first()
+    photo_file = None
+    if media_record and media_record.resize_img:
+        photo_file = BufferedInputFile(               # ← оборачиваем bytes
+            media_record.resize_img,
+            filename="free_acceptance.png"           # произвольное имя
+        )
+
     for token_id, coeff_list in grouped_by_token.items():
         # 1) Ищем всех пользователей, у которых token_id=token_id
         users = session.query(User).filter_by(token_id=token_id).all()
@@ -696,44 +783,29 @@ async def notify_free_acceptance(bot: Bot, new_coeffs: list[dict]):
                 # Никто не подписан
                 continue
 
-            # 5) Отправляем уведомление
+            # 5) Отправляем уведомление (через очередь; без картинки — обычным сообщением)
             for user_obj in target_users:
-                media_record = session.query(Media).order_by(Media.created_at.desc()).first()
-                if media_record and media_record.resize_img:
-                    # Отправляем фотографию с подписью
-                    try:
-                        photo_file = BufferedInputFile(               # ← оборачиваем bytes
-                            media_record.resize_img,
-                            filename="free_acceptance.png"           # произвольное имя
-                        )
-                        await bot.send_photo(
-                            chat_id=user_obj.telegram_id,
-                            photo=photo_file,
-                            caption=msg_text,
-                            parse_mode="HTML"
-                        )
-                    except Exception as exc:
-                        print(f"Ошибка при отправке фотографии пользователю {user_obj.telegram_id}: {exc}")
-                else:
-                    # Если изображение не найдено, отправляем обычное сообщение
-                    try:
-                        await bot.send_message(
-                            chat_id=user_obj.telegram_id,
-                            text=msg_text,
-                            parse_mode="HTML"
-                        )
-                    except Exception as exc:
-                        print(f"Ошибка при отправке сообщения пользователю {user_obj.telegram_id}: {exc}")
+                enqueue_message(bot, user_obj.telegram_id, msg_text, photo=photo_file)
 
     session.close()
-    print("Уведомления о бесплатной приёмке отправлены.")
+    print("Уведомления о бесплатной приёмке поставлены в очередь.")
 
                 
 
 async def generate_daily_excel_report(token_id: int) -> bytes:
+    """
+    Ежедневный отчёт по токену: собирается в процессе-сборщике
+    (core/report_service.py), повторно — из кэша (core/report_cache.py).
+    См. build_daily_excel_report.
+    """
+    return await cached_report("daily", token_id, datetime.date.today().isoformat(), build_daily_excel_report, token_id)
+
+
+def build_daily_excel_report(token_id: int, until: str | None = None) -> bytes:
     """
     Формирует Excel-отчёт (в виде байтов) за последние сутки
     по конкретному токену (т.е. для конкретного пользователя).
+    until — конец периода (ISO, UTC); по умолчанию текущий момент.
     Включает следующие листы:
       1) Заказы
       2) Выкупы
@@ -744,7 +816,7 @@ async def generate_daily_excel_report(token_id: int) -> bytes:
     session = SessionLocal()
 
     # Формируем период "последние сутки" (24 часа)
-    now = datetime.datetime.utcnow()
+    now = datetime.datetime.fromisoformat(until) if until else datetime.datetime.utcnow()
     date_from = now - datetime.timedelta(days=1)
 
     # Подготовим Workbook
@@ -773,6 +845,8 @@ async def generate_daily_excel_report(token_id: int) -> bytes:
             cell.fill = PatternFill(start_color="FF00B050", end_color="FF00B050", fill_type="solid")
 
     row_index = 2
+    # Готовые миниатюры 80x80 (core/thumbnails.py) — одним запросом на лист
+    thumbs = get_thumbnails(session, (o.nm_id for o in orders), THUMB_DAILY)
     for o in orders:
         # В ячейки B..G запишем основные данные
         # А (колонка A) — под картинку
@@ -792,24 +866,11 @@ async def generate_daily_excel_report(token_id: int) -> bytes:
         ws_orders.cell(row=row_index, column=6, value=warehouse_val) # F
         ws_orders.cell(row=row_index, column=7, value=region_val)    # G
 
-        # Достаём product для вставки картинки (если есть)
-        product = session.query(Product).filter_by(nm_id=o.nm_id, token_id=token_id).first()
-        if product and product.resize_img:
+        # Картинка — готовая миниатюра 80x80
+        thumb = thumbs.get(o.nm_id)
+        if thumb:
             try:
-                # Открываем как PIL image
-                img_data = io.BytesIO(product.resize_img)
-                pil_img = PILImage.open(img_data)
-                # Приводим к 80×80
-                pil_img = pil_img.resize((80, 80), PILImage.Resampling.LANCZOS)
-
-                # Превращаем обратно в BytesIO
-                new_img_bytes = io.BytesIO()
-                pil_img = pil_img.convert("RGB")
-                pil_img.save(new_img_bytes, format="JPEG", optimize=True, quality=70)
-                new_img_bytes.seek(0)
-
-                # Создаём объект рисунка для openpyxl
-                excel_img = ExcelImage(new_img_bytes)
+                excel_img = ExcelImage(io.BytesIO(thumb))
                 # Добавляем на лист, в ячейку A{row_index}
                 cell_position = f"A{row_index}"
                 ws_orders.add_image(excel_img, cell_position)
@@ -847,6 +908,8 @@ async def generate_daily_excel_report(token_id: int) -> bytes:
             cell.fill = PatternFill(start_color="FF92D050", end_color="FF92D050", fill_type="solid")
 
     row_index = 2
+    # Готовые миниатюры 80x80 (core/thumbnails.py) — одним запросом на лист
+    thumbs = get_thumbnails(session, (s.nm_id for s in sales), THUMB_DAILY)
     for s in sales:
         # В ячейки B..G запишем основные данные
         # А (колонка A) — под картинку
@@ -866,24 +929,11 @@ async def generate_daily_excel_report(token_id: int) -> bytes:
         ws_sales.cell(row=row_index, column=6, value=warehouse_val) # F
         ws_sales.cell(row=row_index, column=7, value=region_val)    # G
 
-        # Достаём product для вставки картинки (если есть)
-        product = session.query(Product).filter_by(nm_id=s.nm_id, token_id=token_id).first()
-        if product and product.resize_img:
+        # Картинка — готовая миниатюра 80x80
+        thumb = thumbs.get(s.nm_id)
+        if thumb:
             try:
-                # Открываем как PIL image
-                img_data = io.BytesIO(product.resize_img)
-                pil_img = PILImage.open(img_data)
-                # Приводим к 80×80
-                pil_img = pil_img.resize((80, 80), PILImage.Resampling.LANCZOS)
-
-                # Превращаем обратно в BytesIO
-                new_img_bytes = io.BytesIO()
-                pil_img = pil_img.convert("RGB")
-                pil_img.save(new_img_bytes, format="JPEG", optimize=True, quality=70)
-                new_img_bytes.seek(0)
-
-                # Создаём объект рисунка для openpyxl
-                excel_img = ExcelImage(new_img_bytes)
+                excel_img = ExcelImage(io.BytesIO(thumb))
                 # Добавляем на лист, в ячейку A{row_index}
                 cell_position = f"A{row_index}"
                 ws_sales.add_image(excel_img, cell_position)
@@ -921,6 +971,8 @@ async def generate_daily_excel_report(token_id: int) -> bytes:
             cell.fill = PatternFill(start_color="FFFF0000", end_color="FFFF0000", fill_type="solid")
 
     row_index = 2
+    # Готовые миниатюры 80x80 (core/thumbnails.py) — одним запросом на лист
+    thumbs = get_thumbnails(session, (c.nm_id for c in cancels), THUMB_DAILY)
     for c in cancels:
         date_val = c.date.strftime("%Y-%m-%d %H:%M:%S") if c.date else ""
         nm_id = c.nm_id or ""
@@ -940,24 +992,11 @@ async def generate_daily_excel_report(token_id: int) -> bytes:
         ws_cancels.cell(row=row_index, column=8, value=is_cancel_val) # H
 
 
-        # Достаём product для вставки картинки (если есть)
-        product = session.query(Product).filter_by(nm_id=c.nm_id, token_id=token_id).first()
-        if product and product.resize_img:
+        # Картинка — готовая миниатюра 80x80
+        thumb = thumbs.get(c.nm_id)
+        if thumb:
             try:
-                # Открываем как PIL image
-                img_data = io.BytesIO(product.resize_img)
-                pil_img = PILImage.open(img_data)
-                # Приводим к 80×80
-                pil_img = pil_img.resize((80, 80), PILImage.Resampling.LANCZOS)
-
-                # Превращаем обратно в BytesIO
-                new_img_bytes = io.BytesIO()
-                pil_img = pil_img.convert("RGB")
-                pil_img.save(new_img_bytes, format="JPEG", optimize=True, quality=70)
-                new_img_bytes.seek(0)
-
-                # Создаём объект рисунка для openpyxl
-                excel_img = ExcelImage(new_img_bytes)
+                excel_img = ExcelImage(io.BytesIO(thumb))
                 # Добавляем на лист, в ячейку A{row_index}
                 cell_position = f"A{row_index}"
                 ws_cancels.add_image(excel_img, cell_position)
@@ -997,6 +1036,7 @@ async def generate_daily_excel_report(token_id: int) -> bytes:
 
     # --- берём уникальные товары, у которых вообще есть остатки/продажи ---
     nm_ids = {s.nm_id for s in session.query(Stock).filter(Stock.token_id == token_id)}
+    thumbs = get_thumbnails(session, nm_ids, THUMB_DAILY)
     for nm_id in nm_ids:
 
         # 1. продаваемость по складам
@@ -1055,11 +1095,10 @@ async def generate_daily_excel_report(token_id: int) -> bytes:
             ws_ship.cell(row=row_idx, column=8, value=need_ship)      # H
 
             # картинка в A-колонку, если есть
-            if prod and prod.resize_img:
+            thumb = thumbs.get(nm_id)
+            if thumb:
                 try:
-                    img = PILImage.open(io.BytesIO(prod.resize_img)).resize((80, 80))
-                    buf = io.BytesIO(); img.save(buf, "PNG"); buf.seek(0)
-                    ws_ship.add_image(ExcelImage(buf), f"A{row_idx}")
+                    ws_ship.add_image(ExcelImage(io.BytesIO(thumb)), f"A{row_idx}")
                     ws_ship.row_dimensions[row_idx].height = 60
                 except Exception:
                     pass
@@ -1105,43 +1144,122 @@ async def generate_daily_excel_report(token_id: int) -> bytes:
     output.seek(0)
     return output.getvalue()
 
+def _daily_report_cutoff() -> datetime.datetime:
+    """
+    Конец периода ежедневной рассылки: сегодня в DAILY_REPORT_PREBUILD_HOUR:MINUTE
+    (местное время). Одинаков для сборки заранее и для отправки в 9:00,
+    поэтому в 9:00 находится именно собранный заранее файл.
+    """
+    return datetime.datetime.combine(
+        datetime.date.today(),
+        datetime.time(DAILY_REPORT_PREBUILD_HOUR, DAILY_REPORT_PREBUILD_MINUTE),
+    )
+
+
+def _daily_report_recipients(session) -> dict[int, list[int]]:
+    """token_id -> telegram_id всех пользователей токена, подписанных на ежедневный отчёт."""
+    rows = (
+        session.query(User.token_id, User.telegram_id)
+        .filter(User.token_id.isnot(None))
+        .filter(User.notify_daily_report == True)
+        .all()
+    )
+    recipients = defaultdict(list)
+    for token_id, telegram_id in rows:
+        recipients[token_id].append(telegram_id)
+    return dict(recipients)
+
+
+async def _build_daily_reports(token_ids: list[int], cutoff: datetime.datetime) -> dict[int, bytes]:
+    """
+    Ежедневный отчёт каждого токена за 24 часа до cutoff — один на токен
+    (сколько бы пользователей на нём ни было), параллельно. Отчёт — «снимок»:
+    лежит в кэше снимков (core/report_cache.py) под ключом (токен, cutoff),
+    поэтому повторный вызов с тем же cutoff берёт готовый файл.
+    """
+    if not token_ids:
+        return {}
+    session = SessionLocal()
+    try:
+        tokens = session.query(Token).filter(Token.id.in_(token_ids)).all()
+    finally:
+        session.close()
+
+    until = cutoff.astimezone(datetime.timezone.utc).replace(tzinfo=None)  # отчёт считает время в UTC
+
+    async def _build(token_obj: Token):
+        try:
+            report_bytes = await get_snapshot_cache().get_or_build(
+                "daily", token_obj.id, cutoff.isoformat(),
+                build_daily_excel_report, token_obj.id, until.isoformat(),
+                watermark="snapshot",
+            )
+            return token_obj.id, report_bytes
+        except ReportError as e:
+            print(f"Ежедневный отчёт для token_id={token_obj.id} не собран: {e}")
+            return token_obj.id, None
+
+    results = await run_for_tokens(
+        tokens, _build,
+        timeout=None,  # время сборки ограничивает сам ReportService
+        label="daily_report",
+    )
+    return {token_id: data for token_id, data in results if data is not None}
+
+
+async def prebuild_daily_reports():
+    """
+    Шедулер вызывает заранее (DAILY_REPORT_PREBUILD_HOUR, до 9:00), пока бот
+    почти не загружен: отчёты собираются в кэш снимков, а в 9:00 их остаётся
+    только разослать.
+    """
+    print("Собираем ежедневные отчёты заранее...")
+    session = SessionLocal()
+    try:
+        recipients = _daily_report_recipients(session)
+    finally:
+        session.close()
+
+    reports = await _build_daily_reports(list(recipients), _daily_report_cutoff())
+    print(f"Собрано ежедневных отчётов: {len(reports)} из {len(recipients)}")
+
+
 async def send_daily_reports_to_all_users(bot: Bot):
     """
     Функция, которую вызовет шедулер (либо вручную) раз в день.
-    Проходимся по всем пользователям, у которых есть token_id,
-    генерируем Excel и отправляем им в личку.
+    Берём всех пользователей, у которых есть token_id, группируем по токену
+    и рассылаем каждому отчёт его токена за 24 часа до _daily_report_cutoff():
+    собранный заранее (prebuild_daily_reports), а если его нет — собираем
+    сейчас, по разу на токен. Темп отправки держит очередь utils/delivery.py.
     """
     print("Отправляем ежедневные отчёты всем пользователям...")
     session = SessionLocal()
-    users = (
-        session.query(User)
-        .filter(User.token_id.isnot(None))
-        .filter(User.notify_daily_report == True)
-        .all()
-        )
+    try:
+        recipients = _daily_report_recipients(session)
+    finally:
+        session.close()
 
-    for user in users:
-        token_id = user.token_id
-        telegram_id = user.telegram_id
+    cutoff = _daily_report_cutoff()
+    reports = await _build_daily_reports(list(recipients), cutoff)
 
-        # Генерируем Excel-отчёт (в виде байтов)
-        report_bytes = await generate_daily_excel_report(token_id)
+    period_start = cutoff - datetime.timedelta(days=1)
+    caption_text = f"Ежедневный отчёт за 24 часа: {period_start:%d.%m %H:%M} — {cutoff:%d.%m %H:%M}"
 
-        # Длина файла
-        file_size = len(report_bytes)
-        # Если нужно, проверяем, не больше ли 50MB (лимит Телеграма)
-        if file_size > 50_000_000:
-            # Предположим, просто отправим сообщение об ошибке:
-            await bot.send_message(chat_id=telegram_id, text="Отчёт слишком большой.")
+    for token_id, telegram_ids in recipients.items():
+        report_bytes = reports.get(token_id)
+        if report_bytes is None:
             continue
 
-        # Формируем документ
-        doc = BufferedInputFile(file=report_bytes, filename="daily_report.xlsx")
-        # Отправляем пользователю
-        caption_text = "Ежедневный отчёт за последние 24 часа"
-        await bot.send_document(chat_id=telegram_id, document=doc, caption=caption_text)
+        # Проверяем, не больше ли 50MB (лимит Телеграма)
+        if len(report_bytes) > 50_000_000:
+            for telegram_id in telegram_ids:
+                enqueue_message(bot, telegram_id, "Отчёт слишком большой.")
+            continue
 
-    session.close()
+        # Отправляем каждому пользователю токена (через очередь)
+        for telegram_id in telegram_ids:
+            doc = BufferedInputFile(file=report_bytes, filename="daily_report.xlsx")
+            enqueue_message(bot, telegram_id, caption_text, document=doc)
 
 async def notify_subscription_expiring(bot: Bot):
     """
@@ -1182,10 +1300,7 @@ async def notify_subscription_expiring(bot: Bot):
             )
             for user in users:
                 if user.telegram_id:
-                    try:
-                        await bot.send_message(chat_id=user.telegram_id, text=text, parse_mode="HTML")
-                    except Exception as e:
-                        print(f"Warn send failed to {user.telegram_id}: {e}")
+                    enqueue_message(bot, user.telegram_id, text)
 
         # --- (B) Истекшие подписки → переводим на free и уведомляем ---
         tokens_expired = (
@@ -1216,10 +1331,7 @@ async def notify_subscription_expiring(bot: Bot):
                 )
                 for user in users:
                     if user.telegram_id:
-                        try:
-                            await bot.send_message(chat_id=user.telegram_id, text=text, parse_mode="HTML")
-                        except Exception as e:
-                            print(f"Expire send failed to {user.telegram_id}: {e}")
+                        enqueue_message(bot, user.telegram_id, text)
 
     finally:
         session.close()
\ No newline at end of file